@@ -2,8 +2,8 @@
 Example script for creating a MAVS vehicle and driving it
 with the W-A-S-D keys.
 '''
-import time
 import mavspy.mavs as mavs
+from sim_scheduler import Scheduler
 
 # Set the path to the mavs data folder
 mavs_data_path = mavs.mavs_data_path
@@ -49,48 +49,45 @@ lidar.SetOffset([0.0, 0.0, 1.830],[1.0,0.0,0.0,0.0])
 
 # Now start the simulation main loop
 dt = 1.0/30.0 # time step, seconds
-n = 0 # loop counter
-while (True):
-    # tw0 is for timing purposes used later
-    tw0 = time.time()
+# The scheduler runs each task at its own rate, and 
+# makes sure the sim doesn't run faster than real time,
+# which makes it hard to drive
+scheduler = Scheduler(dt, real_time_factor=1.0)
 
+def update_vehicle(t, task_dt):
     # Get the driving command
     dc = drive_cam.GetDrivingCommand()
-
     # Update the vehicle with the driving command
-    veh.Update(env, dc.throttle, dc.steering, dc.braking, dt)
-
-    # Get the current vehicle position
-    position = veh.GetPosition()
-    orientation = veh.GetOrientation()
-
-    # Update the camera sensors at 10 Hz
-    # Each sensor calls three functions
-    # "SetPose" aligns the sensor with the current vehicle position,
-    # the offset is automatically included.
-    # "Update" creates new sensor data, point cloud or image
-    # "Display" is optional and opens a real-time display window
-    if n%3==0:
-        # Update the drive camera at 10 Hz
-        drive_cam.SetPose(position,orientation)
-        drive_cam.Update(env,dt)
-        drive_cam.Display()
-        lidar.SetPose(position,orientation)
-        lidar.Update(env,dt)
-        lidar.Display()
+    veh.Update(env, dc.throttle, dc.steering, dc.braking, task_dt)
     # uncomment the following lines to get some state
     # variables for the vehicle 
     #long_acc = veh.GetLongitudinalAcceleration()
     #lat_acc = veh.GetLateralAcceleration()
     #front_left_normal_force = veh.GetTireNormalForce(0)
 
-    # Update the loop counter
-    n = n+1
+# Each sensor calls three functions
+# "SetPose" aligns the sensor with the current vehicle position,
+# the offset is automatically included.
+# "Update" creates new sensor data, point cloud or image
+# "Display" is optional and opens a real-time display window
+def update_camera(t, task_dt):
+    drive_cam.SetPose(veh.GetPosition(),veh.GetOrientation())
+    drive_cam.Update(env,dt)
+    drive_cam.Display()
+
+def update_lidar(t, task_dt):
+    lidar.SetPose(veh.GetPosition(),veh.GetOrientation())
+    lidar.Update(env,dt)
+    lidar.Display()
+
+scheduler.add_task('vehicle', update_vehicle)
+# Update the sensors at 10 Hz
+scheduler.add_task('drive_cam', update_camera, rate=10.0)
+scheduler.add_task('lidar', update_lidar, rate=10.0)
 
-    # The following lines ensure that the sim
-    # doesn't run faster than real time, which 
-    # makes it hard to drive
-    tw1 = time.time()
-    wall_dt = tw1-tw0
-    if (wall_dt<dt):
-        time.sleep(dt-wall_dt)
\ No newline at end of file
+# Drive until the script is stopped with Ctrl-C
+try:
+    scheduler.run()
+except KeyboardInterrupt:
+    pass
+print(scheduler.report())
@@ -1,10 +1,27 @@
-''' 
+'''
 Script for generating labeled lidar and camera data.
 Shows how to load a MAVS scene, add it to an environment,
 and generate labeled sensor data.
+
+By default each frame is saved as separate files. To append
+the frames to shard files with an index instead (see
+shard_dataset.py), run this example with 'shards':
+python mavs_lidar_trainer_example.py shards
 '''
+import os
 import random
+import sys
 import mavspy.mavs as mavs
+import pcd_io
+import shard_dataset
+
+# save frames as 'files' or 'shards'
+output_format = 'files'
+if (len(sys.argv)>1):
+    output_format = sys.argv[1]
+shards = None
+if output_format=='shards':
+    shards = shard_dataset.ShardWriter('lidar_shards', max_shard_bytes=256*1024*1024)
 
 # Create the lidar and set the offset
 lidar = mavs.MavsLidar('OS1')
@@ -24,7 +41,8 @@ waypoints.Load(mavs.mavs_data_path+'/waypoints/vehicle2_pos_1.vprp')
 # Create a MAVS environment and add the scene to it
 env = mavs.MavsEnvironment()
 env.SetScene(scene)
-env.SetTurbidity(float(random.randrange(2,7)))
+turbidity = float(random.randrange(2,7))
+env.SetTurbidity(turbidity)
 
 # loop over all the poses in the waypoints list
 for i in range(waypoints.num_waypoints):
@@ -39,3 +57,20 @@ for i in range(waypoints.num_waypoints):
     lidar.SaveLabeledPcd('labeled_lidar'+str(i).zfill(4)+'.pcd')
     lidar.DisplayPerspective()
     lidar.SaveProjectedLidarImage('labeled_lidar'+str(i).zfill(4)+'.bmp')
+    if shards is not None:
+        # move the frame into the shards, with the cloud as binary PCD
+        pcd_name = 'labeled_lidar'+str(i).zfill(4)+'.pcd'
+        bmp_name = 'labeled_lidar'+str(i).zfill(4)+'.bmp'
+        with open(bmp_name,'rb') as f:
+            projected = f.read()
+        shards.add_frame(i, {'labeled_lidar.pcd':pcd_io.pcd_bytes(pcd_io.read_pcd(pcd_name)),
+                             'labeled_lidar.bmp':projected},
+                         pose={'position':[float(v) for v in current_position],
+                               'orientation':[float(v) for v in current_orient]},
+                         environment={'Turbidity':turbidity})
+        os.remove(pcd_name)
+        os.remove(bmp_name)
+
+if shards is not None:
+    shards.close()
+    print(shards.report())
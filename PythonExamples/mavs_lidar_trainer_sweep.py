@@ -0,0 +1,148 @@
+'''
+Generate the labeled lidar data of mavs_lidar_trainer_example.py with a
+pool of worker processes.
+
+Each pose of the waypoints is scanned independently, so the poses are
+split into chunks of consecutive waypoint indices and handed out to the
+workers. Each worker loads the lidar, scene and waypoints once and
+scans every pose of its chunks, writing the same files as the example
+(labeled_lidar0000.pcd and labeled_lidar0000.bmp).
+
+The example picks one random turbidity for the whole run. Here each
+pose gets its own turbidity from a random generator seeded with the
+sweep seed and the waypoint index, so the output doesn't depend on
+which worker scans a pose or in what order, and a run with one process
+gives the same files as a run with many.
+
+Files are written under a temporary name and renamed when complete.
+Running the sweep again skips the poses whose files are already there,
+so an interrupted sweep picks up where it stopped. The poses per second
+of each worker are reported at the end.
+
+Run this example with the number of worker processes, the chunk size
+and the seed as optional arguments:
+python mavs_lidar_trainer_sweep.py 8 16 0
+'''
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+
+mavs_scenefile = "/scenes/cube_scene.json"
+waypoints_file = '/waypoints/vehicle2_pos_1.vprp'
+
+def output_names(i):
+    '''The point cloud and image files of waypoint i, with the example's naming'''
+    name = 'labeled_lidar'+str(i).zfill(4)
+    return name+'.pcd', name+'.bmp'
+
+def pose_turbidity(seed, i):
+    '''Turbidity of waypoint i, between 2 and 6 as in the example'''
+    rng = np.random.default_rng([seed, i])
+    return float(rng.integers(2, 7))
+
+# The lidar, scene and environment of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker(seed):
+    '''Load the lidar, scene and waypoints once for this process'''
+    import mavspy.mavs as mavs
+    # Create the lidar and set the offset
+    lidar = mavs.MavsLidar('OS1')
+    lidar.SetOffset([0.0, 0.0, 1.830],[1.0,0.0,0.0,0.0])
+
+    # Select a scene and load it
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+mavs_scenefile)
+    scene.TurnOnLabeling()
+
+    waypoints = mavs.MavsWaypoints()
+    waypoints.Load(mavs.mavs_data_path+waypoints_file)
+
+    env = mavs.MavsEnvironment()
+    env.SetScene(scene)
+
+    worker['lidar'] = lidar
+    worker['scene'] = scene
+    worker['waypoints'] = waypoints
+    worker['env'] = env
+    worker['seed'] = seed
+
+def scan_pose(i):
+    '''Scan waypoint i and save its labeled point cloud and projected image'''
+    lidar = worker['lidar']
+    env = worker['env']
+    waypoints = worker['waypoints']
+    env.SetTurbidity(pose_turbidity(worker['seed'], i))
+    lidar.SetPose(waypoints.GetWaypoint(i),waypoints.GetOrientation(i))
+    lidar.Update(env,0.1)
+    lidar.AnnotateFrame(env)
+    lidar.AnalyzeCloud('labeled_lidar',i,False)
+    lidar.SetDisplayColorType('label')
+    # write to temporary names, so a file that exists is complete
+    pcd_name, bmp_name = output_names(i)
+    lidar.SaveLabeledPcd('tmp_'+pcd_name)
+    lidar.DisplayPerspective()
+    lidar.SaveProjectedLidarImage('tmp_'+bmp_name)
+    os.replace('tmp_'+pcd_name, pcd_name)
+    os.replace('tmp_'+bmp_name, bmp_name)
+
+def scan_chunk(indices):
+    '''Scan a chunk of waypoints, returns (process id, poses, seconds)'''
+    t0 = time.time()
+    for i in indices:
+        scan_pose(i)
+    return (os.getpid(), len(indices), time.time()-t0)
+
+def remaining_poses(num_waypoints):
+    '''Waypoint indices whose output files aren't all there yet'''
+    todo = []
+    for i in range(num_waypoints):
+        if not all(os.path.isfile(name) for name in output_names(i)):
+            todo.append(i)
+    return todo
+
+def run_sweep(num_waypoints, processes=None, chunk_size=16, seed=0):
+    '''Scan the waypoints that aren't done yet with a pool of workers'''
+    todo = remaining_poses(num_waypoints)
+    print('%d of %d poses already done, scanning %d' % (num_waypoints-len(todo), num_waypoints, len(todo)))
+    sys.stdout.flush()
+    if not todo:
+        return
+    chunks = [todo[k:k+chunk_size] for k in range(0, len(todo), chunk_size)]
+    workers = {}
+    done = 0
+    tw0 = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(seed,))
+    try:
+        for pid, poses, seconds in pool.imap_unordered(scan_chunk, chunks):
+            busy = workers.get(pid, (0, 0.0))
+            workers[pid] = (busy[0] + poses, busy[1] + seconds)
+            done = done + poses
+            print('%d/%d poses (%.1f poses/s)' % (done, len(todo), done/(time.time()-tw0)))
+            sys.stdout.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+    elapsed = time.time()-tw0
+    print('Scanned %d poses in %.1f s, %.2f poses/s' % (done, elapsed, done/elapsed))
+    print('worker    poses  busy (s)  poses/s')
+    for k, pid in enumerate(sorted(workers)):
+        poses, seconds = workers[pid]
+        print('%6d %8d %9.1f %8.2f' % (k, poses, seconds, poses/max(seconds, 1e-9)))
+
+if __name__ == "__main__":
+    processes = None # one per CPU
+    chunk_size = 16
+    seed = 0
+    if (len(sys.argv)>1):
+        processes = int(sys.argv[1])
+    if (len(sys.argv)>2):
+        chunk_size = int(sys.argv[2])
+    if (len(sys.argv)>3):
+        seed = int(sys.argv[3])
+    import mavspy.mavs as mavs
+    waypoints = mavs.MavsWaypoints()
+    waypoints.Load(mavs.mavs_data_path+waypoints_file)
+    run_sweep(waypoints.num_waypoints, processes, chunk_size, seed)
@@ -0,0 +1,216 @@
+'''
+Sweep the maximum speed on grade test over soil types, soil strengths
+and slopes to make a mobility map.
+
+mavs_max_vehicle_speed_example.py measures one (soil type, soil strength,
+slope) point per run. This script spreads the points over a pool of
+worker processes. Each worker loads the scene, vehicle and controller
+once and reuses them for all of its points, changing only the terrain
+with SetTerrainProperties and moving the vehicle back to the start.
+SetInitialPosition is only known to place a vehicle that hasn't been
+driven yet, so after the move the vehicle's speed and position are
+checked, and if it isn't at rest at the start a new vehicle is loaded
+for the point.
+
+Soil strength is only used for 'sand' and 'clay', so the other soil
+types are run once per slope.
+
+Results are appended to a CSV file, one row per point, as soon as each
+point finishes. If the sweep is interrupted, running it again with the
+same output file skips the points that are already in it. The columns
+can be read back as arrays with load_results.
+
+Run this example with the output file and the number of worker
+processes as optional arguments:
+python mavs_max_speed_sweep.py max_speed_sweep.csv 8
+'''
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from telemetry_detectors import SteadyStateDetector, StallDetector
+
+# The points of the sweep
+soil_types = ['dry', 'wet', 'snow', 'clay', 'sand']
+# soil strength in PSI - only used when soil_type is 'sand' or 'clay'
+soil_strengths = np.linspace(20.0, 500.0, 25)
+# fractional surface slope, 0.5 = 26.5 degrees, 1 = 45 degrees
+surface_slopes = np.linspace(0.0, 1.0, 21)
+
+# Simulation parameters, as in mavs_max_vehicle_speed_example.py
+dt = 1.0/100.0 # time step, seconds
+max_time = 100000.0 # give up after this much simulated time, seconds
+settle_time = 5.0 # don't check for the max speed before this time, seconds
+window_time = 2.0 # window for the steady state and stall detectors, seconds
+reset_tolerance = 0.01 # largest speed (m/s) and distance from the start (m) after a reset
+veh_file = 'forester_2017_rp3d_tires.json'
+
+columns = ['soil_type', 'soil_strength', 'surface_slope', 'max_speed', 'sim_time', 'wall_time']
+
+def sweep_points():
+    '''All (soil_type, soil_strength, surface_slope) points of the sweep'''
+    points = []
+    for soil_type in soil_types:
+        strengths = soil_strengths if soil_type in ['clay', 'sand'] else [0.0]
+        for soil_strength in strengths:
+            for surface_slope in surface_slopes:
+                points.append((soil_type, round(float(soil_strength), 6), round(float(surface_slope), 6)))
+    return points
+
+def point_key(soil_type, soil_strength, surface_slope):
+    return (soil_type, round(float(soil_strength), 6), round(float(surface_slope), 6))
+
+# The vehicle and controller of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker():
+    '''Load the scene, vehicle and controller once for this process'''
+    import mavspy.mavs as mavs
+    # Load a MAVS scene, the exact scene doesn't matter for this test
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path + "/scenes/cube_scene.json")
+
+    # Create a MAVS environment and add the scene to it
+    env = mavs.MavsEnvironment()
+    env.SetScene(scene.scene)
+
+    # Load waypoints and create controller to follow them
+    # These waypoints are just a straight line
+    waypoints = mavs.MavsWaypoints()
+    waypoints.Load(mavs.mavs_data_path+'/waypoints/x_axis_points.vprp')
+    waypoints.FillIn(0.5)
+    controller = mavs.MavsVehicleController()
+    controller.SetDesiredSpeed(200.0) # m/s, set to an absurdly high number
+    controller.SetSteeringScale(2.35)
+    controller.SetWheelbase(3.8) # meters
+    controller.SetMaxSteerAngle(0.855) # radians
+    controller.TurnOnLooping()
+
+    worker['scene'] = scene
+    worker['env'] = env
+    worker['veh'] = load_vehicle()
+    worker['path'] = waypoints.GetWaypoints2D()
+    worker['controller'] = controller
+
+def load_vehicle():
+    '''Create and load a MAVS vehicle'''
+    import mavspy.mavs as mavs
+    veh = mavs.MavsRp3d()
+    veh.Load(mavs.mavs_data_path+'/vehicles/rp3d_vehicles/' + veh_file)
+    return veh
+
+def at_start(veh):
+    '''True if the vehicle is stopped at the origin'''
+    position = veh.GetPosition()
+    return abs(veh.GetSpeed()) < reset_tolerance and np.hypot(position[0], position[1]) < reset_tolerance
+
+def reset_vehicle():
+    '''Move the worker's vehicle back to the start and stop it, returns the vehicle
+
+    Loads a new vehicle if the old one isn't at rest at the start
+    afterwards, and raises RuntimeError if the new one isn't either.
+    '''
+    veh = worker['veh']
+    for attempt in range(2):
+        veh.SetInitialPosition(0.0, 0.0, 0.0) # in global ENU
+        veh.SetInitialHeading(0.0) # in radians
+        veh.Update(worker['env'], 0.0, 0.0, 1.0, 0.000001)
+        if at_start(veh):
+            worker['veh'] = veh
+            return veh
+        print('Vehicle at %s moving at %.3f m/s after the reset, loading a new one' %
+              (str(veh.GetPosition()), veh.GetSpeed()))
+        sys.stdout.flush()
+        veh = load_vehicle()
+    raise RuntimeError('a newly loaded vehicle is not at rest at the start')
+
+def measure_max_speed(point):
+    '''Run the max speed on grade test for one point with this worker's vehicle
+
+    Returns the point with the max speed in m/s, the simulated time and
+    the wall time it took.
+    '''
+    soil_type, soil_strength, surface_slope = point
+    tw0 = time.time()
+    env = worker['env']
+    controller = worker['controller']
+
+    # Move the vehicle back to the start and stop it, then change the terrain
+    veh = reset_vehicle()
+    veh.SetTerrainProperties(terrain_type='sloped',terrain_param1=surface_slope, terrain_param2=0.0, soil_type=soil_type, soil_strength=soil_strength)
+    controller.SetDesiredPath(worker['path'])
+
+    # see mavs_max_vehicle_speed_example.py
+    steady = SteadyStateDetector(dt, window_time=window_time, slope_tolerance=0.05, min_time=settle_time)
+    stall = StallDetector(dt, threshold=0.1, window_time=window_time, min_time=settle_time)
+    time_elapsed = 0.0
+    max_speed = float('nan')
+    while (time_elapsed<max_time):
+        controller.SetCurrentState(veh.GetPosition()[0],veh.GetPosition()[1], veh.GetSpeed(),veh.GetHeading())
+        dc = controller.GetDrivingCommand(dt)
+        veh.Update(env, dc.throttle, dc.steering, dc.braking, dt)
+        time_elapsed = time_elapsed + dt
+        # the max speed is reached when the vehicle stops speeding up
+        new_velocity = veh.GetSpeed()
+        if steady.update(new_velocity):
+            max_speed = steady.value()
+            break
+        if stall.update(new_velocity):
+            max_speed = 0.0
+            break
+    return (soil_type, soil_strength, surface_slope, max_speed, time_elapsed, time.time()-tw0)
+
+def load_results(filename):
+    '''The results in filename as a dictionary of column arrays'''
+    data = dict((c, []) for c in columns)
+    if not os.path.isfile(filename):
+        return dict((c, np.array(v)) for c, v in data.items())
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            for c in columns:
+                data[c].append(row[c] if c == 'soil_type' else float(row[c]))
+    return dict((c, np.array(v)) for c, v in data.items())
+
+def run_sweep(filename, processes=None, points=None):
+    '''Run the points that aren't in filename yet and append their results'''
+    if points is None:
+        points = sweep_points()
+    done = load_results(filename)
+    finished = set(point_key(*p) for p in zip(done['soil_type'], done['soil_strength'], done['surface_slope']))
+    todo = [p for p in points if point_key(*p) not in finished]
+    print('%d of %d points already done, running %d' % (len(points)-len(todo), len(points), len(todo)))
+    sys.stdout.flush()
+    if not todo:
+        return
+
+    new_file = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+    tw0 = time.time()
+    with open(filename, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(columns)
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        try:
+            # each worker keeps its vehicle, so hand out points one at a time
+            for count, result in enumerate(pool.imap_unordered(measure_max_speed, todo, chunksize=1), 1):
+                writer.writerow(result)
+                f.flush()
+                rate = 60.0*count/(time.time()-tw0)
+                print('%d/%d %s %.1f psi slope %.2f: max speed %.2f m/s (%.1f points/minute)' %
+                      (count, len(todo), result[0], result[1], result[2], result[3], rate))
+                sys.stdout.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+    print('Finished %d points in %.1f minutes' % (len(todo), (time.time()-tw0)/60.0))
+
+if __name__ == "__main__":
+    output_file = 'max_speed_sweep.csv'
+    processes = None # one per CPU
+    if (len(sys.argv)>1):
+        output_file = sys.argv[1]
+    if (len(sys.argv)>2):
+        processes = int(sys.argv[2])
+    run_sweep(output_file, processes)
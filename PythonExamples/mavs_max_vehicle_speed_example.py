@@ -4,6 +4,7 @@ You can set the surface type, soil strength, and slope and get the max speed.
 '''
 import sys
 import mavspy.mavs as mavs
+from telemetry_detectors import SteadyStateDetector, StallDetector
 
 # Set the soil and terrain properties
 # soil type can be 'dry', 'wet', 'snow', 'clay', or 'sand'.
@@ -55,8 +56,12 @@ controller.TurnOnLooping()
 # Set up some simulation parameters
 dt = 1.0/100.0 # time step, seconds
 time_elapsed = 0.0 # total elapsed time, in seconds
-velocity = 0.0 # track the velocity of the vehicle to determine when max is reached
 n = 0 # loop counter
+# The max speed is reached when the speed stops changing over a 2 second
+# window, a few noisy steps on rough terrain don't end the test early
+steady = SteadyStateDetector(dt, window_time=2.0, slope_tolerance=0.05, min_time=5.0)
+# If the vehicle can't climb the slope the max speed is zero
+stall = StallDetector(dt, threshold=0.1, window_time=2.0, min_time=5.0)
 
 # start the simulation 
 while (time_elapsed<100000.0):
@@ -70,10 +75,12 @@ while (time_elapsed<100000.0):
 
     # check if max speed is reached
     new_velocity = veh.GetSpeed()
-    if (new_velocity<=velocity and time_elapsed>5.0):
-        print('Max Speed = '+str(velocity)+' m/s')
+    if steady.update(new_velocity):
+        print('Max Speed = '+str(steady.value())+' m/s')
+        sys.exit()
+    if stall.update(new_velocity):
+        print('Max Speed = 0.0 m/s, the vehicle stalled')
         sys.exit()
-    velocity = new_velocity
 
     ## Print the state every half second
     if n%50==0:
@@ -1,5 +1,8 @@
 '''
 Create a rough terrain from an input .bmp heightmap
+
+progressive_render.py renders the same image in batches on several
+processes, and stops once the image is no longer noisy.
 '''
 import mavspy.mavs as mavs
 
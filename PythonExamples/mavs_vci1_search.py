@@ -0,0 +1,256 @@
+'''
+Find the VCI1 of a vehicle with short constant-strength trials.
+
+mavs_vci1_test.py drives down a soil strength gradient and reports the
+strength where the vehicle slows below half the desired speed, so one
+run covers hundreds of meters and its accuracy depends on how steep the
+gradient is. This script runs short trials on flat clay of a constant
+strength instead. A trial passes once the speed is steady at half the
+desired speed or more, and fails once it stays below that, using the
+detectors in telemetry_detectors.py. A trial where neither happens
+within trial_time is run again from the start for twice as long, up
+to max_trial_time, where it is decided by the mean speed of its last
+window_time.
+
+Passing is assumed to be monotonic in soil strength, so the VCI1 is
+bracketed between a failing and a passing strength and the bracket is
+shrunk until it is smaller than the tolerance. With N worker processes
+each round runs N trials spread evenly inside the bracket, which
+shrinks it by a factor of N+1 per round (plain bisection for N=1).
+The trial outcome is pass/fail, so the search doesn't try a secant
+step, which would need a smooth function of strength.
+
+Each worker moves its vehicle back to the start with SetInitialPosition
+between trials. That is only known to place a vehicle that hasn't been
+driven yet, so the vehicle's speed and position are checked after the
+move, and a new vehicle is loaded if it isn't at rest at the start.
+
+For comparison, the gradient method of mavs_vci1_test.py is then run
+without rendering or real-time pacing, and the simulated and wall times
+of both methods are printed.
+
+Run this example with the tolerance in PSI and the number of worker
+processes as optional arguments:
+python mavs_vci1_search.py 1.0 4
+'''
+import math
+import multiprocessing
+import sys
+import time
+from collections import deque
+from telemetry_detectors import SteadyStateDetector, StallDetector
+
+desired_speed = 5.0 # m/s
+# strengths to start the bracket, in PSI
+min_strength = 0.0
+max_strength = 500.0
+dt = 1.0/30.0 # time step, seconds
+settle_time = 5.0 # don't check the speed before this time, seconds
+trial_time = 15.0 # longest constant-strength trial, seconds
+max_trial_time = 60.0 # longest trial when undecided trials are run again, seconds
+window_time = 1.0 # window for the stall and steady state detectors, seconds
+reset_tolerance = 0.01 # largest speed (m/s) and distance from the start (m) after a reset
+veh_file = 'forester_2017_rp3d_tires.json'
+
+# The vehicle and controller of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker():
+    '''Load the scene, vehicle and controller once for this process'''
+    import mavspy.mavs as mavs
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+"/scenes/surface_only.json")
+    env = mavs.MavsEnvironment()
+    env.SetScene(scene)
+
+    waypoints = mavs.MavsWaypoints()
+    waypoints.Load(mavs.mavs_data_path+'/waypoints/x_axis_points.vprp')
+    waypoints.FillIn(0.5)
+    controller = mavs.MavsVehicleController()
+    controller.SetDesiredSpeed(desired_speed) # m/s
+    controller.SetSteeringScale(2.35)
+    controller.SetWheelbase(3.8) # meters
+    controller.SetMaxSteerAngle(0.855) # radians
+    controller.TurnOnLooping()
+
+    worker['scene'] = scene
+    worker['env'] = env
+    worker['veh'] = load_vehicle()
+    worker['path'] = waypoints.GetWaypoints2D()
+    worker['controller'] = controller
+
+def load_vehicle():
+    '''Create and load a MAVS vehicle'''
+    import mavspy.mavs as mavs
+    veh = mavs.MavsRp3d()
+    veh.Load(mavs.mavs_data_path+'/vehicles/rp3d_vehicles/' + veh_file)
+    return veh
+
+def at_start(veh):
+    '''True if the vehicle is stopped at the origin'''
+    position = veh.GetPosition()
+    return abs(veh.GetSpeed()) < reset_tolerance and math.hypot(position[0], position[1]) < reset_tolerance
+
+def reset_vehicle():
+    '''Move the worker's vehicle back to the start and stop it
+
+    Loads a new vehicle if the old one isn't at rest at the start
+    afterwards, and raises RuntimeError if the new one isn't either.
+    '''
+    veh = worker['veh']
+    for attempt in range(2):
+        veh.SetInitialPosition(0.0, 0.0, 0.0) # in global ENU
+        veh.SetInitialHeading(0.0) # in radians
+        veh.Update(worker['env'], 0.0, 0.0, 1.0, 0.000001)
+        if at_start(veh):
+            worker['veh'] = veh
+            worker['controller'].SetDesiredPath(worker['path'])
+            return
+        print('Vehicle at %s moving at %.3f m/s after the reset, loading a new one' %
+              (str(veh.GetPosition()), veh.GetSpeed()))
+        sys.stdout.flush()
+        veh = load_vehicle()
+    raise RuntimeError('a newly loaded vehicle is not at rest at the start')
+
+def drive_step():
+    '''Advance the worker's vehicle by dt, returns the vehicle'''
+    veh = worker['veh']
+    controller = worker['controller']
+    controller.SetCurrentState(veh.GetPosition()[0],veh.GetPosition()[1],
+                                veh.GetSpeed(),veh.GetHeading())
+    dc = controller.GetDrivingCommand(dt)
+    veh.Update(worker['env'], dc.throttle, dc.steering, dc.braking, dt)
+    return veh
+
+def run_trial(soil_strength, max_time=trial_time, decide=False):
+    '''Drive on clay of constant strength, returns (strength, passed, simulated seconds)
+
+    The trial fails as soon as the speed stays below half the desired
+    speed for window_time after the settle time, and passes as soon
+    as the speed is steady above it. If neither happens within
+    max_time, passed is None, or if decide is True, whether the mean
+    speed of the last window_time is at least half the desired speed.
+    '''
+    reset_vehicle()
+    worker['veh'].SetTerrainProperties(terrain_type='flat',terrain_param1=0.0, terrain_param2=0.0, soil_type='clay', soil_strength=soil_strength)
+    stall = StallDetector(dt, threshold=0.5*desired_speed, window_time=window_time, min_time=settle_time)
+    steady = SteadyStateDetector(dt, window_time=window_time, slope_tolerance=0.05, min_time=settle_time)
+    time_elapsed = 0.0
+    while time_elapsed < max_time:
+        speed = drive_step().GetSpeed()
+        time_elapsed = time_elapsed + dt
+        if stall.update(speed):
+            return (soil_strength, False, time_elapsed)
+        if steady.update(speed) and steady.value() >= 0.5*desired_speed:
+            return (soil_strength, True, time_elapsed)
+    if decide:
+        return (soil_strength, steady.value() >= 0.5*desired_speed, time_elapsed)
+    return (soil_strength, None, time_elapsed)
+
+def run_round(pool, strengths):
+    '''Run a trial at each strength, running undecided ones again for longer
+
+    Returns (results, trials, simulated seconds), with results a list of
+    (strength, passed) in the order of strengths.
+    '''
+    passed = {}
+    trials = 0
+    sim_time = 0.0
+    todo = list(strengths)
+    max_time = trial_time
+    while todo:
+        decide = (max_time >= max_trial_time)
+        results = pool.starmap(run_trial, [(strength, max_time, decide) for strength in todo])
+        trials = trials + len(results)
+        sim_time = sim_time + sum(r[2] for r in results)
+        todo = []
+        for strength, result, t in results:
+            if result is None:
+                todo.append(strength)
+            else:
+                passed[strength] = result
+        if todo:
+            max_time = min(2.0*max_time, max_trial_time)
+            print('%d trials undecided, running them again for %.0f s' % (len(todo), max_time))
+            sys.stdout.flush()
+    return [(strength, passed[strength]) for strength in strengths], trials, sim_time
+
+def search_vci1(tolerance=1.0, processes=4):
+    '''Bracket the VCI1 to within tolerance PSI with rounds of parallel trials
+
+    Returns (vci1, low, high, trials, simulated seconds). vci1 is the
+    middle of the final bracket, or None if the bracket couldn't be
+    started because both ends pass or both fail.
+    '''
+    pool = multiprocessing.Pool(processes, initializer=init_worker)
+    try:
+        # check the ends of the starting bracket first
+        results, trials, sim_time = run_round(pool, [min_strength, max_strength])
+        if results[0][1] or not results[1][1]:
+            print('VCI1 is not between %.1f and %.1f psi' % (min_strength, max_strength))
+            return (None, min_strength, max_strength, trials, sim_time)
+        low = min_strength # fails
+        high = max_strength # passes
+        while high - low > tolerance:
+            step = (high - low)/(processes + 1)
+            strengths = [low + k*step for k in range(1, processes + 1)]
+            results, round_trials, round_time = run_round(pool, strengths)
+            trials = trials + round_trials
+            sim_time = sim_time + round_time
+            # the new bracket is between the strongest failure and the weakest pass
+            for strength, passed in results:
+                if passed:
+                    high = min(high, strength)
+                else:
+                    low = max(low, strength)
+            print('Bracket %.2f - %.2f psi after %d trials' % (low, high, trials))
+            sys.stdout.flush()
+        return (0.5*(low + high), low, high, trials, sim_time)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def gradient_vci1(soil_strength_max=100.0, soil_strength_fade=500.0):
+    '''The gradient method of mavs_vci1_test.py, without rendering or real-time pacing
+
+    Returns (vci1, simulated seconds), with vci1 the strength where
+    the stall detector's window started.
+    '''
+    if not worker:
+        init_worker()
+    reset_vehicle()
+    veh = worker['veh']
+    veh.SetTerrainProperties(terrain_type='flat',terrain_param1=0.0, terrain_param2=0.0, soil_type='clay', soil_strength=soil_strength_max)
+    stall = StallDetector(dt, threshold=0.5*desired_speed, window_time=window_time, min_time=settle_time)
+    window_strengths = deque(maxlen=stall.stats.window)
+    time_elapsed = 0.0
+    while True:
+        veh = drive_step()
+        time_elapsed = time_elapsed + dt
+        p = veh.GetPosition()
+        soil_strength_ = (soil_strength_max/soil_strength_fade)*(soil_strength_fade-p[0])
+        window_strengths.append(soil_strength_)
+        if stall.update(veh.GetSpeed()):
+            return (window_strengths[0], time_elapsed)
+        veh.SetTerrainProperties(terrain_type='flat',terrain_param1=0.0, terrain_param2=0.0, soil_type='clay', soil_strength=soil_strength_)
+
+if __name__ == "__main__":
+    tolerance = 1.0
+    processes = 4
+    if (len(sys.argv)>1):
+        tolerance = float(sys.argv[1])
+    if (len(sys.argv)>2):
+        processes = int(sys.argv[2])
+
+    tw0 = time.time()
+    vci1, low, high, trials, sim_time = search_vci1(tolerance, processes)
+    search_wall = time.time()-tw0
+    tw0 = time.time()
+    gradient, gradient_time = gradient_vci1()
+    gradient_wall = time.time()-tw0
+
+    print('method     VCI1 (psi)  simulated (s)  wall (s)')
+    if vci1 is not None:
+        print('search  %10.2f %14.1f %9.1f   (%.2f - %.2f psi, %d trials)' %
+              (vci1, sim_time, search_wall, low, high, trials))
+    print('gradient %9.2f %14.1f %9.1f' % (gradient, gradient_time, gradient_wall))
@@ -3,7 +3,9 @@ Script for measuring the VCI1 of a vehicle
 '''
 import time
 import sys
+from collections import deque
 import mavspy.mavs as mavs
+from telemetry_detectors import StallDetector
 
 render = False
 if (len(sys.argv)>1):
@@ -57,6 +59,13 @@ soil_strength_max = 100.0
 soil_strength_fade = 500.0
 
 dt = 1.0/30.0 # time step, seconds
+# The vehicle is stuck when the speed stays below half the desired speed
+# for a second, rather than on the first slow step
+stall = StallDetector(dt, threshold=0.5*desired_speed, window_time=1.0, min_time=5.0)
+# The soil strength at each sample in the stall window. The detector
+# fires a window after the vehicle slowed down, so the VCI1 is the
+# strength where the window started.
+window_strengths = deque(maxlen=stall.stats.window)
 time_elapsed = 0.0
 n = 0 # loop counter
 while (True):
@@ -73,8 +82,9 @@ while (True):
     p = veh.GetPosition()
 
     soil_strength_ = (soil_strength_max/soil_strength_fade)*(soil_strength_fade-p[0])
-    if (veh.GetSpeed()<0.5*desired_speed and time_elapsed>5.0):
-        print('VCI1 = '+str(soil_strength_))
+    window_strengths.append(soil_strength_)
+    if stall.update(veh.GetSpeed()):
+        print('VCI1 = '+str(window_strengths[0]))
         sys.exit()
 
     veh.SetTerrainProperties(terrain_type='flat',terrain_param1=0.0, terrain_param2=0.0, soil_type='clay', soil_strength=soil_strength_)
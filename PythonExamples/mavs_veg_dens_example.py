@@ -1,54 +1,60 @@
 '''
 Get a "ground truth" vegetation density from a grassy scene.
+
+The density is queried in tiles by a pool of worker processes (see
+veg_density_tiles.py) and saved to veg_density.npy, so the resolution
+and terrain size can be raised without running out of memory. It is
+then saved as a compressed volume file with its origin and resolution,
+veg_density.vol, along with images of its slices (see
+veg_density_export.py).
 '''
-import matplotlib.pyplot as plt
-import numpy as np
 import mavspy.mavs as mavs
+import veg_density_export
+import veg_density_tiles
 
 terrain_width = 50.0
 terrain_length = 50.0
+resolution = 1.0 # grid resolution in meters
 
-# Select a scene and load it
+# Select a scene
 mavs_scenefile = "/scenes/grass_dense.json"
-scene = mavs.MavsEmbreeScene()
-scene.Load(mavs.mavs_data_path+mavs_scenefile)
-
-# Create a MAVS environment
-env = mavs.MavsEnvironment()
-# Add the scene to the environment
-env.SetScene(scene)
-
-# Render a top-down view of the scene for reference later
-cam = mavs.MavsCamera()
-cam.Initialize(512,512,0.0035,0.0035,0.0035)
-cam.SetOffset([0.0,0.0,0.0],[1.0,0.0,0.0,0.0])
-cam.SetGammaAndGain(0.6,1.0)
-cam.SetPose([0.0, 0.0, max(10,1.25*terrain_width)],[0.7071, 0.0, 0.7071, 0.0])
-cam.Update(env,0.03)
-cam.Display()
-cam.SaveCameraImage("top_down.bmp")
-
-# Get the density grid
-# Arguments are : 
-# Lower left corner in ENU
-# Upper right corner in ENU
-# grid resolution in meters
-density_grid = env.GetVegDensityOnAGrid([-0.5*terrain_width,-0.5*terrain_length,0.0],
-                                        [0.5*terrain_width,0.5*terrain_length,20],1.0)
-
-# convert the python list to a numpy array
-veg_dens = np.array(density_grid)
-
-# get the shape of the numpy array
-nx,ny,nz = veg_dens.shape
-
-# plot the vegetation density slices, one by one
-for k in range(nz):
-    slice = veg_dens[:,:,k]
-    snx = len(slice)
-    sny = len(slice[0])
-    plt.xlim((nx,0))
-    plt.margins(0,0)
-    plt.axis('off')
-    plt.imshow(slice,interpolation='none')
-    plt.savefig('slice_'+str(k)+'.png',bbox_inches='tight')
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Load the scene
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+mavs_scenefile)
+
+    # Create a MAVS environment
+    env = mavs.MavsEnvironment()
+    # Add the scene to the environment
+    env.SetScene(scene)
+
+    # Render a top-down view of the scene for reference later
+    cam = mavs.MavsCamera()
+    cam.Initialize(512,512,0.0035,0.0035,0.0035)
+    cam.SetOffset([0.0,0.0,0.0],[1.0,0.0,0.0,0.0])
+    cam.SetGammaAndGain(0.6,1.0)
+    cam.SetPose([0.0, 0.0, max(10,1.25*terrain_width)],[0.7071, 0.0, 0.7071, 0.0])
+    cam.Update(env,0.03)
+    cam.Display()
+    cam.SaveCameraImage("top_down.bmp")
+
+    # Get the density grid
+    # Arguments are :
+    # scene file
+    # Lower left corner in ENU
+    # Upper right corner in ENU
+    # grid resolution in meters
+    # output file, the grid is memory mapped from it
+    lower = [-0.5*terrain_width,-0.5*terrain_length,0.0]
+    veg_dens = veg_density_tiles.query_density(mavs_scenefile,
+                                               lower,
+                                               [0.5*terrain_width,0.5*terrain_length,20],
+                                               resolution,'veg_density.npy')
+
+    # Save the density volume with its origin and resolution, and
+    # colormapped images of its horizontal slices, slice_0.png, ...
+    veg_density_export.write_volume('veg_density.vol',veg_dens,lower,resolution)
+    volume = veg_density_export.DensityVolume('veg_density.vol')
+    veg_density_export.save_slice_images(volume,'slice_')
+    volume.close()
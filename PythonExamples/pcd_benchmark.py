@@ -0,0 +1,78 @@
+'''
+Compare how fast labeled point clouds load from ASCII, binary and
+compressed PCD files.
+
+Writes a set of synthetic VLP-16 sized labeled scans (28,800 points) in
+each encoding with pcd_io, then times reading all of them back and
+checks that every encoding gives the same points. Binary files are
+timed both memory mapped and read into memory, and memory mapped reads
+are timed touching every point, since a memory map on its own doesn't
+read anything.
+
+Run this example with the number of scans as an optional argument:
+python pcd_benchmark.py 50
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pcd_io
+
+num_points = 28800 # one VLP-16 scan
+
+def make_scan(seed):
+    '''Labeled scan of a flat ground with a few boxes'''
+    rng = np.random.default_rng(seed)
+    points = np.empty(num_points, dtype=pcd_io.LABELED_DTYPE)
+    azimuth = rng.uniform(-np.pi, np.pi, num_points)
+    distance = rng.uniform(2.0, 100.0, num_points)
+    points['x'] = distance*np.cos(azimuth)
+    points['y'] = distance*np.sin(azimuth)
+    points['z'] = rng.normal(0.0, 0.05, num_points)
+    points['label'] = rng.choice([0, 1, 2, 7], num_points, p=[0.7, 0.15, 0.1, 0.05])
+    points['z'][points['label'] > 0] += rng.uniform(0.0, 3.0, np.count_nonzero(points['label'] > 0))
+    points['intensity'] = np.round(rng.uniform(0.0, 1.0, num_points), 3)
+    return points
+
+def time_loads(filenames, mmap=True):
+    '''Seconds to load every file and sum its coordinates, and the loaded scans'''
+    t0 = time.perf_counter()
+    scans = []
+    total = 0.0
+    for filename in filenames:
+        points = pcd_io.read_pcd(filename, mmap=mmap)
+        # touch every point, so memory mapped files are really read
+        total = total + float(np.sum(points['x']))
+        scans.append(points)
+    return time.perf_counter() - t0, scans
+
+if __name__ == "__main__":
+    num_scans = 50
+    if (len(sys.argv)>1):
+        num_scans = int(sys.argv[1])
+    folder = tempfile.mkdtemp(prefix='pcd_benchmark_')
+    try:
+        scans = [make_scan(k) for k in range(num_scans)]
+        print('%d scans of %d points, %s' % (num_scans, num_points,
+              'python-lzf' if pcd_io.lzf is not None else 'pure Python LZF'))
+        print('encoding                  write (s)  size (MB)  load (s)  scans/s  matches')
+        runs = [('ascii', 'ascii', True), ('binary', 'binary', True),
+                ('binary (no mmap)', 'binary', False), ('binary_compressed', 'binary_compressed', True)]
+        for label, data, mmap in runs:
+            filenames = [os.path.join(folder, '%d_%s.pcd' % (k, data)) for k in range(num_scans)]
+            t0 = time.perf_counter()
+            if label == data:
+                for filename, points in zip(filenames, scans):
+                    pcd_io.write_pcd(filename, points, data)
+            write_time = time.perf_counter() - t0
+            size = sum(os.path.getsize(f) for f in filenames)/1.0e6
+            load_time, loaded = time_loads(filenames, mmap)
+            same = all(np.array_equal(np.asarray(a), b) for a, b in zip(loaded, scans))
+            print('%-24s %10.2f %10.1f %9.3f %8.0f %8s' % (label, write_time, size, load_time,
+                                                          num_scans/load_time, str(same)))
+            sys.stdout.flush()
+            del loaded
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,352 @@
+'''
+Read and write PCD point cloud files with NumPy.
+
+MAVS writes labeled lidar scans (SaveLabeledPcd) as ASCII PCD files,
+which are slow to parse when a training job loads thousands of them.
+This module reads and writes PCD files in all three encodings of the
+format: 'ascii', 'binary' and 'binary_compressed'. Clouds are NumPy
+structured arrays with one field per PCD field, for example
+LABELED_DTYPE with x, y, z, intensity and label.
+
+Binary files are read with np.memmap, without copying or parsing the
+points. parse_pcd and pcd_bytes read and write PCD files held in
+memory, such as the records of a shard_dataset.py shard. Compressed
+files store each field contiguously and are compressed with LZF, as in
+PCL. LZF isn't in the standard library, so the python-lzf package is
+used when it is installed (pip install python-lzf) and a slower pure
+Python version otherwise.
+
+Convert a folder of ASCII files to binary, next to the originals, so
+3_labeled.pcd is written to 3_labeled_binary.pcd:
+python pcd_io.py output_data binary
+Add 'inplace' to replace the originals instead:
+python pcd_io.py output_data binary inplace
+'''
+import glob
+import io
+import multiprocessing
+import os
+import struct
+import sys
+import numpy as np
+
+try:
+    import lzf
+except ImportError:
+    lzf = None
+
+# Fields of a labeled lidar point
+LABELED_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4'), ('label', '<u4')])
+
+# PCD TYPE and SIZE to NumPy type, and back
+PCD_TYPES = {('F', 4): '<f4', ('F', 8): '<f8',
+             ('I', 1): 'i1', ('I', 2): '<i2', ('I', 4): '<i4', ('I', 8): '<i8',
+             ('U', 1): 'u1', ('U', 2): '<u2', ('U', 4): '<u4', ('U', 8): '<u8'}
+NUMPY_TYPES = {'f': 'F', 'i': 'I', 'u': 'U'}
+
+def lzf_compress(data):
+    '''LZF compress bytes, with python-lzf if it is installed'''
+    data = bytes(data)
+    if lzf is not None:
+        out = lzf.compress(data)
+        # python-lzf returns None when the data doesn't compress
+        if out is not None:
+            return out
+    n = len(data)
+    out = bytearray()
+    table = {}
+    ip = 0
+    literal_start = 0
+    while ip < n - 2:
+        key = data[ip:ip+3]
+        ref = table.get(key)
+        table[key] = ip
+        if ref is None or ip - ref - 1 >= 8192:
+            ip = ip + 1
+            continue
+        # back reference of up to 264 bytes, up to 8192 bytes back
+        max_length = min(264, n - ip)
+        length = 3
+        while length < max_length and data[ref + length] == data[ip + length]:
+            length = length + 1
+        write_literals(out, data, literal_start, ip)
+        offset = ip - ref - 1
+        if length - 2 < 7:
+            out.append(((length - 2) << 5) | (offset >> 8))
+        else:
+            out.append((7 << 5) | (offset >> 8))
+            out.append(length - 2 - 7)
+        out.append(offset & 0xff)
+        ip = ip + length
+        literal_start = ip
+    write_literals(out, data, literal_start, n)
+    return bytes(out)
+
+def write_literals(out, data, start, end):
+    # runs of up to 32 bytes, each after a control byte of run length - 1
+    while start < end:
+        run = min(32, end - start)
+        out.append(run - 1)
+        out += data[start:start+run]
+        start = start + run
+
+def lzf_decompress(data, size):
+    '''Decompress LZF data to size bytes, with python-lzf if it is installed'''
+    if lzf is not None:
+        return lzf.decompress(bytes(data), size)
+    out = bytearray(size)
+    n = len(data)
+    ip = 0
+    op = 0
+    while ip < n:
+        c = data[ip]
+        ip = ip + 1
+        if c < 32:
+            # literal run
+            c = c + 1
+            out[op:op+c] = data[ip:ip+c]
+            ip = ip + c
+            op = op + c
+            continue
+        # back reference
+        length = c >> 5
+        if length == 7:
+            length = length + data[ip]
+            ip = ip + 1
+        ref = op - ((c & 0x1f) << 8) - data[ip] - 1
+        ip = ip + 1
+        length = length + 2
+        if ref + length <= op:
+            out[op:op+length] = out[ref:ref+length]
+        else:
+            # the copy overlaps its own output, which repeats a pattern
+            for k in range(length):
+                out[op + k] = out[ref + k]
+        op = op + length
+    if op != size:
+        raise ValueError('LZF data decompressed to %d bytes, expected %d' % (op, size))
+    return bytes(out)
+
+class PcdHeader(object):
+    def __init__(self):
+        self.fields = []
+        self.sizes = []
+        self.types = []
+        self.counts = []
+        self.width = 0
+        self.height = 1
+        self.viewpoint = '0 0 0 1 0 0 0'
+        self.points = 0
+        self.data = 'ascii'
+        self.length = 0 # bytes before the point data
+
+    def dtype(self):
+        fields = []
+        for name, size, kind, count in zip(self.fields, self.sizes, self.types, self.counts):
+            t = PCD_TYPES[(kind, size)]
+            # PCL uses '_' for padding fields, which may repeat
+            if name == '_':
+                name = '_%d' % len(fields)
+            fields.append((name, t) if count == 1 else (name, t, (count,)))
+        return np.dtype(fields)
+
+def read_header(f):
+    '''Parse the header of an open PCD file, leaving f at the point data'''
+    header = PcdHeader()
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('PCD header has no DATA line')
+        header.length = header.length + len(line)
+        words = line.decode('ascii').split()
+        if not words or words[0].startswith('#'):
+            continue
+        key = words[0].upper()
+        if key == 'FIELDS':
+            header.fields = words[1:]
+        elif key == 'SIZE':
+            header.sizes = [int(w) for w in words[1:]]
+        elif key == 'TYPE':
+            header.types = words[1:]
+        elif key == 'COUNT':
+            header.counts = [int(w) for w in words[1:]]
+        elif key == 'WIDTH':
+            header.width = int(words[1])
+        elif key == 'HEIGHT':
+            header.height = int(words[1])
+        elif key == 'VIEWPOINT':
+            header.viewpoint = ' '.join(words[1:])
+        elif key == 'POINTS':
+            header.points = int(words[1])
+        elif key == 'DATA':
+            header.data = words[1].lower()
+            break
+    if not header.counts:
+        header.counts = [1]*len(header.fields)
+    if header.points == 0:
+        header.points = header.width*header.height
+    return header
+
+def read_body(f, header):
+    '''Read the points of a PCD file from f, positioned after the header'''
+    dtype = header.dtype()
+    if header.data == 'binary':
+        return np.frombuffer(f.read(header.points*dtype.itemsize), dtype=dtype, count=header.points)
+    if header.data == 'binary_compressed':
+        compressed_size, size = struct.unpack('<II', f.read(8))
+        buf = lzf_decompress(f.read(compressed_size), size)
+        # the fields are stored one after another, not point by point
+        points = np.empty(header.points, dtype=dtype)
+        offset = 0
+        for name in dtype.names:
+            field = dtype.fields[name][0]
+            count = header.points*max(1, int(np.prod(field.shape)))
+            points[name] = np.frombuffer(buf, dtype=field.base, count=count, offset=offset).reshape(points[name].shape)
+            offset = offset + count*field.base.itemsize
+        return points
+    if header.data == 'ascii':
+        if header.points == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.loadtxt(f, dtype=dtype, ndmin=1)
+    raise ValueError('Unknown PCD data type ' + header.data)
+
+def read_pcd(filename, mmap=True):
+    '''Read a PCD file as a structured array
+
+    Binary files are memory mapped read-only when mmap is True, so
+    only the pages that are used are read from disk. Use np.array on
+    the result to get an array that can be modified.
+    '''
+    with open(filename, 'rb') as f:
+        header = read_header(f)
+        if header.data == 'binary' and mmap and header.points > 0:
+            return np.memmap(filename, dtype=header.dtype(), mode='r', offset=header.length, shape=(header.points,))
+        return read_body(f, header)
+
+def parse_pcd(data):
+    '''Read a PCD file held in memory as bytes, as a structured array
+
+    Binary points are a read-only view of data, without a copy.
+    '''
+    f = io.BytesIO(data)
+    header = read_header(f)
+    if header.data == 'binary':
+        return np.frombuffer(data, dtype=header.dtype(), count=header.points, offset=header.length)
+    return read_body(f, header)
+
+def header_text(points, data, viewpoint='0 0 0 1 0 0 0', comment=None):
+    dtype = points.dtype
+    sizes = []
+    types = []
+    counts = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        sizes.append(str(field.base.itemsize))
+        types.append(NUMPY_TYPES[field.base.kind])
+        counts.append(str(max(1, int(np.prod(field.shape)))))
+    # comment lines start with '#', and PCD readers skip them
+    comments = ''
+    if comment is not None:
+        comments = ''.join('# ' + line + '\n' for line in str(comment).splitlines())
+    return '# .PCD v0.7 - Point Cloud Data file format\n' + comments + (
+            'VERSION 0.7\n'
+            'FIELDS ' + ' '.join(dtype.names) + '\n'
+            'SIZE ' + ' '.join(sizes) + '\n'
+            'TYPE ' + ' '.join(types) + '\n'
+            'COUNT ' + ' '.join(counts) + '\n'
+            'WIDTH %d\n'
+            'HEIGHT 1\n'
+            'VIEWPOINT %s\n'
+            'POINTS %d\n'
+            'DATA %s\n') % (len(points), viewpoint, len(points), data)
+
+def write_points(f, points, data='binary', comment=None):
+    '''Write a structured array of points as a PCD file to the open binary file f'''
+    points = np.ascontiguousarray(points)
+    # packed little endian fields, as PCD readers expect
+    dtype = np.dtype([(name, points.dtype.fields[name][0].newbyteorder('<')) for name in points.dtype.names])
+    points = points.astype(dtype, copy=False)
+    f.write(header_text(points, data, comment=comment).encode('ascii'))
+    if data == 'binary':
+        f.write(points.tobytes())
+    elif data == 'binary_compressed':
+        buf = b''.join(np.ascontiguousarray(points[name]).tobytes() for name in dtype.names)
+        compressed = lzf_compress(buf)
+        f.write(struct.pack('<II', len(compressed), len(buf)))
+        f.write(compressed)
+    elif data == 'ascii':
+        columns = []
+        formats = []
+        for name in dtype.names:
+            # the field's count, not -1, which can't be inferred for an empty cloud
+            column = points[name].reshape(len(points), max(1, int(np.prod(dtype.fields[name][0].shape))))
+            columns.append(column)
+            formats = formats + ['%.9g' if column.dtype.kind == 'f' else '%d']*column.shape[1]
+        np.savetxt(f, np.column_stack(columns), fmt=formats)
+    else:
+        raise ValueError('Unknown PCD data type ' + str(data))
+
+def write_pcd(filename, points, data='binary', comment=None):
+    '''Write a structured array of points as a PCD file
+
+    data is 'ascii', 'binary' or 'binary_compressed'. comment is
+    written as comment lines in the header, for example metadata
+    about how the cloud was made.
+    '''
+    with open(filename, 'wb') as f:
+        write_points(f, points, data, comment)
+
+def pcd_bytes(points, data='binary'):
+    '''The contents of a PCD file of the points, as bytes'''
+    f = io.BytesIO()
+    write_points(f, points, data)
+    return f.getvalue()
+
+def converted_name(filename, data):
+    '''Name of the converted copy of a PCD file, name_<data>.pcd'''
+    return os.path.splitext(filename)[0] + '_' + data + '.pcd'
+
+def convert_pcd(filename, data='binary', output=None, in_place=False):
+    '''Write a PCD file with another data encoding, returns the name of the new file
+
+    The new file is output if it is given, the original file if
+    in_place is True, and converted_name(filename, data) otherwise.
+    '''
+    points = np.array(read_pcd(filename))
+    if output is None:
+        output = filename if in_place else converted_name(filename, data)
+    if output == filename:
+        # write the whole file before replacing the original
+        write_pcd(output + '.tmp', points, data)
+        os.replace(output + '.tmp', output)
+    else:
+        write_pcd(output, points, data)
+    return output
+
+def convert_args(args):
+    return convert_pcd(*args)
+
+def convert_files(filenames, data='binary', processes=None, in_place=False):
+    '''Convert many PCD files with a process pool, returns the names of the new files'''
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(convert_args, [(f, data, None, in_place) for f in filenames], chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == "__main__":
+    folder = '.'
+    data = 'binary'
+    in_place = False
+    if (len(sys.argv)>1):
+        folder = sys.argv[1]
+    if (len(sys.argv)>2):
+        data = sys.argv[2]
+    if (len(sys.argv)>3):
+        in_place = (sys.argv[3] == 'inplace')
+    # skip the copies made by an earlier conversion
+    suffixes = tuple('_' + d + '.pcd' for d in ['ascii', 'binary', 'binary_compressed'])
+    filenames = [f for f in sorted(glob.glob(os.path.join(folder, '*.pcd'))) if not f.endswith(suffixes)]
+    convert_files(filenames, data, in_place=in_place)
+    print('Converted %d files in %s to %s%s' % (len(filenames), folder, data, ' in place' if in_place else ''))
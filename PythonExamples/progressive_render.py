@@ -0,0 +1,185 @@
+'''
+Render a MavsPathTraceCamera image progressively, stopping when it is
+no longer noisy.
+
+mavs_rough_terrain_example.py renders one frame at 400 rays per pixel
+and waits for all of them, although smooth parts of the image, like the
+sky and flat ground, stop changing after far fewer rays. Here the frame
+is rendered in batches of a few rays per pixel by a pool of worker
+processes, each with the scene and camera loaded once. Every batch is
+an independent sample of the image, so the running mean and variance
+of the batches give each pixel's value and the standard error of that
+value (in 0-255 gray levels).
+
+The image is divided into square tiles. Once a tile has at least
+min_batches batches and its mean standard error is below the noise
+target, the tile is done and later batches no longer change it. The
+render stops when every tile is done, or after max_batches batches.
+MAVS renders whole frames, so a done tile doesn't save rays on its
+own; the time saved is the batches that aren't rendered once the
+slowest tile is done. A preview of the mean image, with the done tiles
+darkened, is saved every preview_every batches.
+
+The batches are averaged after MAVS's gamma and clipping, which is
+close to, but not the same as, averaging the rays of one render.
+
+Run this example with the noise target, the rays per pixel of a batch
+and the number of worker processes as optional arguments:
+python progressive_render.py 1.0 25 4
+'''
+import multiprocessing
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+# The rough terrain scene and camera of mavs_rough_terrain_example.py
+mavs_scenefile = "/scenes/heightmap_example_scene.json"
+nx = 768
+ny = 432
+pose = ([0.0, 0.0, 1.75],[0.7071, 0.0, 0.0, -0.7071])
+
+# The camera and environment of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker(rays_per_batch, bounces=10):
+    '''Load the scene and make a camera that renders rays_per_batch rays per pixel'''
+    import mavspy.mavs as mavs
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+mavs_scenefile)
+    env = mavs.MavsEnvironment()
+    env.SetTime(19) # 0-23
+    env.SetTurbidity(10.0) # 2-10
+    env.SetScene(scene)
+    cam = mavs.MavsPathTraceCamera('custom',rays_per_batch,bounces,0.55,nx=nx,ny=ny,h_s=0.00622222,
+                                   v_s=0.0035,flen=0.0035,gamma=0.75)
+    cam.SetPose(pose[0],pose[1])
+    worker['scene'] = scene
+    worker['env'] = env
+    worker['cam'] = cam
+
+def render_batch(batch):
+    '''Render one batch of the frame, returns the batch number and the image'''
+    cam = worker['cam']
+    cam.Update(worker['env'],0.05)
+    return batch, np.array(cam.GetNumpyArray(), dtype=np.uint8)
+
+class ProgressiveImage(object):
+    '''Running mean and variance of image batches, with tiles that stop once converged'''
+    def __init__(self, shape, tile=32, noise_target=1.0, min_batches=4):
+        self.shape = shape
+        self.tile = tile
+        self.noise_target = noise_target
+        self.min_batches = min_batches
+        self.tiles = (-(-shape[0]//tile), -(-shape[1]//tile))
+        # pixel arrays are padded to whole tiles
+        padded = (self.tiles[0]*tile, self.tiles[1]*tile) + tuple(shape[2:])
+        self.count = np.zeros(padded[:2])
+        self.mean = np.zeros(padded)
+        self.m2 = np.zeros(padded)
+        self.tile_done = np.zeros(self.tiles, dtype=bool)
+        self.tile_batches = np.zeros(self.tiles, dtype=np.int64)
+        self.active = np.ones(padded[:2], dtype=bool)
+        # pixels of the image, not the padding, and how many are in each tile
+        self.valid = np.zeros(padded[:2])
+        self.valid[:shape[0], :shape[1]] = 1.0
+        self.valid_count = self.valid.reshape(self.tiles[0], tile, self.tiles[1], tile).sum(axis=(1, 3))
+        self.batches = 0
+        self.identical = 0
+        self.last = None
+
+    def add(self, image):
+        '''Add a batch to the tiles that aren't done, returns the number of tiles done'''
+        image = np.asarray(image, dtype=np.float64)
+        if self.last is not None and np.array_equal(image, self.last):
+            # a renderer that repeats its rays would look converged after two batches
+            self.identical = self.identical + 1
+        self.last = image
+        sample = np.zeros(self.mean.shape)
+        sample[:self.shape[0], :self.shape[1]] = image
+        # Welford's update, only where the tiles are still active
+        self.count = self.count + self.active
+        delta = sample - self.mean
+        weight = np.where(self.active, 1.0/np.maximum(self.count, 1.0), 0.0)
+        if self.mean.ndim == 3:
+            weight = weight[:, :, None]
+        self.mean = self.mean + delta*weight
+        self.m2 = self.m2 + delta*(sample - self.mean)*(weight > 0)
+        self.batches = self.batches + 1
+        self.tile_batches = self.tile_batches + ~self.tile_done
+        if self.identical == 0:
+            done = (self.tile_batches >= self.min_batches) & (self.tile_noise() < self.noise_target)
+            if np.any(done & ~self.tile_done):
+                self.tile_done = self.tile_done | done
+                self.active = ~np.repeat(np.repeat(self.tile_done, self.tile, 0), self.tile, 1)
+        return int(np.count_nonzero(self.tile_done))
+
+    def tile_noise(self):
+        '''Mean standard error of the pixels of each tile'''
+        count = self.count if self.mean.ndim == 2 else self.count[:, :, None]
+        variance = self.m2/np.maximum(count - 1.0, 1.0)
+        error = np.sqrt(variance/np.maximum(count, 1.0))
+        if error.ndim == 3:
+            error = error.mean(axis=2)
+        t = self.tile
+        tiles = (error*self.valid).reshape(self.tiles[0], t, self.tiles[1], t)
+        return tiles.sum(axis=(1, 3))/self.valid_count
+
+    def image(self):
+        return np.clip(np.round(self.mean[:self.shape[0], :self.shape[1]]), 0, 255).astype(np.uint8)
+
+    def preview(self):
+        '''The mean image with the done tiles darkened'''
+        image = self.mean[:self.shape[0], :self.shape[1]].copy()
+        done = ~self.active[:self.shape[0], :self.shape[1]]
+        image[done] = 0.5*image[done]
+        return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+    def done(self):
+        return bool(np.all(self.tile_done))
+
+def render(noise_target=1.0, rays_per_batch=25, processes=None, max_batches=16, min_batches=4,
+           tile=32, preview_every=4, preview_prefix='preview_'):
+    '''Render batches until every tile is below the noise target, returns the ProgressiveImage'''
+    progress = None
+    tw0 = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(rays_per_batch,))
+    try:
+        for batch, image in pool.imap_unordered(render_batch, range(max_batches)):
+            if progress is None:
+                progress = ProgressiveImage(image.shape, tile, noise_target, min_batches)
+            tiles_done = progress.add(image)
+            print('%d batches (%d rays/pixel), %d of %d tiles done, %.1f s' %
+                  (progress.batches, progress.batches*rays_per_batch, tiles_done,
+                   progress.tile_done.size, time.time()-tw0))
+            sys.stdout.flush()
+            if progress.batches % preview_every == 0:
+                Image.fromarray(progress.preview()).save(preview_prefix + str(progress.batches).zfill(3) + '.png')
+            if progress.done():
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    if progress.identical > 0:
+        print('Warning: %d batches were the same as the one before, so the camera repeats its rays '
+              'and the noise estimate is not valid' % progress.identical)
+    return progress
+
+if __name__ == "__main__":
+    noise_target = 1.0
+    rays_per_batch = 25
+    processes = None # one per CPU
+    if (len(sys.argv)>1):
+        noise_target = float(sys.argv[1])
+    if (len(sys.argv)>2):
+        rays_per_batch = int(sys.argv[2])
+    if (len(sys.argv)>3):
+        processes = int(sys.argv[3])
+    # at most the 400 rays per pixel of mavs_rough_terrain_example.py
+    max_batches = max(1, 400//rays_per_batch)
+    tw0 = time.time()
+    progress = render(noise_target, rays_per_batch, processes, max_batches)
+    Image.fromarray(progress.image()).save('rough_surface_image.bmp')
+    print('Rendered %d rays/pixel of at most %d in %.1f s, %d of %d tiles below %.2f' %
+          (progress.batches*rays_per_batch, max_batches*rays_per_batch, time.time()-tw0,
+           int(np.count_nonzero(progress.tile_done)), progress.tile_done.size, noise_target))
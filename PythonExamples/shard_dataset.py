@@ -0,0 +1,272 @@
+'''
+Store generated training frames in a few large shard files with an index.
+
+The data generators (SPAV/sim_example_keystrokes.py and
+mavs_lidar_trainer_example.py) save each frame as several small files,
+like 12_image.jpg, 12_image_annotated.jpg and 12_labeled.pcd. A large
+dataset ends up as hundreds of thousands of files in one folder, which
+is slow to list, copy and read in random order.
+
+A ShardWriter appends the files of each frame, as named blobs of bytes,
+to the end of a shard file (shard_00000.bin, shard_00001.bin, ...) and
+starts a new shard once the current one would grow past
+max_shard_bytes. A frame is never split between shards. Each frame adds
+one JSON line to index.jsonl with its frame id, pose, environment
+settings, and the shard, offset and size of each blob. The blobs are
+written before the index line, so an interrupted writer leaves at most
+some unindexed bytes at the end of a shard. Opening the folder again
+appends to the index and starts a new shard.
+
+A ShardReader loads the index and reads blobs from memory mapped
+shards. stream() goes through the frames in a random order across all
+shards (or in index order), reading and decoding the next frames in
+background threads while the caller uses the current one.
+
+Pack a folder of loose files written by the generators into shards:
+python shard_dataset.py pack output_data output_shards
+
+Stream through a dataset in random order and report the read rate:
+python shard_dataset.py read output_shards
+'''
+import concurrent.futures
+import glob
+import io
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import numpy as np
+import pcd_io
+
+INDEX_FILE = 'index.jsonl'
+
+def shard_name(number):
+    return 'shard_%05d.bin' % number
+
+def decode_blob(name, data):
+    '''Decode a blob by its file extension
+
+    Images are returned as arrays, PCD files as structured arrays of
+    points, .json as objects, and anything else as the bytes.
+    '''
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ['.jpg', '.jpeg', '.png', '.bmp']:
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as img:
+            return np.array(img)
+    if extension == '.pcd':
+        return pcd_io.parse_pcd(data)
+    if extension == '.json':
+        return json.loads(data.decode('utf-8'))
+    return data
+
+class ShardWriter(object):
+    '''Appends frames to size-bounded shard files and an index
+
+    add_frame can be called from several threads, for example from
+    the threads of a CaptureWriter.
+    '''
+    def __init__(self, folder, max_shard_bytes=256*1024*1024):
+        self.folder = folder
+        self.max_shard_bytes = max_shard_bytes
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # continue after the shards that are already in the folder
+        existing = glob.glob(os.path.join(folder, 'shard_*.bin'))
+        self.shard_number = max([int(re.findall(r'\d+', os.path.basename(f))[0]) for f in existing] + [-1])
+        self.shard = None
+        self.shard_size = 0
+        self.index = open(os.path.join(folder, INDEX_FILE), 'a')
+        self.lock = threading.Lock()
+        # statistics
+        self.frames = 0
+        self.bytes_written = 0
+
+    def next_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        self.shard_number = self.shard_number + 1
+        self.shard = open(os.path.join(self.folder, shard_name(self.shard_number)), 'wb')
+        self.shard_size = 0
+
+    def add_frame(self, frame_id, blobs, pose=None, environment=None):
+        '''Append a frame with blobs, a dictionary of name to bytes
+
+        Names are like file names, for example 'image.jpg', and the
+        extension tells decode_blob how to decode the blob. pose and
+        environment are anything that can be saved as JSON, for
+        example {'position': [x, y, z], 'orientation': [w, x, y, z]}
+        and {'Time': 13, 'Fog': 50.0}.
+        '''
+        size = sum(len(data) for data in blobs.values())
+        with self.lock:
+            if self.shard is None or (self.shard_size > 0 and self.shard_size + size > self.max_shard_bytes):
+                self.next_shard()
+            offsets = {}
+            for name, data in blobs.items():
+                self.shard.write(data)
+                offsets[name] = [self.shard_size, len(data)]
+                self.shard_size = self.shard_size + len(data)
+            self.shard.flush()
+            record = {'frame': frame_id, 'shard': shard_name(self.shard_number), 'blobs': offsets}
+            if pose is not None:
+                record['pose'] = pose
+            if environment is not None:
+                record['environment'] = environment
+            self.index.write(json.dumps(record) + '\n')
+            self.index.flush()
+            self.frames = self.frames + 1
+            self.bytes_written = self.bytes_written + size
+
+    def add_files(self, frame_id, filenames, pose=None, environment=None, remove=True):
+        '''Append a frame made of files on disk, a dictionary of blob name to file name
+
+        MAVS can only save some outputs, like annotated images and
+        labeled point clouds, to files. Save them to temporary names and
+        add them with this, which deletes them unless remove is False.
+        '''
+        blobs = {}
+        for name, filename in filenames.items():
+            with open(filename, 'rb') as f:
+                blobs[name] = f.read()
+        self.add_frame(frame_id, blobs, pose, environment)
+        if remove:
+            for filename in filenames.values():
+                os.remove(filename)
+
+    def close(self):
+        with self.lock:
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+            self.index.close()
+
+    def report(self):
+        return ('Shard writer: %d frames, %.1f MB in %s up to %s' %
+                (self.frames, self.bytes_written/1.0e6, self.folder, shard_name(max(self.shard_number, 0))))
+
+class ShardReader(object):
+    '''Random access and shuffled streaming over a folder written by a ShardWriter'''
+    def __init__(self, folder):
+        self.folder = folder
+        self.records = []
+        with open(os.path.join(folder, INDEX_FILE)) as f:
+            for line in f:
+                try:
+                    self.records.append(json.loads(line))
+                except ValueError:
+                    # an index line cut short by an interrupted writer
+                    continue
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def shard(self, name):
+        '''The memory map of a shard, opened on first use'''
+        with self.lock:
+            if name not in self.maps:
+                with open(os.path.join(self.folder, name), 'rb') as f:
+                    self.maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.maps[name]
+
+    def read(self, k, names=None, decode=True):
+        '''The record and blobs of frame k of the index
+
+        blobs is a dictionary of name to decoded blob, or to bytes if
+        decode is False. names selects some of the blobs, for example
+        ['image.jpg', 'labeled.pcd'], instead of all of them.
+        '''
+        record = self.records[k]
+        shard = self.shard(record['shard'])
+        blobs = {}
+        for name, (offset, size) in record['blobs'].items():
+            if names is not None and name not in names:
+                continue
+            data = shard[offset:offset+size]
+            blobs[name] = decode_blob(name, data) if decode else data
+        return record, blobs
+
+    def stream(self, shuffle=True, seed=None, workers=4, prefetch=16, names=None, decode=True):
+        '''Yield (record, blobs) for every frame, reading ahead in background threads
+
+        With shuffle the frames come in a random order across all
+        shards, otherwise in the order of the index. Up to prefetch
+        frames are read and decoded by the worker threads ahead of the
+        one being yielded.
+        '''
+        order = np.arange(len(self.records))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        pending = []
+        try:
+            for k in order:
+                pending.append(executor.submit(self.read, int(k), names, decode))
+                if len(pending) > prefetch:
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+        finally:
+            # the caller may stop early, so drop the reads that haven't started
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def close(self):
+        with self.lock:
+            for shard in self.maps.values():
+                shard.close()
+            self.maps = {}
+
+def pack_folder(input_folder, output_folder, max_shard_bytes=256*1024*1024):
+    '''Copy a folder of loose generator files into shards
+
+    Files are grouped into frames by the first number in their name, and
+    the blob name is the rest of the file name, so 12_image.jpg is blob
+    image.jpg of frame 12 and labeled_lidar0012.pcd is blob
+    labeled_lidar.pcd of frame 12. ASCII PCD files are stored as binary.
+    '''
+    frames = {}
+    for filename in sorted(os.listdir(input_folder)):
+        match = re.search(r'\d+', filename)
+        if match is None:
+            continue
+        head = filename[:match.start()].rstrip('_')
+        tail = filename[match.end():].lstrip('_')
+        name = head + tail if not head or tail.startswith('.') else head + '_' + tail
+        frames.setdefault(int(match.group()), {})[name] = os.path.join(input_folder, filename)
+    writer = ShardWriter(output_folder, max_shard_bytes)
+    for frame_id in sorted(frames):
+        blobs = {}
+        for name, filename in frames[frame_id].items():
+            if name.endswith('.pcd'):
+                blobs[name] = pcd_io.pcd_bytes(pcd_io.read_pcd(filename))
+            else:
+                with open(filename, 'rb') as f:
+                    blobs[name] = f.read()
+        writer.add_frame(frame_id, blobs)
+    writer.close()
+    return writer
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == 'pack':
+        writer = pack_folder(sys.argv[2], sys.argv[3])
+        print(writer.report())
+    elif len(sys.argv) > 2 and sys.argv[1] == 'read':
+        reader = ShardReader(sys.argv[2])
+        t0 = time.perf_counter()
+        total = 0
+        for record, blobs in reader.stream(seed=0):
+            total = total + sum(np.asarray(b).nbytes if not isinstance(b, bytes) else len(b) for b in blobs.values())
+        elapsed = time.perf_counter() - t0
+        print('Read and decoded %d frames (%.1f MB) in %.2f s, %.0f frames/s' %
+              (len(reader), total/1.0e6, elapsed, len(reader)/max(elapsed, 1e-9)))
+        reader.close()
+    else:
+        print('Usage: python shard_dataset.py pack input_folder output_folder')
+        print('   or: python shard_dataset.py read dataset_folder')
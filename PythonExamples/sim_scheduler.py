@@ -0,0 +1,183 @@
+'''
+Multi-rate scheduler for MAVS simulation loops.
+
+The examples step the vehicle at a fixed time step dt and update the
+sensors every few steps (n%3==0 for 10 Hz at 30 Hz). The Scheduler does
+that bookkeeping: each task is registered with its own rate and is
+called as task(t, task_dt) on the steps it is due, in the order the
+tasks were added. t is the simulation time and task_dt the task period.
+
+real_time_factor sets the pacing. With 1.0 the sim runs in real time,
+with 2.0 twice as fast, and with None as fast as possible (headless).
+When a step runs late the scheduler doesn't sleep until it has caught
+up, so the simulation clock keeps pace with the wall clock instead of
+drifting. If it falls more than max_lag steps behind it gives up on the
+missed time and starts pacing again from the current time.
+
+A task misses its deadline when it finishes later than one period after
+the wall time its step was due. report() prints the achieved rates,
+mean and max run times and missed deadlines of each task.
+
+The scheduler doesn't use MAVS itself, so it can be tried out with any
+functions in place of the MAVS calls. Run this file to see an example
+with stand-in tasks:
+python sim_scheduler.py
+'''
+import time
+
+class Task(object):
+    def __init__(self, name, function, every, offset):
+        self.name = name
+        self.function = function
+        # the task first runs on step offset, then every "every" steps
+        self.every = every
+        self.offset = offset
+        self.runs = 0
+        self.missed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+class Scheduler(object):
+    def __init__(self, dt, real_time_factor=1.0, max_lag=10, clock=time.perf_counter, sleep=time.sleep):
+        self.dt = dt
+        self.real_time_factor = real_time_factor
+        self.max_lag = max_lag
+        self.clock = clock
+        self.sleep = sleep
+        self.tasks = []
+        self.n = 0 # step counter
+        self.running = False
+        self.resyncs = 0
+        # wall time that step origin_step was due, steps are paced from there
+        self.wall_origin = None
+        self.origin_step = 0
+        self.wall_elapsed = 0.0
+
+    def add_task(self, name, function, rate=None, every=1, offset=0):
+        '''Register function(t, task_dt) to run at rate Hz, or every "every" steps.
+
+        The rate is rounded to a whole number of steps. Returns the Task.
+        '''
+        if rate is not None:
+            every = max(1, int(round(1.0/(rate*self.dt))))
+        task = Task(name, function, every, offset)
+        self.tasks.append(task)
+        return task
+
+    def time(self):
+        '''The current simulation time in seconds'''
+        return self.n*self.dt
+
+    def wall_step(self):
+        return self.dt/self.real_time_factor
+
+    def step(self):
+        '''Run the tasks that are due on the current step and advance by dt'''
+        t = self.time()
+        if self.real_time_factor is not None:
+            if self.wall_origin is None:
+                self.reset_pacing()
+            due = self.wall_origin + (self.n - self.origin_step)*self.wall_step()
+        for task in self.tasks:
+            if self.n < task.offset or (self.n - task.offset)%task.every != 0:
+                continue
+            t0 = self.clock()
+            task.function(t, task.every*self.dt)
+            t1 = self.clock()
+            elapsed = t1 - t0
+            task.runs = task.runs + 1
+            task.total_time = task.total_time + elapsed
+            task.max_time = max(task.max_time, elapsed)
+            if self.real_time_factor is not None and t1 > due + task.every*self.wall_step():
+                task.missed = task.missed + 1
+        self.n = self.n + 1
+        if self.real_time_factor is not None:
+            self.pace()
+
+    def reset_pacing(self):
+        self.wall_origin = self.clock()
+        self.origin_step = self.n
+
+    def pace(self):
+        # wall time the next step is due
+        due = self.wall_origin + (self.n - self.origin_step)*self.wall_step()
+        now = self.clock()
+        if now < due:
+            self.sleep(due - now)
+        elif now - due > self.max_lag*self.wall_step():
+            # too far behind to catch up, drop the missed time
+            self.resyncs = self.resyncs + 1
+            self.reset_pacing()
+
+    def run(self, steps=None, duration=None, until=None):
+        '''Step until stop() is called, or for a number of steps or seconds of
+        simulation time, or until the function until() returns True.
+        '''
+        self.running = True
+        first = self.n
+        wall0 = self.clock()
+        if duration is not None:
+            steps = int(round(duration/self.dt))
+        if self.real_time_factor is not None:
+            self.reset_pacing()
+        try:
+            while self.running:
+                if steps is not None and self.n - first >= steps:
+                    break
+                if until is not None and until():
+                    break
+                self.step()
+        finally:
+            self.running = False
+            self.wall_elapsed = self.wall_elapsed + self.clock() - wall0
+
+    def stop(self):
+        '''Stop run() after the current step, can be called from a task'''
+        self.running = False
+
+    def stats(self):
+        '''Per task statistics as a list of dictionaries'''
+        out = []
+        for task in self.tasks:
+            wall_rate = task.runs/self.wall_elapsed if self.wall_elapsed > 0.0 else 0.0
+            out.append({'name': task.name,
+                        'rate': 1.0/(task.every*self.dt),
+                        'achieved_rate': wall_rate,
+                        'runs': task.runs,
+                        'mean_time': task.total_time/task.runs if task.runs > 0 else 0.0,
+                        'max_time': task.max_time,
+                        'missed': task.missed})
+        return out
+
+    def report(self):
+        '''Table of the task statistics as a string'''
+        lines = ['Simulated %.2f s in %.2f s of wall time (%d steps, %d resyncs)' %
+                 (self.time(), self.wall_elapsed, self.n, self.resyncs),
+                 'task                  rate (Hz)  achieved (Hz)   runs  mean (ms)  max (ms)  missed']
+        for s in self.stats():
+            lines.append('%-20s %10.1f %14.1f %6d %10.2f %9.2f %7d' %
+                         (s['name'], s['rate'], s['achieved_rate'], s['runs'],
+                          1000.0*s['mean_time'], 1000.0*s['max_time'], s['missed']))
+        return '\n'.join(lines)
+
+if __name__ == "__main__":
+    # Stand-in tasks with the run times of a vehicle update, a lidar
+    # update that sometimes runs long, and a planner.
+    state = {'scans': 0}
+    def vehicle(t, dt):
+        time.sleep(0.002)
+    def lidar(t, dt):
+        state['scans'] = state['scans'] + 1
+        time.sleep(0.08 if state['scans']%10==0 else 0.02)
+    def planner(t, dt):
+        time.sleep(0.01)
+
+    for real_time_factor in [1.0, 2.0, None]:
+        scheduler = Scheduler(1.0/30.0, real_time_factor=real_time_factor)
+        scheduler.add_task('vehicle', vehicle)
+        scheduler.add_task('lidar', lidar, rate=10.0)
+        scheduler.add_task('planner', planner, rate=5.0, offset=1)
+        scheduler.run(duration=3.0)
+        print('Real time factor: ' + str(real_time_factor))
+        print(scheduler.report())
+        print('')
@@ -5,6 +5,7 @@ Drive it with the W-A-S-D keys.
 '''
 import math
 import mavspy.mavs as mavs
+from sim_scheduler import Scheduler
 
 # create a path for the vehicle to follow
 path_amplitude = 5.0
@@ -37,20 +38,24 @@ front_cam.SetGammaAndGain(0.5,2.0)
 front_cam.RenderShadows(True)
 front_cam.SetOffset([-15.0, 0.0, 2.0],[1.0, 0.0, 0.0, 0.0])
 
-# Start the simulatio nmain loop
+# Start the simulation main loop
 dt = 1.0/120.0 # time step, seconds
-n = 0 # loop counter
-while veh.GetPosition()[0]<0.95*path_length:
+# Run as fast as possible, like the original loop did
+scheduler = Scheduler(dt, real_time_factor=None)
 
+def update_vehicle(t, task_dt):
     # Get the driving command
     dc = front_cam.GetDrivingCommand()
-    
     # Update the vehicle with the driving command
-    veh.Update(env, dc.throttle, dc.steering, dc.braking, dt)
-
-    # Update the visualization at 30 Hz
-    if n%4==0:
-        front_cam.SetPose(veh.GetPosition(),veh.GetOrientation())
-        front_cam.Update(env,0.05)
-        front_cam.Display()
-    n = n+1
+    veh.Update(env, dc.throttle, dc.steering, dc.braking, task_dt)
+
+def update_camera(t, task_dt):
+    front_cam.SetPose(veh.GetPosition(),veh.GetOrientation())
+    front_cam.Update(env,0.05)
+    front_cam.Display()
+
+scheduler.add_task('vehicle', update_vehicle)
+# Update the visualization at 30 Hz
+scheduler.add_task('front_cam', update_camera, rate=30.0)
+scheduler.run(until=lambda: veh.GetPosition()[0]>=0.95*path_length)
+print(scheduler.report())
@@ -0,0 +1,201 @@
+'''
+Streaming detectors for when a vehicle has reached steady state or stalled.
+
+The max speed and VCI1 tests decide from a single sample, like
+new_velocity<=velocity, so one noisy step on rough terrain can end a
+run early, or a run never ends. The detectors here look at a sliding
+window of samples of a state channel (GetSpeed,
+GetLongitudinalAcceleration, ...) and only decide when the window
+supports it at the requested confidence. Each sample costs O(1), using
+running sums for the rolling mean, variance and least-squares slope.
+
+SteadyStateDetector decides that a channel is steady when the
+confidence interval of its slope lies within +-slope_tolerance.
+StallDetector decides that a channel has stalled when nearly all of the
+window (mean plus z standard deviations) is below a threshold.
+
+Samples from a simulation are strongly correlated, which makes the
+confidence intervals optimistic. The window should be long compared to
+the time the channel takes to respond, a few seconds for vehicle speed.
+
+Run this file to see the detectors on a noisy synthetic speed trace:
+python telemetry_detectors.py
+'''
+import math
+from collections import deque
+from statistics import NormalDist
+
+def z_score(confidence):
+    '''Two sided normal quantile, 1.96 for 0.95'''
+    return NormalDist().inv_cdf(0.5 + 0.5*confidence)
+
+class RollingStats(object):
+    '''Mean, variance and least-squares slope of the last window samples
+
+    The sums are updated in O(1) per sample, and recomputed from the
+    window once per window to keep rounding errors from building up.
+    '''
+    def __init__(self, window, dt=1.0):
+        self.window = window
+        self.dt = dt
+        self.values = deque()
+        self.updates = 0
+        self.recompute()
+
+    def recompute(self):
+        # sums of y, y^2 and k*y, where k is the index in the window, oldest first
+        self.sy = 0.0
+        self.syy = 0.0
+        self.sky = 0.0
+        for k, y in enumerate(self.values):
+            self.sy = self.sy + y
+            self.syy = self.syy + y*y
+            self.sky = self.sky + k*y
+
+    def add(self, y):
+        if len(self.values) == self.window:
+            y0 = self.values.popleft()
+            self.sy = self.sy - y0
+            self.syy = self.syy - y0*y0
+            # the remaining samples all move down one index
+            self.sky = self.sky - self.sy
+        k = len(self.values)
+        self.values.append(y)
+        self.sy = self.sy + y
+        self.syy = self.syy + y*y
+        self.sky = self.sky + k*y
+        self.updates = self.updates + 1
+        if self.updates%self.window == 0:
+            self.recompute()
+
+    def __len__(self):
+        return len(self.values)
+
+    def full(self):
+        return len(self.values) == self.window
+
+    def mean(self):
+        return self.sy/len(self.values)
+
+    def variance(self):
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        return max(0.0, (self.syy - self.sy*self.sy/n)/(n - 1))
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def sxx(self):
+        # sum of (k - mean k)^2 for k = 0..n-1
+        n = len(self.values)
+        return n*(n*n - 1)/12.0
+
+    def slope(self):
+        '''Least-squares slope in units per second'''
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        sk = n*(n - 1)/2.0
+        return (self.sky - sk*self.sy/n)/self.sxx()/self.dt
+
+    def slope_error(self):
+        '''Standard error of the slope in units per second'''
+        n = len(self.values)
+        if n < 3:
+            return float('inf')
+        b = self.slope()*self.dt
+        residual = self.syy - self.sy*self.sy/n - b*b*self.sxx()
+        return math.sqrt(max(0.0, residual)/(n - 2)/self.sxx())/self.dt
+
+class SteadyStateDetector(object):
+    '''Decides when a channel has stopped changing
+
+    update returns True once the window is full, at least min_time has
+    passed, and the confidence interval of the slope is inside
+    +-slope_tolerance (units per second).
+    '''
+    def __init__(self, dt, window_time=2.0, slope_tolerance=0.05, confidence=0.99, min_time=0.0):
+        self.stats = RollingStats(max(3, int(round(window_time/dt))), dt)
+        self.slope_tolerance = slope_tolerance
+        self.z = z_score(confidence)
+        self.min_samples = int(round(min_time/dt))
+        self.samples = 0
+        self.steady = False
+
+    def update(self, value):
+        self.stats.add(value)
+        self.samples = self.samples + 1
+        if not self.stats.full() or self.samples < self.min_samples:
+            return False
+        bound = abs(self.stats.slope()) + self.z*self.stats.slope_error()
+        self.steady = bound < self.slope_tolerance
+        return self.steady
+
+    def value(self):
+        '''Mean of the window, the steady state value once steady'''
+        return self.stats.mean()
+
+class StallDetector(object):
+    '''Decides when a channel has dropped below a threshold and stayed there
+
+    update returns True once the window is full, at least min_time has
+    passed, and the mean plus z standard deviations of the window is
+    below threshold, so a few noisy samples neither trigger nor
+    prevent it.
+    '''
+    def __init__(self, dt, threshold, window_time=1.0, confidence=0.99, min_time=0.0):
+        self.stats = RollingStats(max(2, int(round(window_time/dt))), dt)
+        self.threshold = threshold
+        self.z = z_score(confidence)
+        self.min_samples = int(round(min_time/dt))
+        self.samples = 0
+        self.stalled = False
+
+    def update(self, value):
+        self.stats.add(value)
+        self.samples = self.samples + 1
+        if not self.stats.full() or self.samples < self.min_samples:
+            return False
+        self.stalled = self.stats.mean() + self.z*self.stats.std() < self.threshold
+        return self.stalled
+
+class TelemetryMonitor(object):
+    '''Runs a detector per named channel, for example
+
+    monitor = TelemetryMonitor({'speed': SteadyStateDetector(dt),
+                                'acceleration': SteadyStateDetector(dt, slope_tolerance=0.5)})
+    monitor.update({'speed': veh.GetSpeed(), 'acceleration': veh.GetLongitudinalAcceleration()})
+
+    update returns True when every detector has decided.
+    '''
+    def __init__(self, detectors):
+        self.detectors = detectors
+        self.decided = dict((name, False) for name in detectors)
+
+    def update(self, values):
+        for name, detector in self.detectors.items():
+            self.decided[name] = detector.update(values[name])
+        return all(self.decided.values())
+
+if __name__ == "__main__":
+    import random
+    # speed rising to 20 m/s with bumps from rough terrain, then
+    # bogging down and stopping at 30 s
+    dt = 0.01
+    random.seed(0)
+    steady = SteadyStateDetector(dt, window_time=2.0, slope_tolerance=0.2, min_time=5.0)
+    stall = StallDetector(dt, threshold=1.0, window_time=1.0, min_time=5.0)
+    steady_time = None
+    stall_time = None
+    t = 0.0
+    while t < 40.0 and stall_time is None:
+        speed = 20.0*(1.0 - math.exp(-t/3.0)) if t < 30.0 else max(0.0, 20.0 - 10.0*(t - 30.0))
+        speed = speed + random.gauss(0.0, 0.3) + (2.0 if random.random() < 0.01 else 0.0)
+        if steady.update(speed) and steady_time is None:
+            steady_time = t
+            print('Steady at %.2f s, speed %.2f m/s' % (t, steady.value()))
+        if stall.update(speed):
+            stall_time = t
+            print('Stalled at %.2f s' % t)
+        t = t + dt
@@ -0,0 +1,187 @@
+'''
+Save vegetation density volumes as one compressed, chunked file, and
+export colormapped slice images.
+
+mavs_veg_dens_example.py used to save every horizontal slice of the
+density with plt.imshow and plt.savefig, which spends most of its time
+setting up figures and leaves only a PNG rendering of the numbers.
+
+write_volume saves the whole volume to a single file. Each horizontal
+slice (fixed k) is split into chunks of chunk_rows x rows, and each
+chunk is compressed with zlib on a pool of threads. The file ends with
+a JSON index of the chunks and the metadata of the grid: its shape,
+origin (the lower corner of cell 0, 0, 0), resolution, bounds and
+value range. The volume is read in blocks of x rows, so a memory mapped
+.npy file from veg_density_tiles.py is read once, in order, without
+loading it all.
+
+DensityVolume opens a file lazily: read_slice(k) only reads and
+decompresses the chunks of slice k.
+
+save_slice_images colormaps slices with a lookup table, all cells at
+once, and encodes them as PNG files on a pool of threads. The colors
+are matplotlib's viridis when matplotlib is installed, and a close
+approximation of it otherwise.
+
+Convert a .npy file from veg_density_tiles.py, with the lower corner of
+the box and the resolution, and optionally save the slice images:
+python veg_density_export.py veg_density.npy veg_density.vol -500 -500 0 0.25 images
+'''
+import concurrent.futures
+import json
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+
+MAGIC = b'MAVSVOL1'
+
+# viridis at 0, 0.25, 0.5, 0.75 and 1, used when matplotlib isn't installed
+VIRIDIS_STOPS = np.array([[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]], dtype=np.float64)
+
+def write_volume(filename, volume, origin, resolution, chunk_rows=128, level=6, workers=None):
+    '''Save a 3D array as a compressed, chunked volume file
+
+    origin is the lower corner of cell (0, 0, 0) and resolution the
+    size of a cell, in meters. Returns the metadata of the file.
+    '''
+    nx, ny, nz = volume.shape
+    dtype = np.dtype(volume.dtype).newbyteorder('<')
+    chunks = []
+    vmin = np.inf
+    vmax = -np.inf
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for i0 in range(0, nx, chunk_rows):
+            # one contiguous read of the rows, then one chunk per slice
+            block = np.asarray(volume[i0:i0+chunk_rows], dtype=dtype)
+            if block.size > 0:
+                vmin = min(vmin, float(block.min()))
+                vmax = max(vmax, float(block.max()))
+            futures = []
+            for k in range(nz):
+                data = np.ascontiguousarray(block[:, :, k]).tobytes()
+                futures.append(executor.submit(zlib.compress, data, level))
+            # zlib releases the GIL, so the slices compress in parallel
+            for k, future in enumerate(futures):
+                compressed = future.result()
+                f.write(compressed)
+                chunks.append([k, i0, offset, len(compressed)])
+                offset = offset + len(compressed)
+        executor.shutdown()
+        upper = [o + n*resolution for o, n in zip(origin, volume.shape)]
+        metadata = {'shape': [nx, ny, nz], 'dtype': dtype.str, 'origin': [float(o) for o in origin],
+                    'resolution': float(resolution), 'bounds': [[float(o) for o in origin], upper],
+                    'min': vmin, 'max': vmax, 'chunk_rows': chunk_rows, 'compression': 'zlib',
+                    'chunks': chunks}
+        index = json.dumps(metadata).encode('utf-8')
+        f.write(index)
+        # the index is found from the last 8 bytes of the file
+        f.write(struct.pack('<Q', offset))
+    return metadata
+
+class DensityVolume(object):
+    '''A volume file written by write_volume, read one slice at a time'''
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.lock = threading.Lock()
+        self.file.seek(-8, 2)
+        index_end = self.file.tell()
+        index_offset = struct.unpack('<Q', self.file.read(8))[0]
+        self.file.seek(0)
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + ' is not a MAVS volume file')
+        self.file.seek(index_offset)
+        self.metadata = json.loads(self.file.read(index_end - index_offset).decode('utf-8'))
+        self.shape = tuple(self.metadata['shape'])
+        self.dtype = np.dtype(self.metadata['dtype'])
+        self.origin = self.metadata['origin']
+        self.resolution = self.metadata['resolution']
+        self.bounds = self.metadata['bounds']
+        self.slices = [[] for k in range(self.shape[2])]
+        for k, i0, offset, size in self.metadata['chunks']:
+            self.slices[k].append((i0, offset, size))
+
+    def read_slice(self, k):
+        '''Slice k of the volume, a 2D array of x by y'''
+        nx, ny, nz = self.shape
+        out = np.empty((nx, ny), dtype=self.dtype)
+        for i0, offset, size in self.slices[k]:
+            with self.lock:
+                self.file.seek(offset)
+                compressed = self.file.read(size)
+            rows = np.frombuffer(zlib.decompress(compressed), dtype=self.dtype).reshape(-1, ny)
+            out[i0:i0+len(rows)] = rows
+        return out
+
+    def read(self):
+        '''The whole volume as a 3D array'''
+        out = np.empty(self.shape, dtype=self.dtype)
+        for k in range(self.shape[2]):
+            out[:, :, k] = self.read_slice(k)
+        return out
+
+    def close(self):
+        self.file.close()
+
+def colormap_table(name='viridis'):
+    '''256 x 3 table of uint8 colors'''
+    try:
+        import matplotlib
+        cmap = matplotlib.colormaps[name]
+        return np.round(255.0*cmap(np.linspace(0.0, 1.0, 256))[:, :3]).astype(np.uint8)
+    except (ImportError, AttributeError, KeyError):
+        x = np.linspace(0.0, 1.0, 256)
+        stops = np.linspace(0.0, 1.0, len(VIRIDIS_STOPS))
+        return np.round(np.column_stack([np.interp(x, stops, VIRIDIS_STOPS[:, c]) for c in range(3)])).astype(np.uint8)
+
+def colormap(values, vmin, vmax, table):
+    '''Colors of an array of values, as uint8 RGB'''
+    scale = 255.0/(vmax - vmin) if vmax > vmin else 0.0
+    index = np.clip((values - vmin)*scale, 0.0, 255.0).astype(np.uint8)
+    return table[index]
+
+def save_slice_image(volume, k, filename, vmin, vmax, table):
+    from PIL import Image
+    # rows are x and columns are y, flipped as in the original plots
+    rgb = colormap(volume.read_slice(k)[:, ::-1], vmin, vmax, table)
+    Image.fromarray(rgb).save(filename)
+
+def save_slice_images(volume, prefix='slice_', cmap='viridis', workers=4):
+    '''Save every slice of a DensityVolume as prefix<k>.png on a pool of threads
+
+    All slices use the same colors for the same density, from 0 to
+    the largest density in the volume. Each thread holds one slice and
+    its image in memory at a time.
+    '''
+    table = colormap_table(cmap)
+    vmax = volume.metadata['max']
+    vmin = min(0.0, volume.metadata['min'])
+    filenames = [prefix + str(k) + '.png' for k in range(volume.shape[2])]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(save_slice_image, volume, k, filenames[k], vmin, vmax, table)
+                   for k in range(volume.shape[2])]
+        for future in futures:
+            future.result()
+    return filenames
+
+if __name__ == "__main__":
+    if len(sys.argv) < 7:
+        print('Usage: python veg_density_export.py input.npy output.vol x0 y0 z0 resolution [images]')
+        sys.exit(1)
+    origin = [float(v) for v in sys.argv[3:6]]
+    resolution = float(sys.argv[6])
+    tw0 = time.time()
+    metadata = write_volume(sys.argv[2], np.load(sys.argv[1], mmap_mode='r'), origin, resolution)
+    print('Wrote %s (%d x %d x %d) in %.1f s' % (sys.argv[2], metadata['shape'][0], metadata['shape'][1],
+                                                 metadata['shape'][2], time.time()-tw0))
+    if len(sys.argv) > 7 and sys.argv[7] == 'images':
+        tw0 = time.time()
+        volume = DensityVolume(sys.argv[2])
+        filenames = save_slice_images(volume)
+        volume.close()
+        print('Saved %d slice images in %.1f s' % (len(filenames), time.time()-tw0))
@@ -0,0 +1,116 @@
+'''
+Query the vegetation density of a large box in tiles, with a pool of
+worker processes.
+
+env.GetVegDensityOnAGrid returns the density of the whole box as nested
+Python lists, which take about 8 times the memory of float32 numbers in
+them and are filled on one thread. A 1 km x 1 km x 20 m box at 0.25 m
+is 1.28 billion cells, 5 GB as float32 and far more as lists.
+
+Here the box is split into columns of tile_cells x tile_cells cells
+that cover its whole height. Each worker process loads the scene once
+and queries one tile at a time, writing the result straight into a
+.npy file opened as a memory map, so only one tile per worker is ever
+held as lists and the grid itself never has to fit in memory. Cell
+(i, j, k) of the grid covers lower + [i, i+1) x resolution in x, and
+likewise in y and z. Read the result back with
+np.load(filename, mmap_mode='r').
+
+Run this example with the resolution in meters, the number of worker
+processes and the output file as optional arguments:
+python veg_density_tiles.py 0.25 8 veg_density.npy
+'''
+import multiprocessing
+import sys
+import time
+import numpy as np
+
+def grid_shape(lower, upper, resolution):
+    '''Number of cells in x, y and z of the box from lower to upper'''
+    return tuple(max(1, int(round((u - l)/resolution))) for l, u in zip(lower, upper))
+
+def tile_ranges(shape, tile_cells):
+    '''(i0, i1, j0, j1) cell ranges of the tiles that cover the grid'''
+    tiles = []
+    for i0 in range(0, shape[0], tile_cells):
+        for j0 in range(0, shape[1], tile_cells):
+            tiles.append((i0, min(i0 + tile_cells, shape[0]), j0, min(j0 + tile_cells, shape[1])))
+    return tiles
+
+# The environment and output grid of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker(scenefile, filename, lower, resolution):
+    '''Load the scene and open the output grid once for this process'''
+    import mavspy.mavs as mavs
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+scenefile)
+    env = mavs.MavsEnvironment()
+    env.SetScene(scene)
+    worker['scene'] = scene
+    worker['env'] = env
+    worker['grid'] = np.load(filename, mmap_mode='r+')
+    worker['lower'] = lower
+    worker['resolution'] = resolution
+
+def query_tile(tile):
+    '''Query one tile and write it into the grid, returns the tile and the seconds it took'''
+    t0 = time.time()
+    i0, i1, j0, j1 = tile
+    grid = worker['grid']
+    lower = worker['lower']
+    resolution = worker['resolution']
+    nz = grid.shape[2]
+    tile_lower = [lower[0] + i0*resolution, lower[1] + j0*resolution, lower[2]]
+    tile_upper = [lower[0] + i1*resolution, lower[1] + j1*resolution, lower[2] + nz*resolution]
+    density = np.asarray(worker['env'].GetVegDensityOnAGrid(tile_lower, tile_upper, resolution), dtype=np.float32)
+    # rounding at the edges of a box can add a cell, which is dropped, but a
+    # missing cell would be left at 0 and read as no vegetation
+    if density.ndim != 3 or density.shape[0] < i1 - i0 or density.shape[1] < j1 - j0 or density.shape[2] < nz:
+        raise ValueError('GetVegDensityOnAGrid returned %s cells for the %d x %d x %d tile at (%d, %d)' %
+                         (str(density.shape), i1 - i0, j1 - j0, nz, i0, j0))
+    grid[i0:i1, j0:j1, :] = density[:i1-i0, :j1-j0, :nz]
+    grid.flush()
+    return tile, time.time() - t0
+
+def query_density(scenefile, lower, upper, resolution, filename, processes=None, tile_cells=64):
+    '''Vegetation density of the box from lower to upper, as a memory mapped .npy file
+
+    Returns the grid opened read-only.
+    '''
+    shape = grid_shape(lower, upper, resolution)
+    tiles = tile_ranges(shape, tile_cells)
+    # a float32 .npy file of the full grid, filled with zeros by the file system
+    grid = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32, shape=shape)
+    del grid
+    print('%d x %d x %d cells (%.2f GB) in %d tiles of %d x %d cells' %
+          (shape[0], shape[1], shape[2], 4.0*np.prod(shape, dtype=np.float64)/1.0e9, len(tiles), tile_cells, tile_cells))
+    sys.stdout.flush()
+    tw0 = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(scenefile, filename, list(lower), resolution))
+    try:
+        for count, (tile, seconds) in enumerate(pool.imap_unordered(query_tile, tiles), 1):
+            if count % 100 == 0 or count == len(tiles):
+                print('%d/%d tiles (%.1f tiles/s)' % (count, len(tiles), count/(time.time()-tw0)))
+                sys.stdout.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+    return np.load(filename, mmap_mode='r')
+
+if __name__ == "__main__":
+    resolution = 0.25
+    processes = None # one per CPU
+    output_file = 'veg_density.npy'
+    if (len(sys.argv)>1):
+        resolution = float(sys.argv[1])
+    if (len(sys.argv)>2):
+        processes = int(sys.argv[2])
+    if (len(sys.argv)>3):
+        output_file = sys.argv[3]
+    # a 1 km x 1 km area, 20 m high
+    tw0 = time.time()
+    veg_dens = query_density("/scenes/grass_dense.json", [-500.0, -500.0, 0.0], [500.0, 500.0, 20.0],
+                             resolution, output_file, processes)
+    print('Wrote %s in %.1f s, mean density %.4f' % (output_file, time.time()-tw0, float(veg_dens[::16, ::16, :].mean())))
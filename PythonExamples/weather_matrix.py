@@ -0,0 +1,250 @@
+'''
+Render the same sensor poses under a grid of weather and time of day
+settings, with a pool of worker processes.
+
+mavs_weather_example.py drives through one combination of weather
+settings. For sensor robustness studies, this script renders a camera
+image and a labeled lidar scan at every pose of a waypoints file for
+every combination of a grid of environment settings, like
+
+grid = [('Time', [6, 13, 19]), ('RainRate', [0.0, 5.0, 20.0]), ...]
+
+where each name is an environment setting, set with env.Set<name>.
+
+Each worker process loads the scene and sensors once and keeps its
+environment between renders, so it only calls the setters whose value
+changed since its last render. The combinations are put in an order
+where consecutive ones differ in one setting, by one step (a reflected
+Gray code over the grid), and all of the poses of a combination are
+rendered one after another. List the settings in the grid from the
+slowest to change (changed least often) to the quickest. The jobs are
+split into one contiguous run per worker process, so each worker
+follows that order and only sets many settings at the start of its run.
+
+Every render is a job, keyed by a hash of everything that affects its
+output: scene, pose, settings and sensors. A job writes
+<key>_camera.png and <key>_lidar.pcd, each with the job's settings and
+pose as metadata (a PNG text chunk and PCD header comments), then
+<key>.json. A job whose .json file exists is skipped, so an interrupted
+sweep only renders what is missing when it is run again. At the end of
+a run, scenarios.csv in the output folder is rewritten with a row for
+every job that has a .json file, so it also lists the jobs finished by
+an interrupted run.
+
+Run this example with the output folder, the number of poses and the
+number of worker processes as optional arguments:
+python weather_matrix.py weather_matrix 10 4
+'''
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import pcd_io
+
+mavs_scenefile = "/scenes/cube_scene.json"
+waypoints_file = '/waypoints/vehicle2_pos_1.vprp'
+
+# The settings grid, from the slowest to the quickest setting to change
+grid = [('Time', [6, 13, 19]), # 0-23
+        ('Turbidity', [2.0, 7.0]), # 2-10
+        ('CloudCover', [0.0, 0.5, 1.0]), # 0-1
+        ('Fog', [0.0, 50.0, 100.0]), # 0-100
+        ('RainRate', [0.0, 5.0, 20.0]), # 0-25
+        ('Snow', [0.0, 10.0]), # 0-25
+        ('Wind', [[0.0, 2.0]])] # wind lateral velocity (m/s)
+
+# Sensor settings, part of each job's key
+camera = {'nx': 640, 'ny': 360, 'h_s': 0.006222, 'v_s': 0.0035, 'flen': 0.0035,
+          'gamma': 0.5, 'gain': 2.0, 'offset': [0.0, 0.0, 1.5]}
+lidar_type = 'VLP-16'
+lidar_offset = [0.0, 0.0, 1.830]
+settle_time = 0.1 # seconds of AdvanceTime after a change, so rain and snow fall
+
+columns = ['key', 'pose', 'position', 'orientation'] + [name for name, values in grid]
+
+def gray_order(sizes):
+    '''Index tuples of a grid of the sizes, each one step from the one before'''
+    if not sizes:
+        return [()]
+    rest = gray_order(sizes[1:])
+    order = []
+    for i in range(sizes[0]):
+        # every other pass goes back through the rest of the grid
+        for r in (rest if i % 2 == 0 else reversed(rest)):
+            order.append((i,) + r)
+    return order
+
+def job_key(position, orientation, settings):
+    '''Hash of everything that affects a render'''
+    content = {'scene': mavs_scenefile, 'position': position, 'orientation': orientation,
+               'settings': settings, 'camera': camera, 'lidar': [lidar_type, lidar_offset],
+               'settle_time': settle_time}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def make_jobs(poses):
+    '''Jobs for every pose and setting combination, in rendering order'''
+    jobs = []
+    for index in gray_order([len(values) for name, values in grid]):
+        settings = dict((name, values[i]) for (name, values), i in zip(grid, index))
+        for p, (position, orientation) in enumerate(poses):
+            jobs.append({'key': job_key(position, orientation, settings), 'pose': p,
+                         'position': position, 'orientation': orientation, 'settings': settings})
+    return jobs
+
+# The scene, environment and sensors of a worker process, loaded by init_worker
+worker = {}
+
+def init_worker(output_folder):
+    '''Load the scene and sensors once for this process'''
+    import mavspy.mavs as mavs
+    scene = mavs.MavsEmbreeScene()
+    scene.Load(mavs.mavs_data_path+mavs_scenefile)
+    scene.TurnOnLabeling()
+    env = mavs.MavsEnvironment()
+    env.SetScene(scene)
+
+    cam = mavs.MavsCamera()
+    cam.Initialize(camera['nx'],camera['ny'],camera['h_s'],camera['v_s'],camera['flen'])
+    cam.SetGammaAndGain(camera['gamma'],camera['gain'])
+    cam.SetOffset(camera['offset'],[1.0,0.0,0.0,0.0])
+
+    lidar = mavs.MavsLidar(lidar_type)
+    lidar.SetOffset(lidar_offset,[1.0,0.0,0.0,0.0])
+
+    worker['scene'] = scene
+    worker['env'] = env
+    worker['cam'] = cam
+    worker['lidar'] = lidar
+    worker['folder'] = output_folder
+    # the settings the environment has now, unknown until they are set
+    worker['settings'] = {}
+
+def apply_settings(settings):
+    '''Set the settings that changed since the last render, returns the number set'''
+    env = worker['env']
+    changed = 0
+    for name, value in settings.items():
+        if worker['settings'].get(name) != value:
+            getattr(env, 'Set' + name)(value)
+            worker['settings'][name] = value
+            changed = changed + 1
+    if changed > 0 and settle_time > 0.0:
+        env.AdvanceTime(settle_time)
+    return changed
+
+def render_job(job):
+    '''Render and save the camera image and lidar scan of a job, returns the number of settings changed'''
+    from PIL import Image, PngImagePlugin
+    changed = apply_settings(job['settings'])
+    env = worker['env']
+    cam = worker['cam']
+    lidar = worker['lidar']
+    name = os.path.join(worker['folder'], job['key'])
+    metadata = json.dumps({'key': job['key'], 'pose': job['pose'], 'position': job['position'],
+                           'orientation': job['orientation'], 'settings': job['settings'],
+                           'scene': mavs_scenefile})
+
+    cam.SetPose(job['position'],job['orientation'])
+    cam.Update(env,0.1)
+    info = PngImagePlugin.PngInfo()
+    info.add_text('mavs', metadata)
+    Image.fromarray(np.array(cam.GetNumpyArray(),dtype=np.uint8)).save(name+'_tmp.png', pnginfo=info)
+
+    lidar.SetPose(job['position'],job['orientation'])
+    lidar.Update(env,0.1)
+    lidar.AnnotateFrame(env)
+    # MAVS writes the labeled cloud as ASCII, so rewrite it as binary with the metadata
+    lidar.SaveLabeledPcd(name+'_mavs.pcd')
+    points = pcd_io.read_pcd(name+'_mavs.pcd')
+    pcd_io.write_pcd(name+'_tmp.pcd', points, 'binary', comment='mavs '+metadata)
+    os.remove(name+'_mavs.pcd')
+
+    # the .json file marks the job as done, so it is written last
+    os.replace(name+'_tmp.png', name+'_camera.png')
+    os.replace(name+'_tmp.pcd', name+'_lidar.pcd')
+    with open(name+'_tmp.json', 'w') as f:
+        f.write(metadata)
+    os.replace(name+'_tmp.json', name+'.json')
+    return changed
+
+def render_run(jobs, report_every=10):
+    '''Render a run of consecutive jobs, returns (renders, settings changed, seconds)'''
+    t0 = time.time()
+    changed = 0
+    for count, job in enumerate(jobs, 1):
+        changed = changed + render_job(job)
+        if count % report_every == 0 or count == len(jobs):
+            print('Worker %d: %d/%d renders (%.2f renders/s)' % (os.getpid(), count, len(jobs), count/(time.time()-t0)))
+            sys.stdout.flush()
+    return len(jobs), changed, time.time()-t0
+
+def write_manifest(jobs, output_folder):
+    '''Write scenarios.csv with a row for every job that has a .json file, returns the number of rows'''
+    manifest = os.path.join(output_folder, 'scenarios.csv')
+    rows = 0
+    with open(manifest+'.tmp', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for job in jobs:
+            if os.path.isfile(os.path.join(output_folder, job['key']+'.json')):
+                writer.writerow([job['key'], job['pose'], json.dumps(job['position']), json.dumps(job['orientation'])] +
+                                [json.dumps(job['settings'][name]) for name, values in grid])
+                rows = rows + 1
+    os.replace(manifest+'.tmp', manifest)
+    return rows
+
+def run_matrix(poses, output_folder, processes=None):
+    '''Render the jobs of the poses that aren't in output_folder yet'''
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    jobs = make_jobs(poses)
+    todo = [job for job in jobs if not os.path.isfile(os.path.join(output_folder, job['key']+'.json'))]
+    print('%d of %d renders already done, rendering %d' % (len(jobs)-len(todo), len(jobs), len(todo)))
+    sys.stdout.flush()
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # one contiguous run of jobs per worker, so each worker keeps the Gray code order
+    run_size = max(1, -(-len(todo)//processes))
+    runs = [todo[k:k+run_size] for k in range(0, len(todo), run_size)]
+
+    done = 0
+    changed = 0
+    tw0 = time.time()
+    try:
+        if runs:
+            pool = multiprocessing.Pool(len(runs), initializer=init_worker, initargs=(output_folder,))
+            try:
+                for renders, run_changed, seconds in pool.imap_unordered(render_run, runs):
+                    done = done + renders
+                    changed = changed + run_changed
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        # the .json files are the record of what is done, even if this run was interrupted
+        rows = write_manifest(jobs, output_folder)
+    print('Rendered %d jobs in %.1f s, %d settings changed (%d if every setting were set for every render), '
+          '%d jobs in scenarios.csv' % (done, time.time()-tw0, changed, done*len(grid), rows))
+
+if __name__ == "__main__":
+    output_folder = 'weather_matrix'
+    num_poses = 10
+    processes = None # one per CPU
+    if (len(sys.argv)>1):
+        output_folder = sys.argv[1]
+    if (len(sys.argv)>2):
+        num_poses = int(sys.argv[2])
+    if (len(sys.argv)>3):
+        processes = int(sys.argv[3])
+    import mavspy.mavs as mavs
+    waypoints = mavs.MavsWaypoints()
+    waypoints.Load(mavs.mavs_data_path+waypoints_file)
+    poses = []
+    for i in range(min(num_poses, waypoints.num_waypoints)):
+        poses.append(([float(v) for v in waypoints.GetWaypoint(i)],
+                      [float(v) for v in waypoints.GetOrientation(i)]))
+    run_matrix(poses, output_folder, processes)
@@ -0,0 +1,214 @@
+"""Any-angle path planning and path shortcutting
+
+astar.astar returns an 8-connected staircase with one waypoint per cell,
+which gives the vehicle controller hundreds of closely spaced waypoints.
+This module has two ways to get a short list of straight segments:
+
+theta_star plans any-angle paths directly (Lazy Theta*), keeping a node's
+grandparent as its parent whenever the two can see each other.
+
+shortcut_path post-processes any index path, replacing runs of waypoints
+with a straight segment when the segment is clear. The line-of-sight
+checks for all candidate segments are done in one batched call.
+
+Line of sight is conservative: a segment between two cell centres is
+clear only if no blocked cell's square touches it, including cells it
+only clips at a corner or runs along the edge of. The cell at the start
+of the segment is not checked, so a vehicle sitting on an occupied cell
+can still leave it.
+
+Reference: A. Nash, S. Koenig and C. Tovey, "Lazy Theta*: Any-Angle Path
+Planning and Path Length Analysis in 3D", AAAI 2010.
+"""
+import heapq
+import math
+import numpy as np
+import astar
+
+# Slack for rounding when a segment passes exactly through a cell corner or edge
+EPS = 1e-9
+
+def line_of_sight(blocked, a, b):
+    """True if no blocked cell's square touches the segment from cell a to cell b
+
+    The segment runs between the cell centres. The cell a itself is not
+    checked.
+    """
+    # walk along the longer axis, u, with v the other axis
+    swap = abs(b[1] - a[1]) > abs(b[0] - a[0])
+    ua, va, ub, vb = (a[1], a[0], b[1], b[0]) if swap else (a[0], a[1], b[0], b[1])
+    slope = (vb - va)/(ub - ua) if ub != ua else 0.0
+    lo = min(ua, ub)
+    hi = max(ua, ub)
+    for u in range(lo, hi + 1):
+        # the part of the segment inside the strip of cells at u
+        x0 = max(u, lo + 0.5)
+        x1 = min(u + 1, hi + 0.5)
+        y0 = va + 0.5 + (x0 - ua - 0.5)*slope
+        y1 = va + 0.5 + (x1 - ua - 0.5)*slope
+        # every cell of the strip whose square the part touches
+        for v in range(math.ceil(min(y0, y1) - 1.0 - EPS), math.floor(max(y0, y1) + EPS) + 1):
+            i, j = (v, u) if swap else (u, v)
+            if (i, j) != (a[0], a[1]) and blocked[i, j]:
+                return False
+    return True
+
+def supercover_cells(a, b):
+    """Cells whose squares touch the segments between the centres of cells a[k] and b[k]
+
+    a and b are (N,2) integer arrays. Returns the cell indices of all
+    segments concatenated, plus the segment each cell came from. The
+    cells of a segment are those line_of_sight checks, including a[k].
+    """
+    # walk along the longer axis of each segment, u, with v the other axis
+    swap = np.abs(b[:, 1] - a[:, 1]) > np.abs(b[:, 0] - a[:, 0])
+    ua = np.where(swap, a[:, 1], a[:, 0])
+    va = np.where(swap, a[:, 0], a[:, 1])
+    ub = np.where(swap, b[:, 1], b[:, 0])
+    vb = np.where(swap, b[:, 0], b[:, 1])
+    du = ub - ua
+    slope = (vb - va)/np.where(du == 0, 1, du)
+    lo = np.minimum(ua, ub)
+    hi = np.maximum(ua, ub)
+    # one entry per strip of cells along u
+    counts = hi - lo + 1
+    seg = np.repeat(np.arange(len(a)), counts)
+    u = lo[seg] + np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+    x0 = np.maximum(u, lo[seg] + 0.5)
+    x1 = np.minimum(u + 1, hi[seg] + 0.5)
+    y0 = va[seg] + 0.5 + (x0 - ua[seg] - 0.5)*slope[seg]
+    y1 = va[seg] + 0.5 + (x1 - ua[seg] - 0.5)*slope[seg]
+    vmin = np.ceil(np.minimum(y0, y1) - 1.0 - EPS).astype(np.int64)
+    vmax = np.floor(np.maximum(y0, y1) + EPS).astype(np.int64)
+    # one entry per cell of each strip
+    counts = vmax - vmin + 1
+    strip = np.repeat(np.arange(len(u)), counts)
+    v = vmin[strip] + np.arange(len(strip)) - np.repeat(np.cumsum(counts) - counts, counts)
+    u = u[strip]
+    seg = seg[strip]
+    ci = np.where(swap[seg], v, u)
+    cj = np.where(swap[seg], u, v)
+    return ci, cj, seg
+
+def line_of_sight_batch(blocked, a, b):
+    """line_of_sight for arrays of segments from cells a[k] to cells b[k]
+
+    Cells outside the grid count as blocked. Returns a boolean array.
+    """
+    a = np.asarray(a, dtype=np.int64).reshape(-1, 2)
+    b = np.asarray(b, dtype=np.int64).reshape(-1, 2)
+    if len(a) == 0:
+        return np.zeros(0, dtype=bool)
+    ci, cj, seg = supercover_cells(a, b)
+    inside = (ci >= 0) & (ci < blocked.shape[0]) & (cj >= 0) & (cj < blocked.shape[1])
+    hit = np.ones(len(ci), dtype=bool)
+    hit[inside] = blocked[ci[inside], cj[inside]]
+    # the start cell of a segment isn't checked
+    hit &= (ci != a[seg, 0]) | (cj != a[seg, 1])
+    return np.bincount(seg[hit], minlength=len(a)) == 0
+
+def shortcut_path(maze, path, window=100):
+    """Remove waypoints from an index path where a straight segment is clear
+
+    From each kept waypoint, jumps to the farthest of the next window
+    waypoints that is in line of sight. By the triangle inequality the
+    result is never longer than the input, and every segment of it is
+    collision free.
+    """
+    if path is None or len(path) < 3:
+        return path
+    blocked = (np.asarray(maze) != 0)
+    points = np.asarray(path, dtype=np.int64)
+    n = len(points)
+    # every candidate segment (i,j) with 2 <= j-i <= window, checked in one batch
+    i = np.repeat(np.arange(n), window - 1)
+    j = i + np.tile(np.arange(2, window + 1), n)
+    valid = j < n
+    i = i[valid]
+    j = j[valid]
+    visible = line_of_sight_batch(blocked, points[i], points[j])
+    farthest = np.arange(1, n + 1)
+    farthest[-1] = n - 1
+    # j increases within each i, so the last visible j per i wins
+    np.maximum.at(farthest, i[visible], j[visible])
+    out = [tuple(path[0])]
+    k = 0
+    while k < n - 1:
+        k = int(farthest[k])
+        out.append(tuple(path[k]))
+    return out
+
+def path_length(path):
+    """Length of an index path in cells"""
+    p = np.asarray(path, dtype=float)
+    return float(np.sum(np.sqrt(np.sum(np.diff(p, axis=0)**2, axis=1))))
+
+def unpad(node, stride):
+    """Maze index of a node of the padded grid"""
+    i, j = divmod(node, stride)
+    return (i - 1, j - 1)
+
+def theta_star(maze, start, end):
+    """Returns an any-angle path from start to end as a list of index waypoints
+
+    Uses Lazy Theta* with a Euclidean heuristic. Any nonzero cell of the
+    maze is blocked. Returns None if the end can't be reached.
+    """
+    maze = np.asarray(maze)
+    if not astar.in_bounds(maze, start) or not astar.in_bounds(maze, end):
+        return None
+    occupied = (maze != 0)
+    blocked = astar.padded_blocked(maze)
+    stride = blocked.shape[1]
+    blocked = blocked.ravel()
+    start_node = (start[0] + 1)*stride + start[1] + 1
+    end_node = (end[0] + 1)*stride + end[1] + 1
+    if blocked[end_node]:
+        return None
+
+    g = np.full(blocked.size, np.inf)
+    parent = np.full(blocked.size, -1, dtype=np.int64)
+    closed = np.zeros(blocked.size, dtype=bool)
+    offsets = [(di*stride + dj, step) for di, dj, step in astar.NEIGHBORS]
+    ei = end[0] + 1
+    ej = end[1] + 1
+
+    g[start_node] = 0.0
+    parent[start_node] = start_node
+    open_list = [(math.hypot(start[0] - end[0], start[1] - end[1]), start_node)]
+
+    while open_list:
+        f, current = heapq.heappop(open_list)
+        if closed[current]:
+            continue
+        # Lazy Theta* assumed the parent could see this node, check it now
+        p = int(parent[current])
+        if p != current and not line_of_sight(occupied, unpad(p, stride), unpad(current, stride)):
+            best = np.inf
+            for offset, step in offsets:
+                n = current + offset
+                if closed[n] and g[n] + step < best:
+                    best = g[n] + step
+                    parent[current] = n
+            g[current] = best
+        if current == end_node:
+            path = [current]
+            while parent[path[-1]] != path[-1]:
+                path.append(int(parent[path[-1]]))
+            return [unpad(node, stride) for node in path[::-1]]
+        closed[current] = True
+
+        p = int(parent[current])
+        pi, pj = divmod(p, stride)
+        for offset, step in offsets:
+            child = current + offset
+            if blocked[child] or closed[child]:
+                continue
+            i, j = divmod(child, stride)
+            child_g = g[p] + math.hypot(i - pi, j - pj)
+            if child_g < g[child]:
+                g[child] = child_g
+                parent[child] = p
+                heapq.heappush(open_list, (child_g + math.hypot(i - ei, j - ej), child))
+
+    return None
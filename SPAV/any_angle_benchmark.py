@@ -0,0 +1,119 @@
+"""Check and time any-angle planning and path shortcutting on random grids
+
+For a set of random grids, plans with astar.astar, shortcuts that path
+with any_angle.shortcut_path, and plans with any_angle.theta_star. For
+each method it reports the number of waypoints, the path length relative
+to A*, and the planning time. It also checks that shortcutting never
+makes a path longer, and that no segment of any path enters a blocked
+cell. The collision check doesn't use any_angle's line of sight: it
+samples each segment every sample_step cells and measures the distance
+from the samples to the centres of the blocked cells around them. The
+check is run first on a segment that clips the corner of a blocked cell.
+
+Run this example:
+python any_angle_benchmark.py
+"""
+import sys
+import time
+import numpy as np
+import astar
+import any_angle
+from astar_benchmark import make_test_grid
+
+grid_size = 200
+num_grids = 20
+densities = [0.05, 0.1, 0.2]
+sample_step = 0.01 # cells between the samples of a segment
+
+def clearance(maze, path):
+    """Smallest distance, in cells along either axis, from the path to a blocked cell centre
+
+    Distances of 1 or more are reported as 1. A path that stays out
+    of every blocked cell's square has a clearance of at least 0.5;
+    the diagonal steps of astar touch blocked corners at exactly 0.5.
+    """
+    blocked = (np.asarray(maze) != 0)
+    p = np.asarray(path, dtype=np.float64) + 0.5
+    nearest = 1.0
+    for p0, p1 in zip(p[:-1], p[1:]):
+        n = int(np.ceil(np.max(np.abs(p1 - p0))/sample_step)) + 1
+        q = p0 + np.linspace(0.0, 1.0, n)[:, None]*(p1 - p0)
+        # the four cells whose centres are within one cell of each sample
+        base = np.floor(q - 0.5).astype(np.int64)
+        for di in (0, 1):
+            for dj in (0, 1):
+                ci = base[:, 0] + di
+                cj = base[:, 1] + dj
+                inside = (ci >= 0) & (ci < blocked.shape[0]) & (cj >= 0) & (cj < blocked.shape[1])
+                hit = np.zeros(len(q), dtype=bool)
+                hit[inside] = blocked[ci[inside], cj[inside]]
+                if np.any(hit):
+                    d = np.maximum(np.abs(q[hit, 0] - ci[hit] - 0.5), np.abs(q[hit, 1] - cj[hit] - 0.5))
+                    nearest = min(nearest, float(d.min()))
+    return nearest
+
+def collision_free(maze, path):
+    return clearance(maze, path) >= 0.5 - 1e-9
+
+def corner_case():
+    """A segment that clips the corner of a blocked cell, and the shortcut of a path past it
+
+    Stepping once per cell along the longer axis from (0,0) to (5,2)
+    visits (1,0) but not (1,1), although the segment passes through
+    the upper corner of (1,1).
+    """
+    grid = np.zeros((6, 3))
+    grid[1, 1] = 1.0
+    segment = [(0, 0), (5, 2)]
+    visible = bool(any_angle.line_of_sight_batch(grid != 0, [segment[0]], [segment[1]])[0])
+    short = any_angle.shortcut_path(grid, astar.astar(grid, segment[0], segment[1]))
+    print('Corner case: segment clearance %.2f, line of sight %s, shortcut path %s clearance %.2f' %
+          (clearance(grid, segment), visible, short, clearance(grid, short)))
+    return (not collision_free(grid, segment)) and (not visible) and collision_free(grid, short)
+
+if __name__ == "__main__":
+    results = {'astar': [], 'astar+shortcut': [], 'theta_star': [], 'theta_star+shortcut': []}
+    failures = 0
+    if not corner_case():
+        print('Corner case failed')
+        failures += 1
+    for density in densities:
+        for seed in range(num_grids):
+            grid = make_test_grid(grid_size, density=density, seed=seed)
+            start = (0, 0)
+            end = (grid_size - 1, grid_size - 1)
+            t0 = time.perf_counter()
+            path = astar.astar(grid, start, end)
+            t_astar = time.perf_counter() - t0
+            if path is None:
+                continue
+            t0 = time.perf_counter()
+            short = any_angle.shortcut_path(grid, path)
+            t_short = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            theta = any_angle.theta_star(grid, start, end)
+            t_theta = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            theta_short = any_angle.shortcut_path(grid, theta)
+            t_theta_short = time.perf_counter() - t0
+
+            base = any_angle.path_length(path)
+            runs = [('astar', path, t_astar), ('astar+shortcut', short, t_astar + t_short),
+                    ('theta_star', theta, t_theta), ('theta_star+shortcut', theta_short, t_theta + t_theta_short)]
+            for name, p, t in runs:
+                results[name].append((len(p), any_angle.path_length(p)/base, t, clearance(grid, p)))
+                if not collision_free(grid, p):
+                    print('Collision in %s path, density %.2f seed %d' % (name, density, seed))
+                    failures += 1
+            if any_angle.path_length(short) > base + 1e-9 or \
+               any_angle.path_length(theta_short) > any_angle.path_length(theta) + 1e-9:
+                print('Shortcut made the path longer, density %.2f seed %d' % (density, seed))
+                failures += 1
+
+    print('method                 waypoints  length/A*   time (s)  min clearance')
+    for name, rows in results.items():
+        rows = np.array(rows)
+        print('%-22s %9.1f %10.3f %10.4f %14.3f' % (name, rows[:, 0].mean(), rows[:, 1].mean(), rows[:, 2].mean(),
+                                                     rows[:, 3].min()))
+    print('Paths checked: %d, failures: %d' % (len(results['astar']), failures))
+    sys.stdout.flush()
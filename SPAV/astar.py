@@ -1,7 +1,121 @@
 """Python implementation of A* planner
 
+The astar function uses a binary heap for the open list and NumPy
+arrays for the g-scores, parent indices and closed flags, so it can
+replan on a large occupancy grid inside the sim loop.
+
+The original list based version is kept as astar_simple for comparison.
 Adapted from: https://medium.com/@nicholas.w.swift/easy-a-star-pathfinding-7e6689c7f7b2
 """
+import heapq
+import math
+import numpy as np
+
+SQRT2 = math.sqrt(2.0)
+
+# Adjacent squares and the cost of stepping to each one
+NEIGHBORS = [(0, -1, 1.0), (0, 1, 1.0), (-1, 0, 1.0), (1, 0, 1.0),
+             (-1, -1, SQRT2), (-1, 1, SQRT2), (1, -1, SQRT2), (1, 1, SQRT2)]
+
+def octile_distance(a, b):
+    """Admissible heuristic for an 8-connected grid with diagonal cost sqrt(2)"""
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+    return (dx + dy) + (SQRT2 - 2.0)*min(dx, dy)
+
+def in_bounds(maze, p):
+    """Check that the index p lies inside the 2D array maze"""
+    return p[0] >= 0 and p[0] < maze.shape[0] and p[1] >= 0 and p[1] < maze.shape[1]
+
+def padded_blocked(maze):
+    """Returns a boolean array that is True for non-walkable cells
+
+    The array has a one cell wide blocked border, so neighbors of any
+    cell in the original maze can be looked up without bounds checks.
+    Cell (i,j) of the maze is cell (i+1,j+1) of the padded array.
+    """
+    maze = np.asarray(maze)
+    blocked = np.ones((maze.shape[0] + 2, maze.shape[1] + 2), dtype=bool)
+    blocked[1:-1, 1:-1] = (maze != 0)
+    return blocked
+
+def reconstruct_path(parent, node, stride):
+    """Walk the parent array back from node and return the path as maze indices"""
+    path = []
+    while node >= 0:
+        i, j = divmod(node, stride)
+        path.append((i - 1, j - 1))
+        node = int(parent[node])
+    return path[::-1]
+
+def astar(maze, start, end, cost=None):
+    """Returns a list of tuples as a path from the given start to the given end in the given maze
+
+    Any nonzero cell of the maze is treated as blocked. Returns None
+    if the end can't be reached. cost is an optional array the size of
+    the maze of non-negative extra costs, such as costmap.Costmap.cost.
+    Stepping into a cell then costs (1+cost) times the step length, and
+    cells with infinite cost are blocked.
+    """
+    maze = np.asarray(maze)
+    if not in_bounds(maze, start) or not in_bounds(maze, end):
+        return None
+
+    blocked = padded_blocked(maze)
+    stride = blocked.shape[1]
+    extra = None
+    if cost is not None:
+        extra = np.zeros(blocked.shape)
+        extra[1:-1, 1:-1] = cost
+        blocked |= np.isinf(extra)
+        extra = (1.0 + extra).ravel()
+    blocked = blocked.ravel()
+    start_node = (start[0] + 1)*stride + start[1] + 1
+    end_node = (end[0] + 1)*stride + end[1] + 1
+    if blocked[end_node]:
+        return None
+
+    # Search state, one entry per cell of the padded grid
+    g = np.full(blocked.size, np.inf)
+    parent = np.full(blocked.size, -1, dtype=np.int64)
+    closed = np.zeros(blocked.size, dtype=bool)
+
+    offsets = [(di*stride + dj, step) for di, dj, step in NEIGHBORS]
+    ei = end[0] + 1
+    ej = end[1] + 1
+    diag = SQRT2 - 2.0
+
+    # Heap entries are (f, -g, node), ties are broken towards deeper nodes
+    g[start_node] = 0.0
+    open_list = [(octile_distance(start, end), 0.0, start_node)]
+
+    while open_list:
+        f, neg_g, current = heapq.heappop(open_list)
+        if closed[current]:
+            continue
+        if current == end_node:
+            return reconstruct_path(parent, current, stride)
+        closed[current] = True
+
+        current_g = -neg_g
+        for offset, step in offsets:
+            child = current + offset
+            if blocked[child] or closed[child]:
+                continue
+            if extra is None:
+                child_g = current_g + step
+            else:
+                child_g = current_g + step*extra[child]
+            if child_g < g[child]:
+                g[child] = child_g
+                parent[child] = current
+                i, j = divmod(child, stride)
+                dx = abs(i - ei)
+                dy = abs(j - ej)
+                h = dx + dy + diag*min(dx, dy)
+                heapq.heappush(open_list, (child_g + h, -child_g, child))
+
+    return None
 
 class Node():
     """A node class for A* Pathfinding"""
@@ -17,8 +131,11 @@ class Node():
     def __eq__(self, other):
         return self.position == other.position
 
-def astar(maze, start, end):
-    """Returns a list of tuples as a path from the given start to the given end in the given maze"""
+def astar_simple(maze, start, end):
+    """Returns a list of tuples as a path from the given start to the given end in the given maze
+
+    This is the original tutorial implementation, kept as a reference for benchmarking.
+    """
 
     # Create start and end node
     start_node = Node(None, start)
@@ -98,5 +215,3 @@ def astar(maze, start, end):
 
             # Add the child to the open list
             open_list.append(child)
-
-
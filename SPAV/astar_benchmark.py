@@ -0,0 +1,65 @@
+"""Benchmark the A* planner on synthetic occupancy grids
+
+Compares astar.astar against the original list based astar.astar_simple
+on random grids of 100x100, 400x400 and 2000x2000 cells.
+The original planner gets very slow as the grid grows, so by default it is
+only run on grids up to reference_max_size cells wide.
+
+Run this example:
+python astar_benchmark.py
+or, to run the original planner on every grid size
+python astar_benchmark.py all
+"""
+import sys
+import time
+import numpy as np
+import astar
+
+grid_sizes = [100, 400, 2000]
+obstacle_density = 0.2 # fraction of cells that are blocked
+reference_max_size = 100
+
+def make_test_grid(size, density=obstacle_density, seed=0):
+    """Create a random size x size grid with clumps of obstacles
+
+    The corners (0,0) and (size-1,size-1) are always left free.
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.zeros((size, size))
+    # Place square blocks of 1-4 cells until the requested density is reached
+    num_blocks = int(density*size*size/6.25)
+    corners = rng.integers(0, size, size=(num_blocks, 2))
+    widths = rng.integers(1, 5, size=(num_blocks, 2))
+    for (i, j), (wi, wj) in zip(corners, widths):
+        grid[i:i+wi, j:j+wj] = 1.0
+    grid[0:3, 0:3] = 0.0
+    grid[size-3:size, size-3:size] = 0.0
+    return grid
+
+def path_length(path):
+    """Length of an index path in cells"""
+    p = np.asarray(path, dtype=float)
+    return float(np.sum(np.sqrt(np.sum(np.diff(p, axis=0)**2, axis=1))))
+
+def time_planner(planner, grid, start, end):
+    t0 = time.perf_counter()
+    path = planner(grid, start, end)
+    return time.perf_counter() - t0, path
+
+if __name__ == "__main__":
+    run_all = (len(sys.argv) > 1 and sys.argv[1] == 'all')
+    print('size      planner        time (s)   path cells  path length')
+    for size in grid_sizes:
+        grid = make_test_grid(size)
+        start = (0, 0)
+        end = (size - 1, size - 1)
+        planners = [('astar', astar.astar)]
+        if run_all or size <= reference_max_size:
+            planners.append(('astar_simple', astar.astar_simple))
+        for name, planner in planners:
+            elapsed, path = time_planner(planner, grid, start, end)
+            if path:
+                print('%-9s %-14s %9.4f %12d %12.1f' % (str(size)+'^2', name, elapsed, len(path), path_length(path)))
+            else:
+                print('%-9s %-14s %9.4f     no path' % (str(size)+'^2', name, elapsed))
+        sys.stdout.flush()
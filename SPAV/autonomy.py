@@ -8,6 +8,7 @@ import numpy as np
 import math
 
 class Vector3(object):
+    __slots__ = ('x','y','z')
     def __init__(self,vals=[0.0, 0.0, 0.0]):
         self.x = vals[0]
         self.y = vals[1]
@@ -64,6 +65,7 @@ class Vector3(object):
         return v
 
 class Quaternion(object):
+    __slots__ = ('w','x','y','z')
     def __init__(self,vals=[1.0, 0.0, 0.0, 0.0]):
         self.w = vals[0]
         self.x = vals[1]
@@ -127,6 +129,206 @@ class Quaternion(object):
         v.y = q1.y
         v.z = q1.z
         return v
+    def rotate_array(self,vectors):
+        """Rotate every vector of a Vector3Array by this quaternion"""
+        return Vector3Array(rotate_points([self.w,self.x,self.y,self.z],vectors.data))
+
+def rotate_points(quat,points):
+    """Rotate an (N,3) array of points by the quaternion [w,x,y,z]
+
+    Uses the same sandwich product, term for term, as Quaternion.rotate,
+    so the result is identical to rotating the points one at a time.
+    """
+    w1 = quat[0]
+    x1 = quat[1]
+    y1 = quat[2]
+    z1 = quat[3]
+    x2 = points[:,0]
+    y2 = points[:,1]
+    z2 = points[:,2]
+    w2 = 0.0
+    # q*u
+    tw = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+    tx = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    ty = w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2
+    tz = w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2
+    # (q*u)*q_conjugate
+    cw = w1
+    cx = -x1
+    cy = -y1
+    cz = -z1
+    out = np.empty((len(points),3))
+    out[:,0] = tw * cx + tx * cw + ty * cz - tz * cy
+    out[:,1] = tw * cy + ty * cw + tz * cx - tx * cz
+    out[:,2] = tw * cz + tz * cw + tx * cy - ty * cx
+    return out
+
+def hamilton_product(a,b):
+    """Quaternion product of (N,4) [w,x,y,z] arrays, term for term as Quaternion.__mul__"""
+    w1 = a[:,0]
+    x1 = a[:,1]
+    y1 = a[:,2]
+    z1 = a[:,3]
+    w2 = b[:,0]
+    x2 = b[:,1]
+    y2 = b[:,2]
+    z2 = b[:,3]
+    out = np.empty(np.broadcast(w1,w2).shape+(4,))
+    out[:,0] = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+    out[:,1] = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    out[:,2] = w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2
+    out[:,3] = w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2
+    return out
+
+class Vector3Array(object):
+    """A batch of N vectors stored in one contiguous (N,3) float64 array
+
+    Supports the same operations as Vector3 on every vector at once.
+    The other operand can be a Vector3Array of the same length, a single
+    Vector3 or anything NumPy can broadcast against data. Like np.asarray,
+    a contiguous float64 input array is wrapped without copying.
+    """
+    __slots__ = ('data',)
+    def __init__(self,vals=None):
+        if vals is None:
+            vals = np.zeros((0,3))
+        self.data = np.ascontiguousarray(vals,dtype=np.float64).reshape(-1,3)
+    @staticmethod
+    def from_vectors(vectors):
+        return Vector3Array([[v.x,v.y,v.z] for v in vectors])
+    def to_vectors(self):
+        return [Vector3(v) for v in self.data.tolist()]
+    @staticmethod
+    def operand(u):
+        if isinstance(u,Vector3Array):
+            return u.data
+        if isinstance(u,Vector3):
+            return np.array([u.x,u.y,u.z])
+        return u
+    @property
+    def x(self):
+        return self.data[:,0]
+    @property
+    def y(self):
+        return self.data[:,1]
+    @property
+    def z(self):
+        return self.data[:,2]
+    def __len__(self):
+        return len(self.data)
+    def __getitem__(self,index):
+        if isinstance(index,(int,np.integer)):
+            return Vector3(self.data[index].tolist())
+        return Vector3Array(self.data[index])
+    def __str__(self):
+        return str(self.data)
+    def __add__(self,u):
+        return Vector3Array(self.data + Vector3Array.operand(u))
+    def __radd__(self,u):
+        return self.__add__(u)
+    def __sub__(self,u):
+        return Vector3Array(self.data - Vector3Array.operand(u))
+    def __rsub__(self,u):
+        return Vector3Array(Vector3Array.operand(u) - self.data)
+    def scale(self,s):
+        # s is a scalar or one scale factor per vector
+        return Vector3Array(np.reshape(s,(-1,1))*self.data)
+    def __truediv__(self,s):
+        return Vector3Array(self.data/np.reshape(s,(-1,1)))
+    def normalize(self):
+        self.data /= self.magnitude()[:,None]
+    def magnitude(self):
+        d = self.data
+        return np.sqrt(d[:,0]*d[:,0] + d[:,1]*d[:,1] + d[:,2]*d[:,2])
+    def dot(self,b):
+        b = Vector3Array.operand(b)
+        d = self.data
+        return d[:,0]*b[...,0] + d[:,1]*b[...,1] + d[:,2]*b[...,2]
+    def cross(self,b):
+        b = Vector3Array.operand(b)
+        d = self.data
+        out = np.empty(d.shape)
+        out[:,0] = d[:,1]*b[...,2] - d[:,2]*b[...,1]
+        out[:,1] = d[:,2]*b[...,0] - d[:,0]*b[...,2]
+        out[:,2] = d[:,0]*b[...,1] - d[:,1]*b[...,0]
+        return Vector3Array(out)
+
+class QuaternionArray(object):
+    """A batch of N quaternions stored in one contiguous (N,4) [w,x,y,z] float64 array
+
+    Like Vector3Array, a contiguous float64 input array is wrapped without copying.
+    """
+    __slots__ = ('data',)
+    def __init__(self,vals=None):
+        if vals is None:
+            vals = np.zeros((0,4))
+        self.data = np.ascontiguousarray(vals,dtype=np.float64).reshape(-1,4)
+    @staticmethod
+    def from_quaternions(quats):
+        return QuaternionArray([[q.w,q.x,q.y,q.z] for q in quats])
+    def to_quaternions(self):
+        return [Quaternion(q) for q in self.data.tolist()]
+    @staticmethod
+    def operand(q):
+        if isinstance(q,QuaternionArray):
+            return q.data
+        if isinstance(q,Quaternion):
+            return np.array([[q.w,q.x,q.y,q.z]])
+        return np.reshape(q,(-1,4))
+    def __len__(self):
+        return len(self.data)
+    def __getitem__(self,index):
+        if isinstance(index,(int,np.integer)):
+            return Quaternion(self.data[index].tolist())
+        return QuaternionArray(self.data[index])
+    def __str__(self):
+        return str(self.data)
+    def normalize(self):
+        d = self.data
+        m = np.sqrt(d[:,0]*d[:,0] + d[:,1]*d[:,1] + d[:,2]*d[:,2] + d[:,3]*d[:,3])
+        self.data /= m[:,None]
+    def conjugate(self):
+        q = self.data.copy()
+        q[:,1:] = -q[:,1:]
+        return QuaternionArray(q)
+    def __mul__(self,q):
+        return QuaternionArray(hamilton_product(self.data,QuaternionArray.operand(q)))
+    def __rmul__(self,q):
+        return QuaternionArray(hamilton_product(QuaternionArray.operand(q),self.data))
+    def rotate(self,vectors):
+        """Rotate vector k by quaternion k, or every vector by a single quaternion"""
+        u = Vector3Array.operand(vectors).reshape(-1,3)
+        uq = np.zeros((len(u),4))
+        uq[:,1:] = u
+        q1 = hamilton_product(hamilton_product(self.data,uq),self.conjugate().data)
+        return Vector3Array(q1[:,1:])
+
+def ray_cells(i0,j0,i1,j1,include_end=False):
+    """Grid cells crossed by a batch of rays, Bresenham style
+
+    Rays go from cells (i0,j0) to cells (i1,j1), given as integer arrays
+    (the start may also be a single cell shared by every ray). One cell
+    is visited per step along the major axis of each ray. The end cell
+    is left out unless include_end is True for that ray. Returns the
+    cell indices of all rays concatenated, plus the ray each cell came from.
+    """
+    i1 = np.asarray(i1,dtype=np.int64)
+    j1 = np.asarray(j1,dtype=np.int64)
+    i0 = np.broadcast_to(np.asarray(i0,dtype=np.int64),i1.shape)
+    j0 = np.broadcast_to(np.asarray(j0,dtype=np.int64),i1.shape)
+    di = i1-i0
+    dj = j1-j0
+    steps = np.maximum(np.abs(di),np.abs(dj))
+    counts = steps + np.asarray(include_end,dtype=np.int64)
+    # expand to one entry per visited cell without a python loop
+    ray = np.repeat(np.arange(len(counts)),counts)
+    k = np.arange(len(ray)) - np.repeat(np.cumsum(counts)-counts,counts)
+    # per-step increments along each axis, at most one cell per step
+    step_i = di/np.maximum(steps,1)
+    step_j = dj/np.maximum(steps,1)
+    ci = np.floor(k*step_i[ray] + (i0+0.5)[ray]).astype(np.int64)
+    cj = np.floor(k*step_j[ray] + (j0+0.5)[ray]).astype(np.int64)
+    return ci,cj,ray
 
 class Header(object):
     def __init__(self):
@@ -158,6 +360,19 @@ class OccupancyGrid(object):
         self.info = MapMetaData()
         self.data = np.zeros(shape=(1,1))
         self.height_thresh = 1.0
+        # log-odds occupancy, only used after use_log_odds is called
+        self.log_odds = None
+        self.log_odds_hit = 0.85
+        self.log_odds_miss = -0.4
+        self.log_odds_min = -2.0
+        self.log_odds_max = 3.5
+        self.log_odds_thresh = 0.0
+        # rolling window, only used after use_rolling_window is called.
+        # window_index is the grid index of the lower left cell of the window
+        self.rolling = False
+        self.window_index = [0,0]
+        # planner order copy of a rolling window, reused by local_map
+        self.local_buffer = None
         if dimensions:
             if len(dimensions)==2:
                 self.resize(dimensions[0],dimensions[1])
@@ -165,6 +380,110 @@ class OccupancyGrid(object):
         self.data = np.zeros(shape=(width,height))
         self.info.width = width
         self.info.height = height
+        self.window_index = [0,0]
+        if self.log_odds is not None:
+            self.log_odds = np.zeros(shape=(width,height))
+    def use_log_odds(self,hit=0.85,miss=-0.4,min_log_odds=-2.0,max_log_odds=3.5,thresh=0.0):
+        """Switch the grid to probabilistic log-odds occupancy
+
+        Each lidar return adds hit to the log-odds of the cell it lands in
+        and, when the sensor origin is given, miss to every cell between the
+        sensor and the return. Values are clamped to [min_log_odds,max_log_odds]
+        so cells vacated by moving actors can be cleared again. data still
+        holds 1.0 for cells with log-odds above thresh and 0.0 elsewhere,
+        which is what the planners use.
+        """
+        self.log_odds_hit = hit
+        self.log_odds_miss = miss
+        self.log_odds_min = min_log_odds
+        self.log_odds_max = max_log_odds
+        self.log_odds_thresh = thresh
+        self.log_odds = np.zeros(self.data.shape)
+        self.log_odds[self.data!=0.0] = min(thresh+hit,max_log_odds)
+    def probabilities(self):
+        """Occupancy probability of each cell in log-odds mode"""
+        return 1.0 - 1.0/(1.0+np.exp(self.log_odds))
+    def use_rolling_window(self):
+        """Turn the grid into an ego-centric rolling window
+
+        The data array becomes a ring buffer that only covers the window
+        starting at window_index. Cell (i,j) is stored at
+        data[i%width,j%height], so moving the window with recenter only
+        shifts window_index and clears the newly exposed strips.
+        Grid indices and coordinate_to_index/index_to_coordinate keep
+        using the fixed origin, so indices stay valid as the window moves.
+        Use local_map to get the window in planner order. Incremental
+        planners like dstar_lite.DStarLite keep their search in fixed
+        indices of the map they were made with, and every local index
+        shifts when the window moves, so plan on a rolling window with
+        a planner that starts over each time, like astar.astar.
+        """
+        self.rolling = True
+    def in_window(self,i,j):
+        """True where grid index (i,j) is inside the map, works on arrays too"""
+        wi = self.window_index[0]
+        wj = self.window_index[1]
+        return (i>=wi) & (i<wi+self.info.width) & (j>=wj) & (j<wj+self.info.height)
+    def storage_index(self,i,j):
+        """Index of data that holds grid cell (i,j)"""
+        if self.rolling:
+            return i%self.info.width, j%self.info.height
+        return i,j
+    def recenter(self,x,y):
+        """Scroll a rolling window so the coordinate (x,y) is at its center"""
+        idx = self.coordinate_to_index(x,y)
+        new_i = idx[0]-self.info.width//2
+        new_j = idx[1]-self.info.height//2
+        old_i = self.window_index[0]
+        old_j = self.window_index[1]
+        layers = [self.data]
+        if self.log_odds is not None:
+            layers.append(self.log_odds)
+        # clear the rows and columns that scroll into view
+        rows = self.exposed(old_i,new_i,self.info.width)
+        cols = self.exposed(old_j,new_j,self.info.height)
+        for layer in layers:
+            layer[rows,:] = 0.0
+            layer[:,cols] = 0.0
+        self.window_index = [new_i,new_j]
+    def exposed(self,old,new,size):
+        """Storage rows that come into view when the window start moves from old to new"""
+        shift = new-old
+        if abs(shift)>=size:
+            return np.arange(size)
+        if shift>0:
+            return np.arange(old+size,new+size)%size
+        return np.arange(new,old)%size
+    def local_map(self):
+        """The window with cell (i,j) at [i-window_index[0],j-window_index[1]]
+
+        Without a rolling window this is data itself. With one, the window
+        is copied into a buffer that is kept and overwritten by the next
+        call, so copy the result to keep it.
+        """
+        if not self.rolling:
+            return self.data
+        if self.local_buffer is None or self.local_buffer.shape!=self.data.shape:
+            self.local_buffer = np.empty(self.data.shape,dtype=self.data.dtype)
+        out = self.local_buffer
+        # the window wraps around the ring buffer at storage row a and column b
+        a = self.window_index[0]%self.info.width
+        b = self.window_index[1]%self.info.height
+        ra = self.info.width-a
+        rb = self.info.height-b
+        out[:ra,:rb] = self.data[a:,b:]
+        out[:ra,rb:] = self.data[a:,:b]
+        out[ra:,:rb] = self.data[:a,b:]
+        out[ra:,rb:] = self.data[:a,:b]
+        return out
+    def to_local(self,idx):
+        """Grid index to local_map index, clamped to the window"""
+        i = min(max(idx[0]-self.window_index[0],0),self.info.width-1)
+        j = min(max(idx[1]-self.window_index[1],0),self.info.height-1)
+        return (i,j)
+    def local_path_to_grid(self,path):
+        """local_map index path to grid indices"""
+        return [(p[0]+self.window_index[0],p[1]+self.window_index[1]) for p in path]
     def coordinate_to_index(self,x,y):
         i = math.floor((x-self.info.origin.x)/self.info.resolution)
         j = math.floor((y-self.info.origin.y)/self.info.resolution)
@@ -174,31 +493,144 @@ class OccupancyGrid(object):
         y = iy*self.info.resolution + self.info.origin.y
         return [x,y]
     def index_path_to_coordinates(self,path):
-        path_enu = []
-        for p in path:
-            point_enu = self.index_to_coordinate(p[0],p[1])
-            path_enu.append(point_enu)
-        return path_enu
+        # converts the whole path at once, returns a list of [x,y]
+        if len(path)==0:
+            return []
+        p = np.asarray(path,dtype=np.float64).reshape(-1,2)
+        path_enu = np.empty(p.shape)
+        path_enu[:,0] = p[:,0]*self.info.resolution + self.info.origin.x
+        path_enu[:,1] = p[:,1]*self.info.resolution + self.info.origin.y
+        return path_enu.tolist()
     def set_origin(self,x,y):
         self.info.origin.x = x
         self.info.origin.y = y
-    def add_registered_points(self,points):
+    def add_point_array(self,points,origin=None):
+        """Mark the cells hit by an (N,3) array of registered points in one pass
+
+        Gives the same grid and changed cells as adding the points one at a time.
+        In log-odds mode the scan is passed to update_log_odds instead.
+        """
+        points = np.asarray(points,dtype=np.float64)
+        if points.size==0:
+            return []
+        points = points.reshape(len(points),-1)
+        if self.log_odds is not None:
+            return self.update_log_odds(points,origin)
+        x = points[:,0]
+        y = points[:,1]
+        z = points[:,2]
+        keep = (z>self.height_thresh) & np.isfinite(x) & np.isfinite(y)
+        i = np.floor((x[keep]-self.info.origin.x)/self.info.resolution).astype(np.int64)
+        j = np.floor((y[keep]-self.info.origin.y)/self.info.resolution).astype(np.int64)
+        inside = self.in_window(i,j)
+        i = i[inside]
+        j = j[inside]
+        if len(i)==0:
+            return []
+        si,sj = self.storage_index(i,j)
+        # free cells, in the order they are first hit, are the ones that change
+        _, first = np.unique(si*self.info.height+sj, return_index=True)
+        first = np.sort(first[self.data[si[first],sj[first]]==0.0])
+        changed = list(zip(i[first].tolist(),j[first].tolist()))
+        self.data[si,sj] = 1.0
+        return changed
+    def update_log_odds(self,points,origin=None):
+        """Log-odds update from an (N,3) array of registered points
+
+        Returns the cells whose occupied/free state in data changed.
+        Cells crossed by the ray from origin to each return are marked
+        free, at most once per scan. Returns below height_thresh are
+        treated as ground and clear their own cell as well.
+        """
+        keep = np.isfinite(points).all(axis=1)
+        x = points[keep,0]
+        y = points[keep,1]
+        hit = points[keep,2]>self.height_thresh
+        i = np.floor((x-self.info.origin.x)/self.info.resolution).astype(np.int64)
+        j = np.floor((y-self.info.origin.y)/self.info.resolution).astype(np.int64)
+        width = self.info.width
+        height = self.info.height
+
+        hit_mask = np.zeros(width*height,dtype=bool)
+        inside = hit & self.in_window(i,j)
+        si,sj = self.storage_index(i[inside],j[inside])
+        hit_mask[si*height+sj] = True
+
+        free_mask = np.zeros(width*height,dtype=bool)
+        if origin is not None:
+            oi = math.floor((origin[0]-self.info.origin.x)/self.info.resolution)
+            oj = math.floor((origin[1]-self.info.origin.y)/self.info.resolution)
+            # returns that land in the same cell share a ray, so trace each end cell once
+            imin = i.min() if len(i) else 0
+            jmin = j.min() if len(j) else 0
+            span = (j.max()-jmin+1) if len(j) else 1
+            ends = np.unique(((i-imin)*span+(j-jmin))*2+hit)
+            end_i,end_j = np.divmod(ends>>1,span)
+            ci,cj,ray = ray_cells(oi,oj,end_i+imin,end_j+jmin,include_end=((ends&1)==0))
+            inside = self.in_window(ci,cj)
+            si,sj = self.storage_index(ci[inside],cj[inside])
+            free_mask[si*height+sj] = True
+            free_mask &= ~hit_mask
+
+        free_cells = np.flatnonzero(free_mask)
+        hit_cells = np.flatnonzero(hit_mask)
+        log_odds = self.log_odds.reshape(-1)
+        log_odds[free_cells] = np.maximum(log_odds[free_cells]+self.log_odds_miss,self.log_odds_min)
+        log_odds[hit_cells] = np.minimum(log_odds[hit_cells]+self.log_odds_hit,self.log_odds_max)
+
+        touched = np.concatenate((free_cells,hit_cells))
+        data = self.data.reshape(-1)
+        occupied = log_odds[touched]>self.log_odds_thresh
+        flipped = touched[occupied!=(data[touched]!=0.0)]
+        data[touched] = np.where(occupied,1.0,0.0)
+        si,sj = np.divmod(flipped,height)
+        # storage index back to grid index
+        ci = self.window_index[0] + (si-self.window_index[0])%width
+        cj = self.window_index[1] + (sj-self.window_index[1])%height
+        return list(zip(ci.tolist(),cj.tolist()))
+    def add_registered_points(self,points,origin=None):
+        # returns the list of cells that changed from free to occupied,
+        # or in log-odds mode every cell that changed state.
+        # origin is the sensor position, used to clear cells in log-odds mode
+        if isinstance(points,np.ndarray) or self.log_odds is not None:
+            return self.add_point_array(points,origin)
+        changed = []
         for p in points:
             if p[2]>self.height_thresh:
                 idx = self.coordinate_to_index(p[0],p[1])
-                if idx[0]>=0 and idx[0]<self.info.width and idx[1]>=0 and idx[1]<self.info.height:
-                    self.data[idx[0],idx[1]] = 1.0
+                if self.in_window(idx[0],idx[1]):
+                    si,sj = self.storage_index(idx[0],idx[1])
+                    if self.data[si,sj]==0.0:
+                        changed.append((idx[0],idx[1]))
+                    self.data[si,sj] = 1.0
+        return changed
     def add_points(self,pos,quat,points):
+        # returns the list of cells that changed from free to occupied
+        if isinstance(points,np.ndarray) or self.log_odds is not None:
+            points = np.asarray(points,dtype=np.float64)
+            if points.size==0:
+                return []
+            points = points.reshape(len(points),-1)
+            registered = rotate_points(quat,points)
+            registered[:,0] += pos[0]
+            registered[:,1] += pos[1]
+            registered[:,2] += pos[2]
+            return self.add_point_array(registered,pos)
         q = Quaternion([quat[0],quat[1],quat[2],quat[3]])
         position = Vector3([pos[0],pos[1],pos[2]])
+        changed = []
         for p in points:
             v = Vector3([p[0],p[1],p[2]])
             vprime = q.rotate(v)
             vprime = vprime + position
             if vprime.z>self.height_thresh:
                 idx = self.coordinate_to_index(vprime.x,vprime.y)
-                if idx[0]>=0 and idx[0]<self.info.width and idx[1]>=0 and idx[1]<self.info.height:
-                    self.data[idx[0],idx[1]] = 1.0
+                if self.in_window(idx[0],idx[1]):
+                    si,sj = self.storage_index(idx[0],idx[1])
+                    if self.data[si,sj]==0.0:
+                        changed.append((idx[0],idx[1]))
+                    self.data[si,sj] = 1.0
+        return changed
 
 def Odometry(object):
     def __init__(self):
@@ -0,0 +1,120 @@
+"""Write captured frames to disk in background threads
+
+Saving a labeled frame in sim_example_keystrokes.py used to write a BMP,
+read it back with PIL and encode it to JPEG, all inside the sim loop.
+A CaptureWriter takes the encoding and writing off the loop: the loop
+grabs the sensor data it needs and queues functions that encode and
+save it, which a small pool of threads runs.
+
+The queue is bounded, so memory stays bounded when the disk can't keep
+up. With policy='drop' a frame is skipped when the queue is full, and
+ready() returns False before any work is done for it. With
+policy='block' the loop waits for room instead (back-pressure). The
+counters record how many frames were queued, written and dropped, and
+how long the loop was blocked.
+"""
+import os
+import queue
+import threading
+import time
+from PIL import Image
+
+def save_jpeg(pixels, filename, quality=100):
+    """Encode an image array straight to a JPEG file, without an intermediate BMP"""
+    Image.fromarray(pixels).save(filename, 'JPEG', quality=quality)
+
+def convert_to_jpeg(bmp_filename, jpeg_filename, quality=100):
+    """Re-encode a BMP written by MAVS as a JPEG"""
+    with Image.open(bmp_filename) as img:
+        img.save(jpeg_filename, 'JPEG', quality=quality)
+
+class CaptureWriter(object):
+    """Pool of threads that run queued write functions in order of arrival"""
+    def __init__(self, workers=2, max_pending=8, policy='drop'):
+        if policy not in ['drop', 'block']:
+            raise ValueError('policy must be drop or block, not ' + str(policy))
+        self.policy = policy
+        self.queue = queue.Queue(max_pending)
+        self.lock = threading.Lock()
+        # statistics
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.blocked_time = 0.0
+        self.max_pending = 0
+        self.threads = []
+        for k in range(workers):
+            thread = threading.Thread(target=self.run, name='capture_writer_%d' % k)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def ready(self, writes=1):
+        """True if a frame of this many writes can be queued now, otherwise the frame counts as dropped"""
+        if self.policy == 'block' or self.queue.qsize() + writes <= self.queue.maxsize:
+            return True
+        with self.lock:
+            self.dropped = self.dropped + 1
+        return False
+
+    def put(self, function, *args):
+        """Queue function(*args) to run on a writer thread"""
+        t0 = time.perf_counter()
+        self.queue.put((function, args))
+        with self.lock:
+            self.blocked_time = self.blocked_time + time.perf_counter() - t0
+            self.queued = self.queued + 1
+            self.max_pending = max(self.max_pending, self.queue.qsize())
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            function, args = item
+            try:
+                function(*args)
+                with self.lock:
+                    self.written = self.written + 1
+            except Exception as e:
+                with self.lock:
+                    self.errors = self.errors + 1
+                print('Capture write failed: ' + str(e))
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until everything queued so far has been written"""
+        self.queue.join()
+
+    def close(self):
+        """Write everything still queued and stop the threads"""
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def report(self):
+        return ('Capture writes queued: %d, written: %d, dropped: %d, errors: %d, '
+                'max pending: %d, loop blocked for %.2f s' %
+                (self.queued, self.written, self.dropped, self.errors, self.max_pending, self.blocked_time))
+
+if __name__ == "__main__":
+    # try to write 100 frames of 1920x1080 noise at 100 Hz, faster than
+    # the disk and encoder keep up with, and show the counters
+    import numpy as np
+    output_folder = 'capture_test'
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    pixels = np.random.default_rng(0).integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    for policy in ['drop', 'block']:
+        writer = CaptureWriter(policy=policy)
+        t0 = time.perf_counter()
+        for n in range(100):
+            if writer.ready():
+                writer.put(save_jpeg, pixels.copy(), os.path.join(output_folder, '%d_image.jpg' % n))
+            time.sleep(0.01)
+        writer.close()
+        print(policy + ': ' + writer.report() + ', %.1f s' % (time.perf_counter() - t0))
@@ -0,0 +1,166 @@
+"""Inflated costmap with an incrementally updated distance field
+
+The costmap keeps the distance from every cell of an OccupancyGrid to
+the nearest occupied cell, out to the inflation radius, and turns it
+into a cost array that astar.astar can use to keep paths away from
+obstacles. The distance field is updated with the dynamic brushfire
+algorithm, so when a scan changes a few cells only the cells within the
+inflation radius of those changes are touched, instead of re-inflating
+the whole grid every tick.
+
+Reference: B. Lau, C. Sprunk and W. Burgard, "Improved updating of
+Euclidean distance maps and Voronoi diagrams", IROS 2010.
+"""
+import heapq
+import math
+import numpy as np
+import astar
+
+def full_distance(data, max_distance):
+    """Distance in cells from each cell to the nearest occupied cell, computed from scratch
+
+    Distances larger than max_distance are returned as inf. This is the
+    vectorized whole-grid re-inflation the costmap replaces, kept for
+    comparison.
+    """
+    occupied = (np.asarray(data) != 0)
+    nx, ny = occupied.shape
+    r = int(math.floor(max_distance))
+    dist = np.full(occupied.shape, np.inf)
+    padded = np.zeros((nx + 2*r, ny + 2*r), dtype=bool)
+    padded[r:r+nx, r:r+ny] = occupied
+    for di in range(-r, r+1):
+        for dj in range(-r, r+1):
+            d = math.sqrt(di*di + dj*dj)
+            if d > max_distance:
+                continue
+            shifted = padded[r+di:r+di+nx, r+dj:r+dj+ny]
+            np.minimum(dist, np.where(shifted, d, np.inf), out=dist)
+    return dist
+
+class Costmap(object):
+    """Distance field and inflation cost for an OccupancyGrid
+
+    inflation_radius and robot_radius are in meters. Cells within
+    robot_radius of an obstacle get an infinite cost, which astar.astar
+    treats as blocked. Cost then falls linearly from max_cost to zero at
+    inflation_radius.
+    """
+    def __init__(self, grid, inflation_radius=3.0, robot_radius=0.0, max_cost=10.0):
+        self.grid = grid
+        self.max_distance = inflation_radius/grid.info.resolution
+        self.lethal_distance = robot_radius/grid.info.resolution
+        self.max_cost = max_cost
+        self.rebuild()
+
+    def rebuild(self):
+        """Compute the distance field for the whole grid"""
+        data = np.asarray(self.grid.data)
+        self.shape = data.shape
+        self.stride = data.shape[1] + 2
+        outside = np.ones((data.shape[0] + 2, data.shape[1] + 2), dtype=bool)
+        outside[1:-1, 1:-1] = False
+        self.outside = outside.ravel()
+        n = self.outside.size
+        self.occupied = np.zeros(n, dtype=bool)
+        self.dist = np.full(n, np.inf)
+        self.nearest = np.full(n, -1, dtype=np.int64)
+        self.to_raise = np.zeros(n, dtype=bool)
+        self.queue = []
+        self.touched = []
+        self.offsets = [di*self.stride + dj for di, dj, cost in astar.NEIGHBORS]
+        for i, j in zip(*np.nonzero(data)):
+            self.set_obstacle((i + 1)*self.stride + j + 1)
+        self.process()
+        self.touched = []
+        self.distance = self.dist.reshape(outside.shape)[1:-1, 1:-1].copy()
+        self.cost = self.distance_to_cost(self.distance)
+
+    def distance_to_cost(self, distance):
+        cost = self.max_cost*(1.0 - distance/self.max_distance)
+        cost = np.where(distance > self.max_distance, 0.0, np.maximum(cost, 0.0))
+        if self.lethal_distance > 0.0:
+            cost[distance <= self.lethal_distance] = np.inf
+        return cost
+
+    def update(self, changed_cells):
+        """Update the distance field and cost for a list of (i,j) changed cells
+
+        This is the list returned by OccupancyGrid.add_registered_points.
+        Returns the number of cells whose distance changed.
+        """
+        data = self.grid.data
+        for i, j in changed_cells:
+            s = (i + 1)*self.stride + j + 1
+            occupied = (data[i, j] != 0)
+            if occupied and not self.occupied[s]:
+                self.set_obstacle(s)
+            elif not occupied and self.occupied[s]:
+                self.remove_obstacle(s)
+        self.process()
+        if not self.touched:
+            return 0
+        touched = np.unique(np.array(self.touched, dtype=np.int64))
+        self.touched = []
+        ti, tj = np.divmod(touched, self.stride)
+        self.distance[ti - 1, tj - 1] = self.dist[touched]
+        self.cost[ti - 1, tj - 1] = self.distance_to_cost(self.dist[touched])
+        return len(touched)
+
+    def set_obstacle(self, s):
+        self.occupied[s] = True
+        self.dist[s] = 0.0
+        self.nearest[s] = s
+        self.touched.append(s)
+        heapq.heappush(self.queue, (0.0, s))
+
+    def remove_obstacle(self, s):
+        self.occupied[s] = False
+        self.clear_cell(s)
+        self.to_raise[s] = True
+        heapq.heappush(self.queue, (0.0, s))
+
+    def clear_cell(self, s):
+        self.dist[s] = np.inf
+        self.nearest[s] = -1
+        self.touched.append(s)
+
+    def process(self):
+        while self.queue:
+            d, s = heapq.heappop(self.queue)
+            if self.to_raise[s]:
+                self.raise_cell(s)
+            elif self.nearest[s] >= 0 and self.occupied[self.nearest[s]] and d == self.dist[s]:
+                self.lower_cell(s)
+
+    def raise_cell(self, s):
+        """Clear the neighbors whose nearest obstacle was removed"""
+        for offset in self.offsets:
+            n = s + offset
+            if self.outside[n] or self.nearest[n] < 0 or self.to_raise[n]:
+                continue
+            if not self.occupied[self.nearest[n]]:
+                d = self.dist[n]
+                self.clear_cell(n)
+                self.to_raise[n] = True
+                heapq.heappush(self.queue, (d, n))
+            else:
+                # still valid, let it grow back into the cleared region
+                heapq.heappush(self.queue, (self.dist[n], n))
+        self.to_raise[s] = False
+
+    def lower_cell(self, s):
+        """Offer the nearest obstacle of s to its neighbors"""
+        obstacle = self.nearest[s]
+        oi, oj = divmod(int(obstacle), self.stride)
+        for offset in self.offsets:
+            n = s + offset
+            if self.outside[n] or self.to_raise[n]:
+                continue
+            ni, nj = divmod(n, self.stride)
+            d = math.sqrt((ni - oi)**2 + (nj - oj)**2)
+            if d < self.dist[n] and d <= self.max_distance:
+                self.dist[n] = d
+                self.nearest[n] = obstacle
+                self.touched.append(n)
+                heapq.heappush(self.queue, (d, n))
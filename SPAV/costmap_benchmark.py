@@ -0,0 +1,74 @@
+"""Benchmark incremental costmap updates against full re-inflation
+
+For grids of increasing size, times re-inflating the whole grid with
+costmap.full_distance against costmap.Costmap.update for a small patch
+of new obstacles (and for removing it again). Then, on a fixed grid,
+times updates for patches of increasing size. Incremental updates should
+follow the size of the changed region, not the size of the map.
+
+Run this example:
+python costmap_benchmark.py
+"""
+import sys
+import time
+import numpy as np
+import autonomy
+import costmap
+
+grid_sizes = [250, 500, 1000]
+patch_sizes = [1, 5, 10, 20]
+inflation_radius = 3.0 # meters, at 1 m resolution
+obstacle_density = 0.01
+
+def make_grid(size, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = autonomy.OccupancyGrid([size, size])
+    grid.data[rng.random((size, size)) < obstacle_density] = 1.0
+    return grid
+
+def patch_cells(grid, size):
+    """Cells of a size x size patch in the middle of the grid"""
+    c = grid.info.width//2
+    return [(i, j) for i in range(c, c + size) for j in range(c, c + size)]
+
+def time_patch(grid, cmap, cells):
+    """Time adding and then removing a patch of obstacles"""
+    old = [grid.data[c] for c in cells]
+    for c in cells:
+        grid.data[c] = 1.0
+    t0 = time.perf_counter()
+    touched = cmap.update(cells)
+    add_time = time.perf_counter() - t0
+    for c, v in zip(cells, old):
+        grid.data[c] = v
+    t0 = time.perf_counter()
+    cmap.update(cells)
+    remove_time = time.perf_counter() - t0
+    return add_time, remove_time, touched
+
+if __name__ == "__main__":
+    print('grid     full re-inflation (s)  add 5x5 (s)  remove 5x5 (s)  cells touched')
+    for size in grid_sizes:
+        grid = make_grid(size)
+        cmap = costmap.Costmap(grid, inflation_radius=inflation_radius)
+        t0 = time.perf_counter()
+        costmap.full_distance(grid.data, cmap.max_distance)
+        full_time = time.perf_counter() - t0
+        add_time, remove_time, touched = time_patch(grid, cmap, patch_cells(grid, 5))
+        print('%-8s %21.4f %12.4f %15.4f %14d' % (str(size)+'^2', full_time, add_time, remove_time, touched))
+        sys.stdout.flush()
+
+    size = grid_sizes[-1]
+    grid = make_grid(size)
+    cmap = costmap.Costmap(grid, inflation_radius=inflation_radius)
+    print('')
+    print('patch   add (s)   remove (s)  cells touched   (on a %d^2 grid)' % size)
+    for patch in patch_sizes:
+        add_time, remove_time, touched = time_patch(grid, cmap, patch_cells(grid, patch))
+        print('%-6s %8.4f %11.4f %14d' % (str(patch)+'^2', add_time, remove_time, touched))
+        sys.stdout.flush()
+
+    # the incremental field should match a rebuild from scratch
+    rebuilt = costmap.Costmap(grid, inflation_radius=inflation_radius)
+    print('Incremental distance field matches a rebuild: ' +
+          str(np.array_equal(rebuilt.distance, cmap.distance)))
@@ -0,0 +1,97 @@
+"""Benchmark incremental replanning against planning from scratch
+
+Replays a scripted drive on a synthetic 400x400 grid. Each tick the
+vehicle moves a few cells along its current path and a small patch of
+new obstacles is inserted near the path ahead of it, the way new lidar
+returns show up in sim_example_autonomy.py. The same sequence is
+planned with dstar_lite.DStarLite and with astar.astar from scratch.
+
+Run this example:
+python dstar_benchmark.py
+"""
+import sys
+import time
+import numpy as np
+import astar
+import dstar_lite
+from astar_benchmark import make_test_grid, path_length
+
+grid_size = 400
+num_ticks = 40
+cells_per_tick = 6 # how far the vehicle moves along the path each tick
+patch_size = 3 # width of the obstacle patch added each tick
+look_ahead = 25 # how far ahead on the path the patch is added
+
+def make_events(grid, start, goal, seed=1):
+    """Script the obstacle insertions and vehicle positions for each tick"""
+    rng = np.random.default_rng(seed)
+    grid = grid.copy()
+    events = []
+    position = start
+    for tick in range(num_ticks):
+        path = astar.astar(grid, position, goal)
+        if not path or len(path) <= look_ahead + cells_per_tick:
+            break
+        position = path[cells_per_tick]
+        # block a patch next to the path ahead of the vehicle
+        ci, cj = path[look_ahead + cells_per_tick]
+        ci += int(rng.integers(-1, 2))
+        cj += int(rng.integers(-1, 2))
+        changed = []
+        for i in range(ci, ci + patch_size):
+            for j in range(cj, cj + patch_size):
+                if (i, j) != goal and astar.in_bounds(grid, (i, j)) and grid[i, j] == 0:
+                    grid[i, j] = 1.0
+                    changed.append((i, j))
+        events.append((position, changed))
+    return events
+
+def run_full(grid, goal, events):
+    grid = grid.copy()
+    times = []
+    lengths = []
+    for position, changed in events:
+        for i, j in changed:
+            grid[i, j] = 1.0
+        t0 = time.perf_counter()
+        path = astar.astar(grid, position, goal)
+        times.append(time.perf_counter() - t0)
+        lengths.append(path_length(path) if path else np.inf)
+    return times, lengths
+
+def run_incremental(grid, start, goal, events):
+    grid = grid.copy()
+    t0 = time.perf_counter()
+    planner = dstar_lite.DStarLite(grid, start, goal)
+    planner.replan(start)
+    initial = time.perf_counter() - t0
+    times = []
+    lengths = []
+    expanded = []
+    for position, changed in events:
+        for i, j in changed:
+            grid[i, j] = 1.0
+        t0 = time.perf_counter()
+        path = planner.replan(position, changed)
+        times.append(time.perf_counter() - t0)
+        lengths.append(path_length(path) if path else np.inf)
+        expanded.append(planner.expanded)
+    return initial, times, lengths, expanded
+
+if __name__ == "__main__":
+    grid = make_test_grid(grid_size, density=0.2)
+    start = (0, 0)
+    goal = (grid_size - 1, grid_size - 1)
+    events = make_events(grid, start, goal)
+
+    full_times, full_lengths = run_full(grid, goal, events)
+    initial, inc_times, inc_lengths, expanded = run_incremental(grid, start, goal, events)
+
+    print('tick  changed  astar (s)  dstar (s)  expanded')
+    for k in range(len(events)):
+        print('%4d %8d %10.4f %10.4f %9d' % (k, len(events[k][1]), full_times[k], inc_times[k], expanded[k]))
+    print('D* Lite initial plan: %.4f s' % initial)
+    print('Mean replan: astar %.4f s, dstar %.4f s' % (np.mean(full_times), np.mean(inc_times)))
+    same = np.allclose(full_lengths, inc_lengths)
+    print('Path lengths match: ' + str(same))
+    sys.stdout.flush()
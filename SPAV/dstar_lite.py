@@ -0,0 +1,181 @@
+"""Incremental path planning with D* Lite
+
+D* Lite searches backwards from the goal and keeps its search state
+between calls. When a few cells of the occupancy grid change, only the
+part of the search that depends on those cells is repaired, so the
+cost of a replan depends on how much of the map changed instead of the
+size of the grid.
+
+Reference: S. Koenig and M. Likhachev, "D* Lite", AAAI 2002.
+"""
+import heapq
+import numpy as np
+import astar
+
+class DStarLite(object):
+    """Incremental planner on the same grids and index paths as astar.astar
+
+    Any nonzero cell of the maze is treated as blocked. The maze array is
+    kept by reference, so cells changed in place (for example by
+    OccupancyGrid.add_registered_points) are picked up when they are
+    passed to replan.
+    """
+    def __init__(self, maze, start, goal):
+        self.reset(maze, start, goal)
+
+    def reset(self, maze, start, goal):
+        """Throw away the search state and start over with a new maze and goal"""
+        # Not np.asarray, which would copy a sparse_grid.TiledWindow and
+        # hide cells written to the grid after this call
+        self.maze = maze if hasattr(maze, 'shape') else np.asarray(maze)
+        blocked = astar.padded_blocked(self.maze)
+        self.stride = blocked.shape[1]
+        self.blocked = blocked.ravel()
+        # The padding border is never expanded
+        outside = np.ones(blocked.shape, dtype=bool)
+        outside[1:-1, 1:-1] = False
+        self.outside = outside.ravel()
+
+        n = self.blocked.size
+        self.g = np.full(n, np.inf)
+        self.rhs = np.full(n, np.inf)
+        self.key1 = np.zeros(n)
+        self.key2 = np.zeros(n)
+        self.queued = np.zeros(n, dtype=bool)
+        self.open_list = []
+        self.offsets = [(di*self.stride + dj, cost) for di, dj, cost in astar.NEIGHBORS]
+        self.km = 0.0
+        self.expanded = 0
+
+        self.start = self.to_node(start)
+        self.last = self.start
+        self.goal = self.to_node(goal)
+        self.rhs[self.goal] = 0.0
+        self.push(self.goal)
+
+    def to_node(self, p):
+        return (p[0] + 1)*self.stride + p[1] + 1
+
+    def to_index(self, node):
+        i, j = divmod(node, self.stride)
+        return (i - 1, j - 1)
+
+    def heuristic(self, a, b):
+        ai, aj = divmod(a, self.stride)
+        bi, bj = divmod(b, self.stride)
+        return astar.octile_distance((ai, aj), (bi, bj))
+
+    def calculate_key(self, u):
+        m = min(self.g[u], self.rhs[u])
+        return (m + self.heuristic(self.start, u) + self.km, m)
+
+    def push(self, u):
+        k = self.calculate_key(u)
+        self.key1[u] = k[0]
+        self.key2[u] = k[1]
+        self.queued[u] = True
+        heapq.heappush(self.open_list, (k[0], k[1], u))
+
+    def top_key(self):
+        """Key of the best queued node, dropping stale heap entries"""
+        while self.open_list:
+            k1, k2, u = self.open_list[0]
+            if self.queued[u] and k1 == self.key1[u] and k2 == self.key2[u]:
+                return (k1, k2)
+            heapq.heappop(self.open_list)
+        return (np.inf, np.inf)
+
+    def update_vertex(self, u):
+        if self.outside[u]:
+            return
+        if u != self.goal:
+            # Only entering a blocked cell is forbidden, so a vehicle
+            # sitting on an occupied cell can still plan out of it
+            best = np.inf
+            for offset, cost in self.offsets:
+                s = u + offset
+                if not self.blocked[s]:
+                    c = cost + self.g[s]
+                    if c < best:
+                        best = c
+            self.rhs[u] = best
+        self.queued[u] = False
+        if self.g[u] != self.rhs[u]:
+            self.push(u)
+
+    def compute_shortest_path(self):
+        start = self.start
+        while (self.top_key() < self.calculate_key(start)
+               or self.rhs[start] != self.g[start]):
+            k_old = self.top_key()
+            if k_old[0] == np.inf:
+                break
+            u = heapq.heappop(self.open_list)[2]
+            self.queued[u] = False
+            k_new = self.calculate_key(u)
+            if k_old < k_new:
+                self.push(u)
+            elif self.g[u] > self.rhs[u]:
+                self.g[u] = self.rhs[u]
+                self.expanded += 1
+                for offset, cost in self.offsets:
+                    self.update_vertex(u - offset)
+            else:
+                self.g[u] = np.inf
+                self.expanded += 1
+                self.update_vertex(u)
+                for offset, cost in self.offsets:
+                    self.update_vertex(u - offset)
+
+    def extract_path(self):
+        """Follow the g-values downhill from the start to the goal"""
+        if self.g[self.start] == np.inf:
+            return None
+        path = [self.to_index(self.start)]
+        u = self.start
+        max_steps = self.blocked.size
+        while u != self.goal and len(path) < max_steps:
+            best = np.inf
+            best_node = -1
+            for offset, cost in self.offsets:
+                s = u + offset
+                if not self.blocked[s]:
+                    c = cost + self.g[s]
+                    if c < best:
+                        best = c
+                        best_node = s
+            if best_node < 0 or best == np.inf:
+                return None
+            u = best_node
+            path.append(self.to_index(u))
+        return path
+
+    def replan(self, start, changed_cells=[]):
+        """Returns a path from start to the goal after applying changed cells
+
+        changed_cells is a list of (i,j) grid indices whose value in the
+        maze changed since the last call. Returns None if there is no path.
+        """
+        if not astar.in_bounds(self.maze, start):
+            return None
+        self.expanded = 0
+        start_node = self.to_node(start)
+        if start_node != self.start:
+            self.km += self.heuristic(self.last, start_node)
+            self.last = start_node
+            self.start = start_node
+
+        updated = []
+        for cell in changed_cells:
+            u = self.to_node(cell)
+            is_blocked = (self.maze[cell[0], cell[1]] != 0)
+            if is_blocked != self.blocked[u]:
+                self.blocked[u] = is_blocked
+                updated.append(u)
+        # The edges into a changed cell belong to its neighbors
+        for u in updated:
+            for offset, cost in self.offsets:
+                self.update_vertex(u - offset)
+
+        self.compute_shortest_path()
+        return self.extract_path()
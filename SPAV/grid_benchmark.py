@@ -0,0 +1,82 @@
+"""Benchmark lidar scan insertion into the occupancy grid
+
+Builds synthetic scans the size of a VLP-16 (16 x 1800 returns) and an
+OS1 (64 x 1024 returns) in a scene of random boxes and times the
+per-point, batched and log-odds (with free space ray clearing) insertion
+paths of autonomy.OccupancyGrid. The lidar runs at 10 Hz, so an
+update has 100 ms to finish.
+
+Run this example:
+python grid_benchmark.py
+"""
+import sys
+import time
+import numpy as np
+import autonomy
+
+grid_size = 400
+resolution = 1.0
+max_range = 100.0
+# name, number of channels, returns per channel, vertical field of view in degrees
+lidars = [('VLP-16', 16, 1800, (-15.0, 15.0)),
+          ('OS1', 64, 1024, (-16.6, 16.6))]
+
+def make_scan(channels, samples, fov, origin, seed=0):
+    """Registered points for a spinning lidar at origin
+
+    Rays that go above the horizon end at max_range, the rest hit the ground
+    plane, and a random subset of horizontal directions is blocked by
+    obstacles 5-60 m away.
+    """
+    rng = np.random.default_rng(seed)
+    azimuth = np.linspace(0.0, 2.0*np.pi, samples, endpoint=False)
+    elevation = np.radians(np.linspace(fov[0], fov[1], channels))
+    az, el = np.meshgrid(azimuth, elevation)
+    az = az.ravel()
+    el = el.ravel()
+    dist = np.full(az.shape, max_range)
+    down = el < 0.0
+    dist[down] = np.minimum(origin[2]/np.tan(-el[down]), max_range)
+    # obstacles block whole sectors of azimuth
+    sectors = rng.random(samples) < 0.3
+    obstacle_dist = rng.uniform(5.0, 60.0, samples)
+    blocked = np.tile(sectors, channels)
+    obstacle = np.tile(obstacle_dist, channels)
+    hit_obstacle = blocked & (obstacle < dist)
+    dist[hit_obstacle] = obstacle[hit_obstacle]
+    points = np.empty((len(az), 3))
+    points[:, 0] = origin[0] + dist*np.cos(el)*np.cos(az)
+    points[:, 1] = origin[1] + dist*np.cos(el)*np.sin(az)
+    points[:, 2] = origin[2] + dist*np.sin(el)
+    # obstacle returns are lifted above the height threshold
+    points[hit_obstacle, 2] = np.maximum(points[hit_obstacle, 2], 1.5)
+    return points
+
+def make_grid(log_odds=False):
+    grid = autonomy.OccupancyGrid([grid_size, grid_size])
+    grid.info.resolution = resolution
+    grid.set_origin(-0.5*grid_size*resolution, -0.5*grid_size*resolution)
+    if log_odds:
+        grid.use_log_odds()
+    return grid
+
+def time_call(func, repeats):
+    times = []
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+if __name__ == "__main__":
+    origin = [0.0, 0.0, 2.0]
+    print('lidar     points  per-point (s)  batch (s)  log-odds (s)')
+    for name, channels, samples, fov in lidars:
+        points = make_scan(channels, samples, fov, origin)
+        point_list = points.tolist()
+        per_point = time_call(lambda: make_grid().add_registered_points(point_list), 1)
+        batch = time_call(lambda: make_grid().add_registered_points(points), 5)
+        grid = make_grid(log_odds=True)
+        log_odds = time_call(lambda: grid.add_registered_points(points, origin), 5)
+        print('%-8s %7d %14.4f %10.4f %13.4f' % (name, len(points), per_point, batch, log_odds))
+        sys.stdout.flush()
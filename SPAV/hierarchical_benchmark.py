@@ -0,0 +1,94 @@
+"""Benchmark hierarchical planning against flat A*
+
+Plans on a synthetic 2300x2300 city-like grid at 1 m resolution from a
+fixed start to goals 100 m, 500 m and 2 km away, with
+hierarchical_planner.HierarchicalPlanner and with astar.astar on the
+full grid, and prints the speedup and the path length ratio. Each plan
+is timed repeats times and the fastest time is kept, since single runs
+of the longer plans vary by 50% or more. It also times updating the
+pyramid for a scan's worth of changed cells.
+
+Run this example:
+python hierarchical_benchmark.py
+"""
+import sys
+import time
+import numpy as np
+import astar
+import hierarchical_planner
+from astar_benchmark import path_length
+
+grid_size = 2300
+resolution = 1.0 # meters per cell
+block_size = 80 # cells per city block
+road_width = 12 # cells
+goal_distances = [100.0, 500.0, 2000.0] # meters
+repeats = 3 # times each plan is run, the fastest is reported
+
+def make_city_grid(size, block=block_size, road=road_width, seed=0):
+    """Grid of city blocks with one building each, split by long walls
+
+    Roads run along every multiple of block in both directions, and each
+    wall has two gaps where it crosses a road, so far away goals need
+    long detours.
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.zeros((size, size))
+    for i0 in range(0, size, block):
+        for j0 in range(0, size, block):
+            # building footprint inside the block, leaving a road on each side
+            wi = int(rng.integers(block//3, block - road))
+            wj = int(rng.integers(block//3, block - road))
+            oi = i0 + road//2 + int(rng.integers(0, block - road - wi + 1))
+            oj = j0 + road//2 + int(rng.integers(0, block - road - wj + 1))
+            grid[oi:oi+wi, oj:oj+wj] = 1.0
+    for k in range(size//400):
+        i = int(rng.integers(200, size - 200))
+        grid[i:i+3, :] = 1.0
+        for gap in rng.integers(1, size//block, 2)*block - road//2:
+            grid[i:i+3, gap:gap+road] = 0.0
+    return grid
+
+def best_time(plan, *args):
+    """Fastest of repeats runs of plan(*args), returns (seconds, result)"""
+    best = np.inf
+    for k in range(repeats):
+        t0 = time.perf_counter()
+        result = plan(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def road_index(i):
+    """Nearest cell at or before i that lies on a road"""
+    return (i//block_size)*block_size + 2
+
+if __name__ == "__main__":
+    grid = make_city_grid(grid_size)
+    t0 = time.perf_counter()
+    planner = hierarchical_planner.HierarchicalPlanner(grid)
+    print('Pyramid build: %.3f s' % (time.perf_counter() - t0))
+
+    start = (road_index(160), road_index(400))
+    print('goal (m)   flat A* (s)  hierarchical (s)  speedup  length ratio  top level')
+    for distance in goal_distances:
+        # goals lie diagonally away from the start, on a road
+        offset = int(distance/resolution/np.sqrt(2.0))
+        goal = (start[0] + offset, road_index(start[1] + offset))
+        flat_time, flat = best_time(astar.astar, grid, start, goal)
+        hier_time, path = best_time(planner.plan, start, goal)
+        ratio = path_length(path)/path_length(flat) if (path and flat) else np.nan
+        print('%8.0f %13.3f %17.3f %8.1fx %13.3f %10d' % (distance, flat_time, hier_time,
+                                                          flat_time/hier_time, ratio, planner.top_level))
+        sys.stdout.flush()
+
+    # update the pyramid for a scan's worth of new obstacles
+    rng = np.random.default_rng(2)
+    changed = [tuple(c) for c in rng.integers(0, grid_size, size=(500, 2))]
+    for c in changed:
+        grid[c] = 1.0
+    t0 = time.perf_counter()
+    planner.update(changed)
+    print('Pyramid update for %d changed cells: %.4f s' % (len(changed), time.perf_counter() - t0))
+    rebuilt = hierarchical_planner.HierarchicalPlanner(grid)
+    same = all(np.array_equal(a, b) for a, b in zip(planner.pyramid, rebuilt.pyramid))
+    print('Updated pyramid matches a full rebuild: ' + str(same))
@@ -0,0 +1,147 @@
+"""Hierarchical coarse-to-fine path planning
+
+A full resolution A* to a distant goal explores large numbers of cells
+that a coarse search would rule out right away. HierarchicalPlanner
+keeps a pyramid of downsampled copies of the occupancy grid, where a
+coarse cell is blocked if any of the cells it covers is blocked. It
+searches the coarsest level first and then re-plans each finer level
+only inside a corridor around the coarser path, in the spirit of HPA*.
+
+Because of the any-occupied reduction, coarse levels can close off
+narrow gaps. If the coarse search or a refinement fails, the planner
+starts again from the next finer level, and falls back to a full
+resolution astar.astar search if every level fails.
+"""
+import numpy as np
+import astar
+
+def downsample(blocked, factor):
+    """Any-occupied reduction of a boolean grid by factor in each direction"""
+    nx = -(-blocked.shape[0]//factor)
+    ny = -(-blocked.shape[1]//factor)
+    padded = np.zeros((nx*factor, ny*factor), dtype=bool)
+    padded[:blocked.shape[0], :blocked.shape[1]] = blocked
+    return padded.reshape(nx, factor, ny, factor).any(axis=(1, 3))
+
+class HierarchicalPlanner(object):
+    """Coarse-to-fine planner over the same grids and index paths as astar.astar
+
+    levels is the number of levels in the pyramid including the full
+    resolution grid, and each level is factor times coarser than the one
+    below it. corridor_width is how many coarse cells around the coarse
+    path the finer search may use.
+    """
+    def __init__(self, maze, levels=3, factor=4, corridor_width=1):
+        self.maze = maze
+        self.num_levels = levels
+        self.factor = factor
+        self.corridor_width = corridor_width
+        self.used_fallback = False
+        self.top_level = levels - 1
+        self.build()
+
+    def build(self):
+        """Rebuild the whole pyramid from the maze"""
+        self.pyramid = [np.asarray(self.maze) != 0]
+        for k in range(1, self.num_levels):
+            self.pyramid.append(downsample(self.pyramid[-1], self.factor))
+
+    def update(self, changed_cells):
+        """Update the pyramid for a list of (i,j) cells that changed in the maze
+
+        This is the list returned by OccupancyGrid.add_registered_points.
+        """
+        if len(changed_cells) == 0:
+            return
+        cells = np.asarray(changed_cells, dtype=np.int64).reshape(-1, 2)
+        maze = np.asarray(self.maze)
+        self.pyramid[0][cells[:, 0], cells[:, 1]] = (maze[cells[:, 0], cells[:, 1]] != 0)
+        f = self.factor
+        di, dj = np.meshgrid(np.arange(f), np.arange(f), indexing='ij')
+        di = di.ravel()
+        dj = dj.ravel()
+        for k in range(1, self.num_levels):
+            cells = np.unique(cells//f, axis=0)
+            below = self.pyramid[k-1]
+            # gather the f x f children of every changed parent at once
+            ci = cells[:, 0:1]*f + di
+            cj = cells[:, 1:2]*f + dj
+            inside = (ci < below.shape[0]) & (cj < below.shape[1])
+            children = np.zeros(ci.shape, dtype=bool)
+            children[inside] = below[ci[inside], cj[inside]]
+            self.pyramid[k][cells[:, 0], cells[:, 1]] = children.any(axis=1)
+
+    def scale(self, p, level):
+        s = self.factor**level
+        return (p[0]//s, p[1]//s)
+
+    def corridor(self, path, level):
+        """Cells of level that lie within corridor_width coarse cells of a level+1 path
+
+        Returns the lower corner of the corridor's bounding box and a
+        boolean mask over the box.
+        """
+        f = self.factor
+        w = self.corridor_width
+        coarse_shape = self.pyramid[level+1].shape
+        offsets = np.array([(a, b) for a in range(-w, w+1) for b in range(-w, w+1)])
+        cells = (np.asarray(path)[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+        cells = np.clip(cells, 0, np.array(coarse_shape) - 1)
+        lo = cells.min(axis=0)
+        hi = cells.max(axis=0) + 1
+        coarse_mask = np.zeros(hi - lo, dtype=bool)
+        coarse_mask[cells[:, 0] - lo[0], cells[:, 1] - lo[1]] = True
+        fine_shape = self.pyramid[level].shape
+        corner = lo*f
+        size = (min(hi[0]*f, fine_shape[0]) - corner[0], min(hi[1]*f, fine_shape[1]) - corner[1])
+        mask = np.repeat(np.repeat(coarse_mask, f, axis=0), f, axis=1)[:size[0], :size[1]]
+        return corner, mask
+
+    def search(self, level, start, goal, corridor=None):
+        """A* on one level of the pyramid, optionally inside a corridor"""
+        blocked = self.pyramid[level]
+        corner = (0, 0)
+        if corridor is not None:
+            corner, mask = corridor
+            blocked = blocked[corner[0]:corner[0]+mask.shape[0], corner[1]:corner[1]+mask.shape[1]] | ~mask
+        elif level > 0:
+            blocked = blocked.copy()
+        local_start = (start[0] - corner[0], start[1] - corner[1])
+        local_goal = (goal[0] - corner[0], goal[1] - corner[1])
+        if not astar.in_bounds(blocked, local_start) or not astar.in_bounds(blocked, local_goal):
+            return None
+        if level > 0:
+            # the coarse cells holding the start and goal are usually partly blocked
+            blocked[local_start] = False
+            blocked[local_goal] = False
+        path = astar.astar(blocked, local_start, local_goal)
+        if path is None:
+            return None
+        return [(p[0] + corner[0], p[1] + corner[1]) for p in path]
+
+    def plan_from(self, top, start, goal):
+        """Search level top, then refine down to full resolution"""
+        path = self.search(top, self.scale(start, top), self.scale(goal, top))
+        level = top - 1
+        while path is not None and level >= 0:
+            path = self.search(level, self.scale(start, level), self.scale(goal, level),
+                               self.corridor(path, level))
+            level -= 1
+        return path
+
+    def plan(self, start, goal):
+        """Returns a list of tuples as a path from start to goal, or None
+
+        If a coarse level has no path, the next finer level is tried as
+        the top of the search, and full resolution A* is the last resort.
+        top_level records the level the successful search started from.
+        """
+        self.used_fallback = False
+        for top in range(self.num_levels - 1, 0, -1):
+            path = self.plan_from(top, start, goal)
+            if path is not None:
+                self.top_level = top
+                return path
+        self.used_fallback = True
+        self.top_level = 0
+        return astar.astar(self.pyramid[0], start, goal)
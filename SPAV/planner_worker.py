@@ -0,0 +1,150 @@
+"""Run path planning in a background thread
+
+The sim loop in sim_example_autonomy.py has a fixed time step, and a slow
+replan inline in the loop makes it fall behind real time. A PlannerWorker
+plans on its own thread instead. The loop submits a snapshot of the grid
+with the current start and goal, and on later ticks picks up the newest
+finished path from a mailbox without waiting for it.
+
+Only the newest request is kept. A request that is still waiting when a
+newer one arrives is dropped, and its changed cells are merged into the
+newer request so an incremental planner like dstar_lite.DStarLite does
+not miss any. A request that is already being planned can't be
+interrupted, and a path that is never polled is replaced by the next one.
+
+The search loops hold the GIL, but the MAVS calls in the sim loop are
+ctypes calls that release it, so the sensor and vehicle updates still
+run while the worker plans.
+"""
+import threading
+import time
+import numpy as np
+
+class PlanRequest(object):
+    """Inputs for one plan, stamped with the time it was submitted"""
+    def __init__(self, request_id, maze, start, goal, changed_cells, tag):
+        self.request_id = request_id
+        self.maze = maze
+        self.start = start
+        self.goal = goal
+        self.changed_cells = changed_cells
+        self.tag = tag
+        self.submitted = time.perf_counter()
+
+class PlanResult(object):
+    """A finished plan and its timing
+
+    latency is the time from submitting the request to posting the
+    path, and plan_time the part of it spent planning. tag is the value
+    passed to PlannerWorker.submit.
+    """
+    def __init__(self, request, path, started, error=None):
+        self.request_id = request.request_id
+        self.path = path
+        self.tag = request.tag
+        self.error = error
+        self.submitted = request.submitted
+        self.finished = time.perf_counter()
+        self.latency = self.finished - request.submitted
+        self.plan_time = self.finished - started
+    def age(self, now=None):
+        """Seconds since the grid snapshot this path was planned on was submitted"""
+        if now is None:
+            now = time.perf_counter()
+        return now - self.submitted
+
+class PlannerWorker(object):
+    """Background thread that plans the newest submitted request
+
+    plan is called as plan(maze, start, goal, changed_cells) on the worker
+    thread and returns a path, or None if there is none. Exceptions it
+    raises are passed back to the caller of poll.
+    """
+    def __init__(self, plan):
+        self.plan = plan
+        self.cond = threading.Condition()
+        self.pending = None
+        self.result = None
+        self.last_posted = -1
+        self.next_id = 0
+        self.running = True
+        # statistics
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.latencies = []
+        self.thread = threading.Thread(target=self.run, name='planner_worker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, maze, start, goal, changed_cells=None, tag=None):
+        """Queue a plan on a copy of maze and return its request id
+
+        Replaces any request that has not started yet.
+        """
+        snapshot = np.array(maze, copy=True)
+        changed = list(changed_cells) if changed_cells is not None else []
+        with self.cond:
+            if self.pending is not None:
+                # the waiting request is stale, but keep its changes
+                changed = self.pending.changed_cells + changed
+                self.dropped = self.dropped + 1
+            request = PlanRequest(self.next_id, snapshot, tuple(start), tuple(goal), changed, tag)
+            self.next_id = self.next_id + 1
+            self.submitted = self.submitted + 1
+            self.pending = request
+            self.cond.notify()
+        return request.request_id
+
+    def poll(self):
+        """Take the newest finished result out of the mailbox, or None if there is none"""
+        with self.cond:
+            result = self.result
+            self.result = None
+        if result is not None and result.error is not None:
+            raise result.error
+        return result
+
+    def wait(self, timeout=None):
+        """Block until a result is in the mailbox or nothing is left to plan, then poll"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.result is not None or
+                               (self.pending is None and self.last_posted == self.next_id - 1) or
+                               not self.running, timeout)
+        return self.poll()
+
+    def busy(self):
+        with self.cond:
+            return self.pending is not None or self.last_posted < self.next_id - 1
+
+    def stop(self, timeout=None):
+        """Stop the worker thread after the plan in progress, if any"""
+        with self.cond:
+            self.running = False
+            self.pending = None
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def mean_latency(self):
+        return float(np.mean(self.latencies)) if self.latencies else 0.0
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None or not self.running)
+                if not self.running:
+                    return
+                request = self.pending
+                self.pending = None
+            started = time.perf_counter()
+            try:
+                path = self.plan(request.maze, request.start, request.goal, request.changed_cells)
+                result = PlanResult(request, path, started)
+            except Exception as e:
+                result = PlanResult(request, None, started, error=e)
+            with self.cond:
+                self.last_posted = request.request_id
+                self.result = result
+                self.completed = self.completed + 1
+                self.latencies.append(result.latency)
+                self.cond.notify_all()
@@ -0,0 +1,222 @@
+"""Keep the last few seconds of sensor frames in memory, and save them on a trigger
+
+By the time someone presses a key to capture an interesting event, like
+an actor cutting across the road, the event has already passed. A
+RingRecorder keeps the most recent frames in a ring buffer and, when
+triggered, saves the frames from before the trigger (pre_seconds) and
+the ones recorded after it (post_seconds).
+
+The frame data is a set of channels, each a NumPy array of a fixed
+shape and type, like the camera pixels (360, 640, 3) uint8. Channels
+whose data has a varying number of rows, like lidar points, are given
+the most rows that are kept and store the number of rows of each frame.
+All of the buffers are allocated when the recorder is made, so its
+memory use is fixed and known up front (memory_bytes), and record()
+copies into them without allocating.
+
+When the post-trigger frames are in, the event is copied to a second,
+flush buffer of the same size and a background thread passes each of
+its frames to a save function, while the ring keeps recording. If
+another event finishes while the last one is still being saved, it is
+dropped with policy='drop' or the recording waits for the save to
+finish with policy='block'.
+"""
+import threading
+import time
+import numpy as np
+
+class RingRecorder(object):
+    """Ring buffer of the last frames of a set of channels, saved in the background on a trigger
+
+    channels is a dictionary of channel name to (shape, dtype).
+    save(event, k, t, frame) is called on the writer thread for frame k
+    of an event, where frame is a dictionary of channel name to array,
+    trimmed to the number of rows that were recorded. The arrays are
+    views of the flush buffer, so copy anything that is kept.
+    """
+    def __init__(self, channels, rate, save, pre_seconds=5.0, post_seconds=2.0, policy='drop'):
+        if policy not in ['drop', 'block']:
+            raise ValueError('policy must be drop or block, not ' + str(policy))
+        self.policy = policy
+        self.save = save
+        self.pre_frames = int(round(pre_seconds*rate))
+        self.post_frames = int(round(post_seconds*rate))
+        self.capacity = max(1, self.pre_frames + self.post_frames)
+        self.ring = {}
+        self.flush_buffer = {}
+        self.ring_rows = {}
+        self.flush_rows = {}
+        for name, (shape, dtype) in channels.items():
+            self.ring[name] = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+            self.flush_buffer[name] = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+            self.ring_rows[name] = np.zeros(self.capacity, dtype=np.int64)
+            self.flush_rows[name] = np.zeros(self.capacity, dtype=np.int64)
+        self.ring_times = np.zeros(self.capacity)
+        self.flush_times = np.zeros(self.capacity)
+        self.count = 0 # frames recorded
+        self.event_start = None # first frame of the event being recorded
+        self.post_remaining = 0
+        self.flush_frames = 0
+        self.flush_event = 0
+        # statistics
+        self.events = 0 # handed to the writer thread
+        self.events_saved = 0 # finished by the writer thread
+        self.saved = 0
+        self.dropped = 0
+        self.truncated = 0
+        self.errors = 0
+        self.blocked_time = 0.0
+        # the writer thread saves the flush buffer when pending is set,
+        # and sets idle when it is done with it
+        self.pending = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='ring_recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def memory_bytes(self):
+        """Bytes used by the ring and flush buffers"""
+        total = self.ring_times.nbytes + self.flush_times.nbytes
+        for name in self.ring:
+            total = total + self.ring[name].nbytes + self.flush_buffer[name].nbytes
+            total = total + self.ring_rows[name].nbytes + self.flush_rows[name].nbytes
+        return total
+
+    def recording(self):
+        """True while the frames after a trigger are being recorded"""
+        return self.event_start is not None
+
+    def record(self, t, **values):
+        """Copy a frame into the ring, with one keyword argument per channel"""
+        slot = self.count % self.capacity
+        self.ring_times[slot] = t
+        for name, value in values.items():
+            buf = self.ring[name][slot]
+            if not isinstance(value, np.ndarray):
+                value = np.asarray(value)
+            if value.shape == buf.shape:
+                np.copyto(buf, value, casting='unsafe')
+                rows = len(buf)
+            else:
+                # keep up to the channel's rows and columns
+                rows = min(len(value), len(buf))
+                if len(value) > len(buf):
+                    self.truncated = self.truncated + 1
+                index = (slice(0, rows),) + tuple(slice(0, n) for n in buf.shape[1:])
+                buf[index] = value[index]
+            self.ring_rows[name][slot] = rows
+        self.count = self.count + 1
+        if self.event_start is not None:
+            self.post_remaining = self.post_remaining - 1
+            if self.post_remaining <= 0:
+                self.finish_event()
+
+    def trigger(self):
+        """Start saving an event with the frames already in the ring
+
+        Returns False if an event is already being recorded.
+        """
+        if self.event_start is not None:
+            return False
+        self.event_start = max(0, self.count - self.pre_frames, self.count - self.capacity)
+        self.post_remaining = self.post_frames
+        if self.post_remaining <= 0:
+            self.finish_event()
+        return True
+
+    def finish_event(self):
+        """Copy the event to the flush buffer and hand it to the writer thread"""
+        start = self.event_start
+        self.event_start = None
+        if not self.idle.is_set():
+            if self.policy == 'drop':
+                self.dropped = self.dropped + 1
+                return
+            t0 = time.perf_counter()
+            self.idle.wait()
+            self.blocked_time = self.blocked_time + time.perf_counter() - t0
+        frames = self.count - start
+        # copy oldest first, in at most two pieces of the ring
+        first = start % self.capacity
+        head = min(frames, self.capacity - first)
+        pieces = [(0, first, head), (head, 0, frames - head)]
+        for out, begin, n in pieces:
+            if n <= 0:
+                continue
+            self.flush_times[out:out+n] = self.ring_times[begin:begin+n]
+            for name in self.ring:
+                self.flush_buffer[name][out:out+n] = self.ring[name][begin:begin+n]
+                self.flush_rows[name][out:out+n] = self.ring_rows[name][begin:begin+n]
+        self.flush_frames = frames
+        self.flush_event = self.events
+        self.events = self.events + 1
+        self.idle.clear()
+        self.pending.set()
+
+    def run(self):
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            if not self.running and self.idle.is_set():
+                return
+            for k in range(self.flush_frames):
+                frame = {}
+                for name in self.flush_buffer:
+                    frame[name] = self.flush_buffer[name][k][:self.flush_rows[name][k]]
+                try:
+                    self.save(self.flush_event, k, self.flush_times[k], frame)
+                    self.saved = self.saved + 1
+                except Exception as e:
+                    self.errors = self.errors + 1
+                    print('Event frame save failed: ' + str(e))
+            self.events_saved = self.events_saved + 1
+            self.idle.set()
+
+    def flush(self):
+        """Wait until the last event has been saved"""
+        self.idle.wait()
+
+    def close(self):
+        """Save an event that is still being recorded and stop the writer thread"""
+        if self.event_start is not None:
+            self.finish_event()
+        self.idle.wait()
+        self.running = False
+        self.pending.set()
+        self.thread.join()
+
+    def events_pending(self):
+        """Events triggered but not saved yet, being recorded or being written"""
+        return self.events - self.events_saved + (1 if self.event_start is not None else 0)
+
+    def report(self):
+        return ('Recorder: %.1f MB for %d frames, events saved: %d, pending: %d, dropped: %d, '
+                'frames saved: %d, errors: %d, truncated: %d, loop blocked for %.2f s' %
+                (self.memory_bytes()/1.0e6, self.capacity, self.events_saved, self.events_pending(),
+                 self.dropped, self.saved, self.errors, self.truncated, self.blocked_time))
+
+if __name__ == "__main__":
+    # record 30 s of 10 Hz frames of a counter image and a varying number
+    # of points, trigger twice, and check the saved frames are the right ones
+    saved = []
+    def save(event, k, t, frame):
+        saved.append((event, k, round(t, 3), int(frame['image'][0, 0, 0]), len(frame['points'])))
+    channels = {'image': ((360, 640, 3), np.uint8), 'points': ((28800, 3), np.float32)}
+    recorder = RingRecorder(channels, 10.0, save, pre_seconds=5.0, post_seconds=2.0)
+    print('%.1f MB allocated' % (recorder.memory_bytes()/1.0e6))
+    image = np.zeros((360, 640, 3), dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    t0 = time.perf_counter()
+    for n in range(300):
+        image[:] = n % 256
+        recorder.record(0.1*n, image=image, points=rng.normal(size=(20000 + 100*n, 3)))
+        if n in [30, 200]:
+            recorder.trigger()
+    print('%.2f ms per frame' % (1000.0*(time.perf_counter() - t0)/300))
+    recorder.close()
+    print(recorder.report())
+    for event in range(2):
+        frames = [s for s in saved if s[0] == event]
+        print('event %d: %d frames, images %d to %d' % (event, len(frames), frames[0][3], frames[-1][3]))
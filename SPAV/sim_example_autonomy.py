@@ -3,40 +3,92 @@
 Run this example:
 python sim_example_autonomy.py
 """
-# import the MAVS simulation loader
-from mavs_spav_simulation import MavsSpavSimulation
+# import the MAVS simulation loader, which connects to 
+# a running sim_server.py instead of loading if it can
+import sim_server
 # Import the additional autonomy modules
 import autonomy
 import astar
+import dstar_lite
+import any_angle
+import planner_worker
 # Import some python functions we'll need
 from math import sqrt
-import time
+import os
+import sys
+import numpy as np
+# The simulation scheduler is shared with the examples in PythonExamples
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','PythonExamples'))
+from sim_scheduler import Scheduler
+
+# Set rolling_window to True to use a 200x200 map that follows the
+# vehicle instead of a fixed 400x400 map, for larger scenes. The
+# window's cells move every time it is recentered, which D* Lite's
+# saved search can't follow, so the rolling map is planned with A*
+# from scratch on every update instead of being repaired with D* Lite
+rolling_window = False
+# Set background_planning to False to plan inline in the sim loop
+# instead of on a planner_worker.PlannerWorker thread
+background_planning = True
 
 # Create and occupancy grid and resize it
 grid = autonomy.OccupancyGrid()
-grid.resize(400,400)
+if rolling_window:
+    grid.resize(200,200)
+    grid.use_rolling_window()
+    print('Rolling window map: planning with A* instead of D* Lite')
+else:
+    grid.resize(400,400)
 # Set the resolution (in meters) of the grid
 grid.info.resolution = 1.0
 # Set the origin of the grid (lower left corner)
 grid.set_origin(-200.0,-200.0)
+# Use log-odds occupancy, so cells that moving actors 
+# drive through are cleared again by later scans
+grid.use_log_odds()
+# Offset of the lidar from the vehicle CG, see mavs_spav_simulation.py
+lidar_offset = np.array([[1.0, 0.0, 2.0]])
 # Define the goal point on our map and convert it to a grid index 
 goal_point = [62.75,7.5]
 goal_index = grid.coordinate_to_index(goal_point[0],goal_point[1])
 
 # Create the simulation
-sim = MavsSpavSimulation()
+sim = sim_server.connect_or_load()
+if isinstance(sim,sim_server.SimClient):
+    # the server keeps its state between scripts, so start a new episode
+    sim.reset(position=[10.0,7.5,0.0],heading=0.0,waypoints='spa_city_top_block.vprp')
+
+# Create an incremental planner that keeps its search between replans.
+# It gets its own copy of the grid, which is updated from the snapshot
+# of each request, so it never sees a scan half way through being added
+if not rolling_window:
+    start_index = grid.coordinate_to_index(sim.veh.GetPosition()[0],sim.veh.GetPosition()[1])
+    planner_map = np.array(grid.data)
+    planner = dstar_lite.DStarLite(planner_map,(start_index[0],start_index[1]),(goal_index[0],goal_index[1]))
+
+def plan(maze, start, goal, changed_cells):
+    """Returns a path of grid indices, maze is a copy of grid.data or of grid.local_map()"""
+    if rolling_window:
+        # the map moves with the vehicle, so plan with A* on the window,
+        # see the note on rolling_window above
+        path = astar.astar(maze,start,goal)
+    else:
+        # repair the path through the occupancy grid using D* Lite
+        planner_map[...] = maze
+        path = planner.replan(start,changed_cells)
+    # replace the cell-by-cell staircase with straight segments
+    return any_angle.shortcut_path(maze,path)
+
+if background_planning:
+    worker = planner_worker.PlannerWorker(plan)
+    path_ages = []
 
 # The dist_to_goal value will be used to test completion
 # For now, just set it to a high value to start the simulation
 dist_to_goal = 1000.0
 
-# Start the main simulation loop
-dt = 1.0/30.0 # time step, seconds
-n = 0 # loop counter
-while dist_to_goal > 4.0:
-    # a timing value to be used later
-    tw0 = time.time()
-
+def update_vehicle(t, dt):
+    global dist_to_goal
     # Update the driving command using the controller
     sim.controller.SetCurrentState(sim.veh.GetPosition()[0],sim.veh.GetPosition()[1],
                                    sim.veh.GetSpeed(),sim.veh.GetHeading())
@@ -45,53 +97,99 @@ while dist_to_goal > 4.0:
     # Update the vehicle
     sim.veh.Update(sim.env, dc.throttle, dc.steering, dc.braking, dt)
 
-    # Get the current vehicle position
-    position = sim.veh.GetPosition()
-    orientation = sim.veh.GetOrientation()
-
     # The AdvanceTime method updates the other actors
     sim.env.AdvanceTime(dt)
 
     # Check to see if we've advanced towards our goal
+    position = sim.veh.GetPosition()
     dist_to_goal = sqrt(pow(position[0]-goal_point[0],2)+pow(position[1]-goal_point[1],2))
 
-    # Update the sensors and recalculate the path at 10 Hz
-    if n%3==0 and n>0:
-        # Update and display the drive camera
-        # which is for visualization purposes only.
-        sim.drive_cam.SetPose(position,orientation)
-        sim.drive_cam.Update(sim.env,dt)
-        sim.drive_cam.Display()  
-        
-        # Update and display the lidar, which will be used
-        # by the A* algorithm
-        sim.lidar.SetPose(position,orientation)
-        sim.lidar.Update(sim.env,dt)
-        sim.lidar.Display()    
-
-        # Get lidar point cloud registered to world coordinates
-        registered_points = sim.lidar.GetPoints()
-        # add the points to the grid
-        grid.add_registered_points(registered_points)
-        # determine the grid index of the current vehicle location
-        current_grid_index = grid.coordinate_to_index(position[0],position[1])
-        # calculate a path through the occupancy grid using A*
-        path = astar.astar(grid.data,(current_grid_index[0],current_grid_index[1]),(goal_index[0],goal_index[1]))
-        # if the path is valid, set it as the new path for the controller
-        if path:
-            # first convert it back to ENU coordinates
-            path_enu = grid.index_path_to_coordinates(path)
-            # Update the controller path
-            sim.controller.SetDesiredPath(path_enu)
-
-    # Update the loop counter
-    n = n + 1
-
-    # Check the timing to make sure we don't exceed real-time
-    tw1 = time.time()
-    wall_dt = tw1-tw0
-    if (wall_dt<dt):
-        time.sleep(dt-wall_dt)
+def update_sensors(t, task_dt):
+    # Get the current vehicle position
+    position = sim.veh.GetPosition()
+    orientation = sim.veh.GetOrientation()
+
+    # Update and display the drive camera
+    # which is for visualization purposes only.
+    sim.drive_cam.SetPose(position,orientation)
+    sim.drive_cam.Update(sim.env,dt)
+    sim.drive_cam.Display()  
+    
+    # Update and display the lidar, which will be used
+    # by the A* algorithm
+    sim.lidar.SetPose(position,orientation)
+    sim.lidar.Update(sim.env,dt)
+    sim.lidar.Display()    
+
+    # Get lidar point cloud registered to world coordinates
+    # as an array, so the whole scan is added to the grid at once
+    registered_points = np.array(sim.lidar.GetPoints())
+    # keep the rolling map centered on the vehicle
+    if rolling_window:
+        grid.recenter(position[0],position[1])
+    # the lidar position is used to clear the cells each ray passed through
+    lidar_origin = autonomy.rotate_points(orientation,lidar_offset)[0] + position
+    # add the points to the grid, keeping track of the cells that changed
+    changed_cells = grid.add_registered_points(registered_points,lidar_origin)
+    # determine the grid index of the current vehicle location
+    current_grid_index = grid.coordinate_to_index(position[0],position[1])
+    if rolling_window:
+        # plan on the current window, aiming for the point of the window
+        # closest to the goal, and remember where the window was.
+        # local_map reuses its buffer, which is fine because submit
+        # copies it and inline planning is done before the next call
+        maze = grid.local_map()
+        start = grid.to_local(current_grid_index)
+        goal = grid.to_local(goal_index)
+        offset = list(grid.window_index)
+    else:
+        maze = grid.data
+        start = current_grid_index
+        goal = goal_index
+        offset = [0,0]
+    if background_planning:
+        # hand the request to the worker, it replaces any request still waiting
+        worker.submit(maze,start,goal,changed_cells,tag=offset)
+    else:
+        set_path(plan(maze,start,goal,changed_cells),offset)
+
+def apply_path(t, task_dt):
+    # pick up the newest path from the worker without waiting for it
+    result = worker.poll()
+    if result is not None and result.path:
+        path_ages.append(result.age())
+        # offset is the window index at the time of the request
+        set_path(result.path,result.tag)
+
+def set_path(path, offset):
+    # if the path is valid, set it as the new path for the controller
+    if path:
+        # first convert it back to ENU coordinates
+        path_enu = grid.index_path_to_coordinates([(p[0]+offset[0],p[1]+offset[1]) for p in path])
+        # Update the controller path
+        sim.controller.SetDesiredPath(path_enu)
+
+# Start the main simulation loop
+dt = 1.0/30.0 # time step, seconds
+# The scheduler makes sure we don't exceed real-time
+scheduler = Scheduler(dt, real_time_factor=1.0)
+scheduler.add_task('vehicle', update_vehicle)
+# Update the sensors and recalculate the path at 10 Hz,
+# starting after the first three vehicle steps
+scheduler.add_task('sensors', update_sensors, rate=10.0, offset=3)
+if background_planning:
+    scheduler.add_task('apply_path', apply_path)
+scheduler.run(until=lambda: dist_to_goal <= 4.0)
+print(scheduler.report())
+
+if background_planning:
+    worker.stop()
+    print('Plans requested: %d, completed: %d, dropped as stale: %d' %
+          (worker.submitted,worker.completed,worker.dropped))
+    print('Mean planning latency: %.3f s' % worker.mean_latency())
+    if path_ages:
+        print('Mean path age when applied: %.3f s, max: %.3f s' %
+              (sum(path_ages)/len(path_ages),max(path_ages)))
     
 
 
@@ -6,43 +6,148 @@ python spa_sim_example.py human
 or
 python spa_sim_example.py waypoints
 
-Pressing the 'c' key during the simulation will capture
-the current frame and save a labeled and raw version.
+Holding the 'c' key during the simulation will capture
+frames at the 10 Hz sensor rate and save a labeled and raw
+version of each. The images are encoded and written by
+background threads, and frames are dropped if the disk
+can't keep up, so capturing doesn't slow the sim down.
+
+Frames are saved as separate files in 'output_data', or
+appended to shard files with an index in 'output_shards'
+(see shard_dataset.py in PythonExamples) when 'shards' is
+given after the control mode:
+python spa_sim_example.py waypoints shards
+
+The last few seconds of camera images, lidar points and
+vehicle poses are kept in memory (see ring_recorder.py).
+Pressing 'r' saves them, and the frames of the next few
+seconds, to a folder for the event in 'output_data' or to
+the shards. The frames after 'r' are also captured with
+labels, as when holding 'c'. Set pre_trigger_seconds to 0
+to turn this off, which saves rendering the camera on
+every sensor update.
 """
-# import the MAVS simulation loader
-from mavs_spav_simulation import MavsSpavSimulation
+# import the MAVS simulation loader, which connects to 
+# a running sim_server.py instead of loading if it can
+import sim_server
 # import other python functions
-import time
 import keyboard
 import sys
-from PIL import Image
 import os
+import io
+import numpy as np
+import capture_writer
+from ring_recorder import RingRecorder
+# The simulation scheduler is shared with the examples in PythonExamples
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','PythonExamples'))
+from sim_scheduler import Scheduler
+import pcd_io
+import shard_dataset
 
 # get the control mode (human or waypoints)
 # from the command line
 control_mode = 'human'
 if (len(sys.argv)>1):
     control_mode = sys.argv[1]
+# save frames as 'files' or 'shards'
+output_format = 'files'
+if (len(sys.argv)>2):
+    output_format = sys.argv[2]
 
 # create a folder for the saved data
 output_folder = 'output_data'
 if not os.path.isdir(output_folder):
     os.makedirs(output_folder)
 
+# Environment settings, saved in the shard index with each frame.
+# These are the settings of mavs_spav_simulation.py, and each key
+# calls env.Set<key>, so they can be changed here.
+environment = {'Time': 13, 'Fog': 50.0, 'RainRate': 0.0, 'Wind': [2.5, 1.0]}
+
+# Seconds of frames kept before and saved after pressing 'r'
+pre_trigger_seconds = 5.0
+post_trigger_seconds = 2.0
+# the most lidar points kept per frame, a full VLP-16 scan
+max_lidar_points = 28800
+
+# Writer threads for captured frames, set policy='block' to
+# slow the sim down instead of dropping frames
+writer = capture_writer.CaptureWriter(workers=2, max_pending=8, policy='drop')
+
 # Create the simulation
-sim = MavsSpavSimulation()
+sim = sim_server.connect_or_load()
+if isinstance(sim,sim_server.SimClient):
+    # the server keeps its state between scripts, so start a new episode
+    sim.reset(position=[10.0,7.5,0.0],heading=0.0,waypoints='spa_city_top_block.vprp')
+for key, value in environment.items():
+    getattr(sim.env,'Set'+key)(value)
+
+# Shards for the captured frames, up to 256 MB each
+shards = None
+if output_format=='shards':
+    shards = shard_dataset.ShardWriter('output_shards', max_shard_bytes=256*1024*1024)
 
 # Set display options for the lidar
 # can be 'height', 'color', 'range', 'intensity', 'label', or 'white'
 sim.lidar.SetDisplayColorType("color")
 
-# Start the simulation main loop
-dt = 1.0/30.0 # time step, seconds
-n = 0 # loop counter
-while (True):
-    # tw0 is for timing purposes used later
-    tw0 = time.time()
-
+def save_frame_to_shards(n, pixels, annotated_bmp, labeled_pcd, pose):
+    # Runs on a writer thread: encode the images to jpg in memory,
+    # store the point cloud as binary PCD, and append the frame
+    image = io.BytesIO()
+    capture_writer.save_jpeg(pixels,image)
+    annotated = io.BytesIO()
+    capture_writer.convert_to_jpeg(annotated_bmp,annotated)
+    points = pcd_io.read_pcd(labeled_pcd)
+    shards.add_frame(n, {'image.jpg':image.getvalue(),
+                         'image_annotated.jpg':annotated.getvalue(),
+                         'labeled.pcd':pcd_io.pcd_bytes(points)},
+                     pose=pose, environment=environment)
+    os.remove(annotated_bmp)
+    os.remove(labeled_pcd)
+
+def save_event_frame(event, k, t, frame):
+    # Runs on the recorder thread for each frame of a triggered event
+    step = int(round(t/dt))
+    points = frame['points']
+    cloud = np.zeros(len(points),dtype=[('x','<f4'),('y','<f4'),('z','<f4')])
+    cloud['x'] = points[:,0]
+    cloud['y'] = points[:,1]
+    cloud['z'] = points[:,2]
+    pose = frame['pose']
+    if shards is not None:
+        image = io.BytesIO()
+        capture_writer.save_jpeg(frame['image'],image)
+        shards.add_frame('event%04d_%d' % (event,step), {'image.jpg':image.getvalue(),
+                                                        'points.pcd':pcd_io.pcd_bytes(cloud)},
+                         pose={'position':pose[0:3].tolist(),'orientation':pose[3:7].tolist()},
+                         environment=environment)
+        return
+    event_folder = output_folder+'/event_'+str(event).zfill(4)
+    if not os.path.isdir(event_folder):
+        os.makedirs(event_folder)
+    capture_writer.save_jpeg(frame['image'],event_folder+'/'+str(step)+'_image.jpg')
+    pcd_io.write_pcd(event_folder+'/'+str(step)+'_points.pcd',cloud)
+    with open(event_folder+'/poses.csv','a') as f:
+        f.write('%d,%.4f,' % (step,t) + ','.join('%.6f' % v for v in pose) + '\n')
+
+# Recorder of the last frames, allocated once at a fixed size
+recorder = None
+if pre_trigger_seconds>0.0:
+    # render one camera frame to get the image size
+    sim.cam.SetPose(sim.veh.GetPosition(),sim.veh.GetOrientation())
+    sim.cam.Update(sim.env,0.0)
+    image_shape = np.asarray(sim.cam.GetNumpyArray()).shape
+    channels = {'image':(image_shape,np.uint8),
+                'points':((max_lidar_points,3),np.float32),
+                'pose':((7,),np.float64)}
+    recorder = RingRecorder(channels,10.0,save_event_frame,
+                            pre_seconds=pre_trigger_seconds,post_seconds=post_trigger_seconds)
+    print('Recorder buffers use %.1f MB' % (recorder.memory_bytes()/1.0e6))
+# position and orientation of the frame being recorded
+recorder_pose = np.zeros(7)
+
+def update_vehicle(t, task_dt):
     # Get the driving command, either from the WASD keys or the controller
     if (control_mode=='human'):
         dc = sim.drive_cam.GetDrivingCommand()
@@ -54,67 +159,97 @@ while (True):
     # Update the vehicle with the driving command
     sim.veh.Update(sim.env, dc.throttle, dc.steering, dc.braking, dt)
 
-    # Get the current vehicle position
-    position = sim.veh.GetPosition()
-    orientation = sim.veh.GetOrientation()
-
     # The AdvanceTime method updates the other actors
     sim.env.AdvanceTime(dt)
 
-    # Update the sensors at 10 Hz
-    # Each sensor calls three functions
-    # "SetPose" aligns the sensor with the current vehicle position,
-    # the offset is automatically included.
-    # "Update" creates new sensor data, point cloud or image
-    # "Display" is optional and opens a real-time display window
-    if n%3==0:
-        # Update the camera
-        sim.cam.SetPose(position,orientation)
-        # Update the drive camera
-        sim.drive_cam.SetPose(position,orientation)
-        sim.drive_cam.Update(sim.env,dt)
-        sim.drive_cam.Display()
-        # Update the lidar 
-        sim.lidar.SetPose(position,orientation)
-        sim.lidar.Update(sim.env,dt)
-        sim.lidar.DisplayPerspective()
-
-        # Save labeled data fram when 'c' key is pressed
-        if keyboard.is_pressed('c'):
-            # print feedback that the frame is being saved
-            print('Saving frame ' + str(n))
-            sys.stdout.flush()
-
-            # update the camera sensor
+# Each sensor calls three functions
+# "SetPose" aligns the sensor with the current vehicle position,
+# the offset is automatically included.
+# "Update" creates new sensor data, point cloud or image
+# "Display" is optional and opens a real-time display window
+def update_sensors(t, task_dt):
+    # Get the current vehicle position
+    position = sim.veh.GetPosition()
+    orientation = sim.veh.GetOrientation()
+    # Update the camera
+    sim.cam.SetPose(position,orientation)
+    # Update the drive camera
+    sim.drive_cam.SetPose(position,orientation)
+    sim.drive_cam.Update(sim.env,dt)
+    sim.drive_cam.Display()
+    # Update the lidar 
+    sim.lidar.SetPose(position,orientation)
+    sim.lidar.Update(sim.env,dt)
+    sim.lidar.DisplayPerspective()
+
+    # Keep the frame in the recorder, and save the
+    # recorded frames when 'r' is pressed
+    if recorder is not None:
+        sim.cam.Update(sim.env,dt)
+        recorder_pose[0:3] = position
+        recorder_pose[3:7] = orientation
+        recorder.record(t,image=sim.cam.GetNumpyArray(),points=sim.lidar.GetPoints(),pose=recorder_pose)
+        if keyboard.is_pressed('r') and recorder.trigger():
+            print('Saving the last %.1f s and the next %.1f s' % (pre_trigger_seconds,post_trigger_seconds))
+
+    # Save labeled data frames while the 'c' key is pressed or an event
+    # is being recorded, skipping the frame if the writers are still busy
+    capture = keyboard.is_pressed('c') or (recorder is not None and recorder.recording())
+    if capture and shards is not None and writer.ready():
+        n = scheduler.n
+        if recorder is None:
+            sim.cam.Update(sim.env,dt)
+        pixels = np.array(sim.cam.GetNumpyArray(),dtype=np.uint8)
+        # MAVS can only write the annotated frame and labeled cloud to files,
+        # so write them to temporary files that the writer thread adds to the shard
+        tmp_name = output_folder+'/'+str(n)+'_tmp'
+        sim.cam.SaveAnnotation(sim.env,tmp_name+'_annotated')
+        sim.lidar.AnnotateFrame(sim.env)
+        sim.lidar.SaveLabeledPcd(tmp_name+'_labeled.pcd')
+        pose = {'position':[float(v) for v in position],'orientation':[float(v) for v in orientation]}
+        writer.put(save_frame_to_shards,n,pixels,tmp_name+'_annotated.bmp',tmp_name+'_labeled.pcd',pose)
+    elif capture and shards is None and writer.ready(writes=2):
+        # the frame number is the simulation step
+        n = scheduler.n
+
+        # update the camera sensor, unless it was updated for the recorder
+        if recorder is None:
             sim.cam.Update(sim.env,dt)
 
-            # save the camera data
-            im_name = (output_folder+'/'+str(n)+'_image')
-            sim.cam.SaveCameraImage(im_name+'.bmp')
-
-            # convert it to jpg for later
-            img = Image.open(im_name+'.bmp')
-            img.save(im_name+'.jpg' , 'JPEG', quality=100)
-
-            # save the annotated camera frame
-            # don't include file extension, it's automatically .bmp
-            sim.cam.SaveAnnotation(sim.env,im_name+'_annotated')
-
-            # and convert the annotated from to jpg
-            label_img = Image.open(im_name+'_annotated.bmp')
-            label_img.save(im_name+'_annotated.jpg' , 'JPEG', quality=100)
+        # queue the camera image to be encoded to jpg from memory
+        im_name = (output_folder+'/'+str(n)+'_image')
+        writer.put(capture_writer.save_jpeg,np.array(sim.cam.GetNumpyArray(),dtype=np.uint8),im_name+'.jpg')
 
-            # Save annotated lidar point cloud
-            sim.lidar.AnnotateFrame(sim.env)
-            sim.lidar.SaveLabeledPcd(output_folder+'/'+str(n)+'_labeled.pcd')    
+        # save the annotated camera frame, MAVS can only write it to a file
+        # don't include file extension, it's automatically .bmp
+        sim.cam.SaveAnnotation(sim.env,im_name+'_annotated')
+        # and convert the annotated frame to jpg in the background
+        writer.put(capture_writer.convert_to_jpeg,im_name+'_annotated.bmp',im_name+'_annotated.jpg')
 
-    # Update the loop counter
-    n = n+1
+        # Save annotated lidar point cloud
+        sim.lidar.AnnotateFrame(sim.env)
+        sim.lidar.SaveLabeledPcd(output_folder+'/'+str(n)+'_labeled.pcd')    
 
-    # The following lines ensure that the sim
-    # doesn't run faster than real time, which 
-    # makes it hard to drive
-    tw1 = time.time()
-    wall_dt = tw1-tw0
-    if (wall_dt<dt):
-        time.sleep(dt-wall_dt)
\ No newline at end of file
+# Start the simulation main loop
+dt = 1.0/30.0 # time step, seconds
+# The scheduler makes sure the sim doesn't run 
+# faster than real time, which makes it hard to drive
+scheduler = Scheduler(dt, real_time_factor=1.0)
+scheduler.add_task('vehicle', update_vehicle)
+# Update the sensors at 10 Hz
+scheduler.add_task('sensors', update_sensors, rate=10.0)
+# Drive until the script is stopped with Ctrl-C
+try:
+    scheduler.run()
+except KeyboardInterrupt:
+    pass
+print(scheduler.report())
+# finish writing the captured frames
+if recorder is not None:
+    recorder.close()
+    print(recorder.report())
+writer.close()
+print(writer.report())
+if shards is not None:
+    shards.close()
+    print(shards.report())
@@ -0,0 +1,319 @@
+"""Keep a loaded MAVS simulation running between scripts
+
+Loading the scene, vehicle, actors and sensors in MavsSpavSimulation
+takes 1-2 minutes. Start this server once and leave it running:
+python sim_server.py
+
+Scripts then connect to it in milliseconds with connect_or_load(), which
+returns a SimClient if the server is running and loads the simulation
+locally if it isn't. A SimClient has the same veh, env, lidar, cam,
+drive_cam and controller members as MavsSpavSimulation, so code like
+
+sim.veh.Update(sim.env, dc.throttle, dc.steering, dc.braking, dt)
+
+runs unchanged. Each method call is sent to the server over a local
+socket, and the result is sent back. Results that can't be pickled,
+like the driving command, come back as objects with the same data
+attributes. SimClient.reset starts a new episode, setting the vehicle
+pose, environment and waypoints, without reloading anything. The
+vehicle is moved with SetInitialPosition, which is only known to work
+before it is first driven, so the server checks that it is at rest at
+the new position afterwards and raises an error if it isn't.
+
+The server has its own working directory, so the client makes relative
+file names in the arguments of Save... and Write... methods, like
+SaveCameraImage and SaveLabeledPcd, absolute before it sends them.
+
+Requests are pickled, so anyone who can connect can run code in the
+server. Clients must present a key, read from the MAVS_SIM_AUTHKEY
+environment variable if it is set, otherwise from ~/.mavs_sim_server_key,
+which is created with random contents, readable only by its owner, the
+first time it is needed. Only methods of the members in MEMBERS can be
+called.
+
+The server runs one client at a time, in the order they connect. It
+builds the simulation with any factory function, so it can be run
+against a stand-in for MavsSpavSimulation when MAVS isn't installed.
+"""
+import math
+import os
+import pickle
+import sys
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+# Local address of the server
+ADDRESS = ('localhost', 6010)
+
+# Where the key clients must present comes from, see load_authkey
+AUTHKEY_VARIABLE = 'MAVS_SIM_AUTHKEY'
+AUTHKEY_FILE = os.path.join(os.path.expanduser('~'), '.mavs_sim_server_key')
+
+# Members of MavsSpavSimulation that clients can call methods on
+MEMBERS = ['scene', 'env', 'cam', 'drive_cam', 'lidar', 'veh', 'controller']
+
+# Largest speed (m/s) and distance from the new position (m) after a reset
+RESET_TOLERANCE = 0.01
+
+def load_authkey(key_file=AUTHKEY_FILE):
+    """The key shared by the server and its clients
+
+    Uses the MAVS_SIM_AUTHKEY environment variable if it is set.
+    Otherwise reads key_file, creating it with a random key and
+    owner-only permissions if it doesn't exist, and raises
+    PermissionError if other users can read or write it.
+    """
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if key:
+        return key.encode()
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+    except FileExistsError:
+        pass
+    if os.name == 'posix' and os.stat(key_file).st_mode & 0o077:
+        raise PermissionError(key_file + ' can be used by other users; run chmod 600 ' + key_file)
+    with open(key_file) as f:
+        return f.read().strip().encode()
+
+class Ref(object):
+    """Stands for a member of the simulation in a message"""
+    def __init__(self, name):
+        self.name = name
+
+class Record(object):
+    """The data attributes of an object that can't be pickled"""
+    def __init__(self, attributes):
+        self.__dict__.update(attributes)
+    def __repr__(self):
+        return 'Record(' + ', '.join('%s=%r' % kv for kv in sorted(self.__dict__.items())) + ')'
+
+def to_wire(value):
+    """value if it can be pickled, otherwise a Record of its data attributes"""
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        attributes = {}
+        for name in dir(value):
+            if name.startswith('_'):
+                continue
+            try:
+                attr = getattr(value, name)
+            except Exception:
+                continue
+            if not callable(attr):
+                attributes[name] = to_wire(attr)
+        return Record(attributes)
+
+class SimServer(object):
+    """Serves method calls on a simulation built once by factory()"""
+    def __init__(self, factory, address=ADDRESS, authkey=None):
+        if authkey is None:
+            authkey = load_authkey()
+        t0 = time.time()
+        self.sim = factory()
+        print('Simulation loaded in %.1f s' % (time.time() - t0))
+        sys.stdout.flush()
+        self.listener = Listener(address, authkey=authkey)
+        self.running = True
+        self.calls = 0
+
+    def member(self, name):
+        """The member of the simulation called name, if clients may use it"""
+        if name not in MEMBERS:
+            raise ValueError('Unknown member ' + repr(name))
+        return getattr(self.sim, name)
+
+    def resolve(self, value):
+        if isinstance(value, Ref):
+            return self.member(value.name)
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self.resolve(v) for v in value)
+        return value
+
+    def call(self, name, method, args, kwargs):
+        self.calls = self.calls + 1
+        if method.startswith('_'):
+            raise ValueError('Private method ' + repr(method))
+        function = getattr(self.member(name), method)
+        return function(*self.resolve(args), **kwargs)
+
+    def reset(self, position=None, heading=None, environment=None, waypoints=None, desired_speed=None):
+        """Start a new episode without reloading the scene"""
+        sim = self.sim
+        if environment:
+            # for example {'Time': 13, 'Fog': 50.0} calls env.SetTime(13) and env.SetFog(50.0)
+            for key, value in environment.items():
+                getattr(sim.env, 'Set' + key)(value)
+        if position is not None:
+            sim.veh.SetInitialPosition(position[0], position[1], position[2] if len(position) > 2 else 0.0)
+        if heading is not None:
+            sim.veh.SetInitialHeading(heading)
+        if position is not None or heading is not None:
+            # short update step to move the vehicle to the new pose, as when loading
+            sim.veh.Update(sim.env, 0.0, 0.0, 1.0, 0.000001)
+            self.check_at_rest(position)
+        if waypoints is not None:
+            import mavspy.mavs as mavs
+            path = mavs.MavsWaypoints()
+            path.Load(mavs.mavs_data_path + '/waypoints/' + waypoints)
+            sim.controller.SetDesiredPath(path.GetWaypoints2D())
+        if desired_speed is not None:
+            sim.controller.SetDesiredSpeed(desired_speed)
+
+    def check_at_rest(self, position=None):
+        """Raise RuntimeError if the vehicle is moving or isn't at position after a reset"""
+        veh = self.sim.veh
+        speed = veh.GetSpeed()
+        error = 0.0
+        if position is not None:
+            p = veh.GetPosition()
+            error = math.hypot(p[0] - position[0], p[1] - position[1])
+        if abs(speed) > RESET_TOLERANCE or error > RESET_TOLERANCE:
+            raise RuntimeError('The vehicle is %.3f m from the reset position, moving at %.3f m/s; '
+                               'restart sim_server.py to reload it' % (error, speed))
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == 'call':
+            return self.call(*message[1:])
+        if kind == 'batch':
+            return [self.call(*m) for m in message[1]]
+        if kind == 'reset':
+            return self.reset(**message[1])
+        if kind == 'members':
+            return [name for name in MEMBERS if hasattr(self.sim, name)]
+        if kind == 'shutdown':
+            self.running = False
+            return None
+        raise ValueError('Unknown request ' + str(kind))
+
+    def serve_client(self, conn):
+        while self.running:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ('ok', to_wire(self.handle(message)))
+            except Exception as e:
+                try:
+                    pickle.dumps(e)
+                    error = e
+                except Exception:
+                    error = RuntimeError(repr(e))
+                reply = ('error', error, traceback.format_exc())
+            conn.send(reply)
+
+    def serve_forever(self):
+        print('Serving the simulation on ' + str(self.listener.address))
+        sys.stdout.flush()
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                # a client with the wrong authkey doesn't stop the server
+                print('Refused a client: ' + repr(e))
+                sys.stdout.flush()
+                continue
+            try:
+                self.serve_client(conn)
+            finally:
+                conn.close()
+        self.listener.close()
+
+class RemoteMember(object):
+    """Proxy for a member of the simulation, like sim.veh"""
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+    def __getattr__(self, method):
+        def remote_method(*args, **kwargs):
+            args = absolute_paths(method, args)
+            return self._client.request(('call', self._name, method, to_message(args), kwargs))
+        remote_method.__name__ = method
+        return remote_method
+
+def to_message(value):
+    """Replace proxies in the arguments of a call with references"""
+    if isinstance(value, RemoteMember):
+        return Ref(value._name)
+    if isinstance(value, list):
+        return [to_message(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(to_message(v) for v in value)
+    return value
+
+def absolute_paths(method, args):
+    """args with relative file names made absolute, for methods that write files"""
+    if not (method.startswith('Save') or method.startswith('Write')):
+        return args
+    return tuple(os.path.abspath(a) if isinstance(a, str) else a for a in args)
+
+class SimClient(object):
+    """Drop-in replacement for MavsSpavSimulation that uses a running SimServer"""
+    def __init__(self, address=ADDRESS, authkey=None):
+        if authkey is None:
+            authkey = load_authkey()
+        self.conn = Client(address, authkey=authkey)
+        for name in self.request(('members',)):
+            setattr(self, name, RemoteMember(self, name))
+
+    def request(self, message):
+        self.conn.send(message)
+        reply = self.conn.recv()
+        if reply[0] == 'error':
+            sys.stderr.write(reply[2])
+            raise reply[1]
+        return reply[1]
+
+    def batch(self, calls):
+        """Run a list of (member, method, args) calls in one round trip, returns the results"""
+        return self.request(('batch', [(name, method, to_message(absolute_paths(method, tuple(args))), {})
+                                       for name, method, args in calls]))
+
+    def reset(self, position=None, heading=None, environment=None, waypoints=None, desired_speed=None):
+        """Start a new episode
+
+        position is [x,y] or [x,y,z] and heading is in radians, as for
+        MavsRp3d.SetInitialPosition and SetInitialHeading. environment
+        is a dictionary of MavsEnvironment settings without the 'Set',
+        like {'Time': 13, 'RainRate': 5.0}. waypoints is the name of a
+        file in the MAVS data/waypoints folder for the controller.
+        """
+        self.request(('reset', {'position': position, 'heading': heading, 'environment': environment,
+                                'waypoints': waypoints, 'desired_speed': desired_speed}))
+
+    def shutdown(self):
+        """Stop the server after this client disconnects"""
+        self.request(('shutdown',))
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+def connect_or_load(address=ADDRESS, authkey=None):
+    """A SimClient if a server is running, otherwise a locally loaded MavsSpavSimulation"""
+    try:
+        sim = SimClient(address, authkey)
+        print('Connected to the simulation server at ' + str(address))
+        return sim
+    except (ConnectionRefusedError, OSError, AuthenticationError) as e:
+        from mavs_spav_simulation import MavsSpavSimulation
+        if isinstance(e, AuthenticationError):
+            print('The server at ' + str(address) + ' uses a different authkey, loading the simulation')
+        else:
+            print('No simulation server running, loading the simulation')
+        sys.stdout.flush()
+        return MavsSpavSimulation()
+
+if __name__ == "__main__":
+    from mavs_spav_simulation import MavsSpavSimulation
+    server = SimServer(MavsSpavSimulation)
+    server.serve_forever()
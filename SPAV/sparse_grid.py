@@ -0,0 +1,322 @@
+"""Sparse tiled occupancy grid for large maps
+
+A dense OccupancyGrid allocates every cell of the map up front, which is
+gigabytes for kilometer-scale scenes at useful resolutions. TiledArray
+stores the map in fixed-size square tiles that are only allocated when a
+cell in them is written, and can spill the least recently used tiles to
+a memory-mapped file on disk, paging them back in when they are accessed.
+
+TiledArray supports the indexing OccupancyGrid uses on its data array
+(single cells, integer index arrays and slices), so
+SparseOccupancyGrid.add_registered_points works unchanged.
+
+The planners need a dense array, and np.asarray(grid.data) would copy
+the whole map into one. Plan in a window around the start and goal
+instead: grid.planning_window(start,goal) returns a TiledWindow, which
+astar copies into a dense array of just the window. dstar_lite.DStarLite
+keeps the window and reads the cells passed to replan through it, so it
+sees cells added to the grid after it was made. Convert the changed
+cells and the path with the window's to_window and path_to_grid.
+"""
+import collections
+import os
+import numpy as np
+import autonomy
+
+class TiledArray(object):
+    """2D array made of lazily allocated square tiles
+
+    Unallocated cells read as zero. If max_tiles is set, at most that many
+    tiles are kept in memory and the rest are spilled to spill_path.
+    """
+    def __init__(self,shape,tile_size=64,dtype=np.float64,max_tiles=None,spill_path=None):
+        self.shape = (int(shape[0]),int(shape[1]))
+        self.ndim = 2
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tile_size
+        self.tiles_per_row = (self.shape[1]+tile_size-1)//tile_size
+        # tiles in memory, least recently used first
+        self.tiles = collections.OrderedDict()
+        self.max_tiles = max_tiles
+        self.spill_path = spill_path
+        if max_tiles is not None and spill_path is None:
+            raise ValueError('spill_path is needed when max_tiles is set')
+        # cold tiles on disk, tile key -> slot of the memory mapped file
+        self.spill = None
+        self.spill_slots = {}
+        self.page_ins = 0
+        self.page_outs = 0
+
+    @property
+    def size(self):
+        return self.shape[0]*self.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes of tile memory currently held in RAM"""
+        return len(self.tiles)*self.tile_size*self.tile_size*self.dtype.itemsize
+
+    @property
+    def spilled_nbytes(self):
+        """Bytes of the spill file on disk"""
+        if self.spill is None:
+            return 0
+        return self.spill.nbytes
+
+    def num_tiles(self):
+        """Number of allocated tiles, in memory or on disk"""
+        return len(set(self.tiles.keys()) | set(self.spill_slots.keys()))
+
+    def get_tile(self,key,create):
+        """Tile for key, paged in from disk or allocated if create is True"""
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        if key in self.spill_slots:
+            tile = np.array(self.spill[self.spill_slots[key]])
+            self.page_ins += 1
+        elif create:
+            tile = np.zeros((self.tile_size,self.tile_size),dtype=self.dtype)
+        else:
+            return None
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def evict(self):
+        """Spill least recently used tiles until at most max_tiles are in memory"""
+        if self.max_tiles is None:
+            return
+        while len(self.tiles)>max(self.max_tiles,1):
+            key, tile = self.tiles.popitem(last=False)
+            self.write_spill(key,tile)
+
+    def write_spill(self,key,tile):
+        slot = self.spill_slots.get(key)
+        if slot is None:
+            slot = len(self.spill_slots)
+            self.spill_slots[key] = slot
+            self.grow_spill(slot+1)
+        self.spill[slot] = tile
+        self.page_outs += 1
+
+    def grow_spill(self,slots):
+        """Make sure the spill file has room for at least slots tiles"""
+        capacity = 0 if self.spill is None else self.spill.shape[0]
+        if slots<=capacity:
+            return
+        capacity = max(slots,2*capacity,16)
+        if self.spill is not None:
+            self.spill.flush()
+            del self.spill
+        tile_bytes = self.tile_size*self.tile_size*self.dtype.itemsize
+        with open(self.spill_path,'ab') as f:
+            f.truncate(capacity*tile_bytes)
+        self.spill = np.memmap(self.spill_path,dtype=self.dtype,mode='r+',
+                               shape=(capacity,self.tile_size,self.tile_size))
+
+    def flush(self):
+        """Write every tile in memory to the spill file"""
+        if self.spill_path is None:
+            return
+        for key, tile in self.tiles.items():
+            self.write_spill(key,tile)
+        self.spill.flush()
+
+    def close(self):
+        """Release the spill file and delete it from disk"""
+        if self.spill is not None:
+            del self.spill
+            self.spill = None
+            os.remove(self.spill_path)
+        self.spill_slots = {}
+
+    def tile_keys(self,i,j):
+        ts = self.tile_size
+        return (i//ts)*self.tiles_per_row + j//ts
+
+    def group_by_tile(self,i,j):
+        """Split index arrays by tile, yields (tile key, positions in i and j)"""
+        keys = self.tile_keys(i,j).ravel()
+        order = np.argsort(keys,kind='stable')
+        unique_keys, starts = np.unique(keys[order],return_index=True)
+        ends = np.append(starts[1:],len(order))
+        for key, a, b in zip(unique_keys.tolist(),starts,ends):
+            yield key, order[a:b]
+
+    def block(self,i0,i1,j0,j1):
+        """Dense copy of rows i0:i1 and columns j0:j1"""
+        out = np.zeros((i1-i0,j1-j0),dtype=self.dtype)
+        ts = self.tile_size
+        for ti in range(i0//ts,(i1+ts-1)//ts):
+            for tj in range(j0//ts,(j1+ts-1)//ts):
+                tile = self.get_tile(ti*self.tiles_per_row+tj,False)
+                if tile is None:
+                    continue
+                a0 = max(i0,ti*ts)
+                a1 = min(i1,(ti+1)*ts)
+                b0 = max(j0,tj*ts)
+                b1 = min(j1,(tj+1)*ts)
+                out[a0-i0:a1-i0,b0-j0:b1-j0] = tile[a0-ti*ts:a1-ti*ts,b0-tj*ts:b1-tj*ts]
+        return out
+
+    def set_block(self,i0,j0,values):
+        """Write a dense array of values with its corner at (i0,j0)"""
+        values = np.asarray(values,dtype=self.dtype)
+        i1 = i0+values.shape[0]
+        j1 = j0+values.shape[1]
+        ts = self.tile_size
+        for ti in range(i0//ts,(i1+ts-1)//ts):
+            for tj in range(j0//ts,(j1+ts-1)//ts):
+                a0 = max(i0,ti*ts)
+                a1 = min(i1,(ti+1)*ts)
+                b0 = max(j0,tj*ts)
+                b1 = min(j1,(tj+1)*ts)
+                part = values[a0-i0:a1-i0,b0-j0:b1-j0]
+                tile = self.get_tile(ti*self.tiles_per_row+tj,np.any(part!=0))
+                if tile is not None:
+                    tile[a0-ti*ts:a1-ti*ts,b0-tj*ts:b1-tj*ts] = part
+
+    def slice_bounds(self,index):
+        bounds = []
+        for s, n in zip(index,self.shape):
+            start, stop, step = s.indices(n)
+            if step!=1:
+                raise IndexError('TiledArray slices must have a step of 1')
+            bounds.append((start,max(start,stop)))
+        return bounds
+
+    def __getitem__(self,index):
+        i, j = index
+        if isinstance(i,slice) and isinstance(j,slice):
+            (i0,i1),(j0,j1) = self.slice_bounds(index)
+            return self.block(i0,i1,j0,j1)
+        if np.isscalar(i) and np.isscalar(j):
+            ts = self.tile_size
+            tile = self.get_tile(self.tile_keys(int(i),int(j)),False)
+            if tile is None:
+                return self.dtype.type(0)
+            return tile[i%ts,j%ts]
+        i, j = np.broadcast_arrays(np.asarray(i,dtype=np.int64),np.asarray(j,dtype=np.int64))
+        shape = i.shape
+        out = np.zeros(i.size,dtype=self.dtype)
+        i = i.ravel()
+        j = j.ravel()
+        ts = self.tile_size
+        for key, sel in self.group_by_tile(i,j):
+            tile = self.get_tile(key,False)
+            if tile is not None:
+                out[sel] = tile[i[sel]%ts,j[sel]%ts]
+        return out.reshape(shape)
+
+    def __setitem__(self,index,value):
+        i, j = index
+        if isinstance(i,slice) and isinstance(j,slice):
+            (i0,i1),(j0,j1) = self.slice_bounds(index)
+            self.set_block(i0,j0,np.broadcast_to(value,(i1-i0,j1-j0)))
+            return
+        ts = self.tile_size
+        if np.isscalar(i) and np.isscalar(j):
+            self.get_tile(self.tile_keys(int(i),int(j)),True)[i%ts,j%ts] = value
+            return
+        i, j = np.broadcast_arrays(np.asarray(i,dtype=np.int64),np.asarray(j,dtype=np.int64))
+        value = np.broadcast_to(np.asarray(value,dtype=self.dtype),i.shape).ravel()
+        i = i.ravel()
+        j = j.ravel()
+        for key, sel in self.group_by_tile(i,j):
+            self.get_tile(key,True)[i[sel]%ts,j[sel]%ts] = value[sel]
+
+    def __array__(self,dtype=None,copy=None):
+        out = self.block(0,self.shape[0],0,self.shape[1])
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+class TiledWindow(object):
+    """Rows i0:i1 and columns j0:j1 of a TiledArray, indexed from (0,0)
+
+    Reads and writes go through to the tiles, nothing is copied until
+    np.asarray is called on the window.
+    """
+    def __init__(self,array,i0,i1,j0,j1):
+        self.array = array
+        self.i0 = i0
+        self.j0 = j0
+        self.shape = (i1-i0,j1-j0)
+        self.ndim = 2
+        self.dtype = array.dtype
+
+    @property
+    def size(self):
+        return self.shape[0]*self.shape[1]
+
+    def offset_index(self,index):
+        i, j = index
+        if isinstance(i,slice) and isinstance(j,slice):
+            bounds = []
+            for s, n, o in zip(index,self.shape,(self.i0,self.j0)):
+                start, stop, step = s.indices(n)
+                bounds.append(slice(start+o,max(start,stop)+o,step))
+            return tuple(bounds)
+        return np.add(i,self.i0), np.add(j,self.j0)
+
+    def __getitem__(self,index):
+        return self.array[self.offset_index(index)]
+
+    def __setitem__(self,index,value):
+        self.array[self.offset_index(index)] = value
+
+    def __array__(self,dtype=None,copy=None):
+        out = self.array.block(self.i0,self.i0+self.shape[0],self.j0,self.j0+self.shape[1])
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+    def to_window(self,cells):
+        """Grid cells to window indices, dropping the ones outside the window"""
+        out = []
+        for i, j in cells:
+            wi = i-self.i0
+            wj = j-self.j0
+            if wi>=0 and wi<self.shape[0] and wj>=0 and wj<self.shape[1]:
+                out.append((wi,wj))
+        return out
+
+    def path_to_grid(self,path):
+        """Window index path to grid indices"""
+        if path is None:
+            return None
+        return [(p[0]+self.i0,p[1]+self.j0) for p in path]
+
+class SparseOccupancyGrid(autonomy.OccupancyGrid):
+    """OccupancyGrid whose data is a TiledArray
+
+    Only the default (binary) update mode is supported, the log-odds and
+    rolling window modes need a dense array, so use_log_odds and
+    use_rolling_window raise ValueError. Use an OccupancyGrid for those.
+    """
+    def __init__(self,dimensions=None,tile_size=64,max_tiles=None,spill_path=None):
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.spill_path = spill_path
+        super(SparseOccupancyGrid,self).__init__(dimensions)
+    def resize(self,width,height):
+        if isinstance(self.data,TiledArray):
+            self.data.close()
+        self.data = TiledArray((width,height),self.tile_size,
+                               max_tiles=self.max_tiles,spill_path=self.spill_path)
+        self.info.width = width
+        self.info.height = height
+        self.window_index = [0,0]
+    def planning_window(self,start,goal,margin=64):
+        """TiledWindow around the grid indices start and goal, margin cells wider on every side"""
+        i0 = max(min(start[0],goal[0])-margin,0)
+        i1 = min(max(start[0],goal[0])+margin+1,self.info.width)
+        j0 = max(min(start[1],goal[1])-margin,0)
+        j1 = min(max(start[1],goal[1])+margin+1,self.info.height)
+        return TiledWindow(self.data,i0,max(i0,i1),j0,max(j0,j1))
+    def use_log_odds(self,*args,**kwargs):
+        raise ValueError('log-odds mode is not supported on a SparseOccupancyGrid')
+    def use_rolling_window(self):
+        raise ValueError('rolling window mode is not supported on a SparseOccupancyGrid')
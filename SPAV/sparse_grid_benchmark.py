@@ -0,0 +1,110 @@
+"""Benchmark the memory footprint of a sparse tiled grid on a long traverse
+
+Simulates a vehicle driving a winding 5 km route across a 10 km x 10 km
+map at 0.25 m resolution, adding a synthetic lidar scan every 10 m.
+The dense grid for this map would need width*height*8 bytes, so it is
+only computed, not allocated. The sparse grid is run once with every
+tile in memory and once with at most max_tiles in memory and the rest
+spilled to a memory-mapped file. The spilled grid is then read back tile
+by tile, which pages the tiles back in from the file, and compared with
+the grid that stayed in memory. Last, a path is planned with astar in a
+window of the map around two points of the route.
+
+Run this example:
+python sparse_grid_benchmark.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import astar
+import sparse_grid
+
+map_size = 10000.0 # meters
+resolution = 0.25 # meters
+route_length = 5000.0 # meters
+scan_spacing = 10.0 # meters between scans
+scan_radius = 60.0 # meters
+points_per_scan = 2000
+max_tiles = 256
+spill_path = 'sparse_grid_spill.bin'
+
+def make_route():
+    """Winding route from the middle of the map, sampled every scan_spacing"""
+    s = np.arange(0.0, route_length, scan_spacing)
+    heading = 0.6*np.sin(s/400.0)
+    x = np.cumsum(scan_spacing*np.cos(heading))
+    y = np.cumsum(scan_spacing*np.sin(heading))
+    return np.stack((x - 0.5*route_length, y), axis=1)
+
+def make_scan(position, rng):
+    """Random returns around position, a third of them above the height threshold"""
+    r = scan_radius*np.sqrt(rng.random(points_per_scan))
+    theta = rng.uniform(0.0, 2.0*np.pi, points_per_scan)
+    points = np.empty((points_per_scan, 3))
+    points[:, 0] = position[0] + r*np.cos(theta)
+    points[:, 1] = position[1] + r*np.sin(theta)
+    points[:, 2] = np.where(rng.random(points_per_scan) < 0.33, 2.0, 0.0)
+    return points
+
+def run(max_tiles=None, spill_path=None):
+    cells = int(map_size/resolution)
+    grid = sparse_grid.SparseOccupancyGrid([cells, cells], max_tiles=max_tiles, spill_path=spill_path)
+    grid.info.resolution = resolution
+    grid.set_origin(-0.5*map_size, -0.5*map_size)
+    rng = np.random.default_rng(0)
+    t0 = time.perf_counter()
+    for position in make_route():
+        grid.add_registered_points(make_scan(position, rng))
+    elapsed = time.perf_counter() - t0
+    return grid, elapsed
+
+def read_back(grid, reference):
+    """Compare every tile of grid with the same tile of reference, returns the mismatched tiles"""
+    mismatched = 0
+    for key, tile in reference.data.tiles.items():
+        spilled = grid.data.get_tile(key, False)
+        if spilled is None or not np.array_equal(spilled, tile):
+            mismatched += 1
+    return mismatched
+
+if __name__ == "__main__":
+    cells = int(map_size/resolution)
+    dense_bytes = cells*cells*8
+    print('Map: %d x %d cells, dense grid would be %.2f GB' % (cells, cells, dense_bytes/1e9))
+
+    reference, elapsed = run()
+    print('Sparse, all tiles in memory: %d tiles, %.1f MB in RAM, %.2f s' %
+          (reference.data.num_tiles(), reference.data.nbytes/1e6, elapsed))
+    sys.stdout.flush()
+
+    grid, elapsed = run(max_tiles, spill_path)
+    print('Sparse, at most %d tiles in memory: %d tiles, %.1f MB in RAM, %.1f MB on disk, %d page ins, %.2f s' %
+          (max_tiles, grid.data.num_tiles(), grid.data.nbytes/1e6, grid.data.spilled_nbytes/1e6,
+           grid.data.page_ins, elapsed))
+    sys.stdout.flush()
+
+    page_ins = grid.data.page_ins
+    t0 = time.perf_counter()
+    mismatched = read_back(grid, reference)
+    print('Read back %d tiles: %d page ins, %d tiles differ from the in-memory grid, %.2f s' %
+          (len(reference.data.tiles), grid.data.page_ins - page_ins, mismatched, time.perf_counter() - t0))
+    sys.stdout.flush()
+
+    route = make_route()
+    start = tuple(grid.coordinate_to_index(route[100][0], route[100][1]))
+    goal = tuple(grid.coordinate_to_index(route[110][0], route[110][1]))
+    t0 = time.perf_counter()
+    window = grid.planning_window(start, goal)
+    maze = np.asarray(window)
+    local_start = window.to_window([start])[0]
+    local_goal = window.to_window([goal])[0]
+    # synthetic returns can land on the route itself, so free the goal cell
+    maze[local_goal] = 0.0
+    path = window.path_to_grid(astar.astar(maze, local_start, local_goal))
+    print('Planned %s cells in a %d x %d window (%.1f MB), %.2f s' %
+          ('no path' if path is None else len(path), window.shape[0], window.shape[1],
+           maze.nbytes/1e6, time.perf_counter() - t0))
+    grid.data.close()
+    if os.path.exists(spill_path):
+        os.remove(spill_path)
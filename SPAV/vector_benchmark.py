@@ -0,0 +1,76 @@
+"""Microbenchmarks for the Vector3 and Quaternion types in autonomy.py
+
+Times each operation on N=30000 elements (about one VLP-16 scan), once
+with lists of the scalar Vector3/Quaternion classes and once with
+Vector3Array/QuaternionArray, and reports the memory used by the
+scalar objects.
+
+Run this example:
+python vector_benchmark.py
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import autonomy
+
+num_elements = 30000
+
+def time_call(func, repeats=3):
+    times = []
+    for r in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def normalize_all(vectors):
+    for v in vectors:
+        v.normalize()
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=(num_elements, 3))
+    b = rng.normal(size=(num_elements, 3))
+    qa = rng.normal(size=(num_elements, 4))
+    qb = rng.normal(size=(num_elements, 4))
+    q = autonomy.Quaternion([0.9238795, 0.0, 0.0, 0.3826834])
+
+    va = autonomy.Vector3Array(a)
+    vb = autonomy.Vector3Array(b)
+    qarr = autonomy.QuaternionArray(qa)
+    qbrr = autonomy.QuaternionArray(qb)
+    list_a = va.to_vectors()
+    list_b = vb.to_vectors()
+    list_qa = qarr.to_quaternions()
+    list_qb = qbrr.to_quaternions()
+    # normalize works in place, so it gets its own copies
+    vn = autonomy.Vector3Array(a.copy())
+    list_n = vn.to_vectors()
+
+    tests = [
+        ('add', lambda: [u + v for u, v in zip(list_a, list_b)], lambda: va + vb),
+        ('scale', lambda: [u.scale(2.0) for u in list_a], lambda: va.scale(2.0)),
+        ('dot', lambda: [u.dot(v) for u, v in zip(list_a, list_b)], lambda: va.dot(vb)),
+        ('cross', lambda: [u.cross(v) for u, v in zip(list_a, list_b)], lambda: va.cross(vb)),
+        ('normalize', lambda: normalize_all(list_n), lambda: vn.normalize()),
+        ('quat multiply', lambda: [p*r for p, r in zip(list_qa, list_qb)], lambda: qarr*qbrr),
+        ('quat conjugate', lambda: [p.conjugate() for p in list_qa], lambda: qarr.conjugate()),
+        ('rotate by one quat', lambda: [q.rotate(u) for u in list_a], lambda: q.rotate_array(va)),
+        ('rotate by many quats', lambda: [p.rotate(u) for p, u in zip(list_qa, list_a)], lambda: qarr.rotate(va)),
+    ]
+
+    print('operation              objects (s)   arrays (s)   speedup')
+    for name, scalar, batch in tests:
+        ts = time_call(scalar)
+        tb = time_call(batch)
+        print('%-22s %11.4f %12.5f %9.0fx' % (name, ts, tb, ts/tb))
+        sys.stdout.flush()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    vectors = [autonomy.Vector3([1.0, 2.0, 3.0]) for k in range(num_elements)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('Memory: %d Vector3 objects use %.0f bytes each, a Vector3Array uses %d bytes each' %
+          (num_elements, used/num_elements, va.data.itemsize*3))